@@ -4,23 +4,47 @@ Backend dla kalkulatora "Tani prąd"
 Obsługuje upload faktury PDF lub zdjęcia i ekstraktuje dane do kalkulatora
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, make_response, send_from_directory
 from flask_cors import CORS
-import pytesseract
-from PIL import Image
+import ipaddress
 import os
+import re
+import sqlite3
 import uuid
+from functools import wraps
 from datetime import datetime
 from werkzeug.utils import secure_filename
-from parser_advanced import parse_invoice
+from parser_advanced import PARSER_VERSION, parse_invoice, parse_invoice_text, pool_pids
+from models import PozycjaRozliczenia, Rozliczenie, Oszczednosci, dumps
+import ir_store
+import metrics
+import single_flight
+import stats
+from result_cache import RESULT_DB, ResultCache, ResultStore, files_sha256, normalize_sha256
+import profiling
+from scheduler import LANES, RETRY_AFTER, ClientBusy, LaneBusy, choose_lane
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag', 'X-Request-ID'])
+
+# Pula procesów parsera liczy się do RSS workera (recykling w gunicorn.conf.py)
+metrics.register_child_pids(pool_pids)
 
 # Konfiguracja
 UPLOAD_FOLDER = '/tmp/uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_IMAGE_PAGES = 6  # zdjęcia stron jednej faktury w jednym uploadzie
+
+# Założenia ustawy "Tani prąd" — domyślne parametry kalkulacji oszczędności
+VAT_PO_REFORMIE = 0.05                  # Filar 1: VAT 23% → 5%
+CERTYFIKATY_OSZCZEDNOSC_ROK = 80        # Filar 2: ~80 zł/rok ...
+CERTYFIKATY_ZUZYCIE_ROK = 2200          # ... dla przeciętnego gospodarstwa 2200 kWh/rok
+OBNIZKA_DYSTRYBUCJI = 0.15              # Filar 3: obniżka taryf dystrybucyjnych o ~15%
+OPLATY_DO_ZEROWANIA = ('mocowa', 'oze', 'kogeneracyjna', 'przejściowa')  # Filar 4
+
+# Sweep parametrów — maksymalna liczba scenariuszy w jednej siatce
+MAX_SWEEP_CELLS = 10000
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -29,8 +53,12 @@ from collections import defaultdict
 from threading import Lock
 import time
 
+# Cache wyników analizy (SHA-256 treści pliku -> gotowy JSON); L2 w SQLite, jeśli skonfigurowany
+result_cache = ResultCache(store=ResultStore(RESULT_DB, PARSER_VERSION) if RESULT_DB else None)
+
 rate_limit_data = defaultdict(list)
 rate_limit_lock = Lock()
+BY_HASH_RATE_KEY = 'by-hash:'  # osobny kubełek klienta dla /api/analyze-invoice/by-hash
 
 def check_rate_limit(ip_address, max_requests=10, window_seconds=60):
     """
@@ -54,6 +82,25 @@ def check_rate_limit(ip_address, max_requests=10, window_seconds=60):
         rate_limit_data[ip_address].append(now)
         return True
 
+def resolve_client_ip(remote_addr, real_ip=None):
+    """
+    Klucz klienta (rate limit, kolejka parsowania): adres IP.
+    Za nginx (połączenie z adresu prywatnego / loopback) — nagłówek X-Real-IP ustawiany przez proxy;
+    od klienta z adresu publicznego nagłówek jest ignorowany (nie da się nim podszyć).
+    """
+    try:
+        proxied = ipaddress.ip_address(remote_addr or '').is_private
+    except ValueError:
+        proxied = False
+    if proxied and real_ip:
+        return real_ip.strip()
+    return remote_addr or ''
+
+
+def client_key():
+    return resolve_client_ip(request.remote_addr, request.headers.get('X-Real-IP'))
+
+
 def cleanup_old_files(folder, max_age_seconds=3600):
     """
     Usuwa stare pliki z folderu tymczasowego
@@ -71,13 +118,40 @@ def cleanup_old_files(folder, max_age_seconds=3600):
     except Exception as e:
         print(f"⚠️  Błąd podczas czyszczenia plików: {e}")
 
-# Wyczyść stare pliki przy starcie
-cleanup_old_files(UPLOAD_FOLDER)
+def print_banner():
+    """Wypisuje konfigurację przy starcie (dev server / master gunicorna w trybie preload)"""
+    print("✅ Parser faktur zainicjalizowany (pdfplumber + regex)")
+    print("✅ Rate limiting: 10 requestów / 60 sekund na IP")
+    print("✅ Unikalne nazwy plików (UUID + timestamp)")
+    print("✅ Automatyczne czyszczenie plików (max 1h)")
+
+
+def json_response(payload, status=200):
+    """Odpowiedź JSON przez szybki encoder (models.dumps) — rekordy wyników serializowane bez kopii pośrednich"""
+    return app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+
+def _request_id():
+    """ID requestu: z nagłówka X-Request-ID (np. z nginx) albo nowy UUID"""
+    return clean_request_id(request.headers.get('X-Request-ID', ''))
 
-print("✅ Parser faktur zainicjalizowany (pdfplumber + regex)")
-print("✅ Rate limiting: 10 requestów / 60 sekund na IP")
-print("✅ Unikalne nazwy plików (UUID + timestamp)")
-print("✅ Automatyczne czyszczenie plików (max 1h)")
+
+def clean_request_id(value):
+    request_id = re.sub(r'[^A-Za-z0-9_-]', '', value or '')[:64]
+    return request_id or uuid.uuid4().hex
+
+
+def profiled(view):
+    """Profiluje endpoint: na żądanie (nagłówek X-Profile-Token) lub gdy request jest wolny"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        request_id = _request_id()
+        forced = profiling.token_matches(request.headers.get(profiling.PROFILE_HEADER))
+        with profiling.profile_request(request_id, forced=forced):
+            response = make_response(view(*args, **kwargs))
+        response.headers['X-Request-ID'] = request_id
+        return response
+    return wrapper
 
 
 def allowed_file(filename):
@@ -85,18 +159,27 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def extract_text_from_image(filepath):
-    """Ekstraktuje tekst ze zdjęcia używając OCR (Tesseract)"""
+def extract_text_from_images(filepaths, deadline=None):
+    """Ekstraktuje tekst ze zdjęć stron faktury używając OCR (Tesseract, tylko regiony z tekstem,
+    strony równolegle — ocr.py). Tekst stron w kolejności plików.
+    deadline: termin toru (time.monotonic) — po nim TimeoutError."""
+    # OCR ładowany leniwie — dopiero gdy przyjdzie zdjęcie
+    import ocr
+
     try:
-        image = Image.open(filepath)
-        text = pytesseract.image_to_string(image, lang='pol')
-        return text
+        return ocr.extract_pages_text(filepaths, deadline)
+    except TimeoutError:
+        raise
     except Exception as e:
         print(f"Błąd przy OCR: {e}")
         return None
 
 
-def calculate_savings(invoice_data):
+def calculate_savings(invoice_data, vat_after=VAT_PO_REFORMIE,
+                      obnizka_dystrybucji=OBNIZKA_DYSTRYBUCJI,
+                      certyfikaty_oszczednosc_rok=CERTYFIKATY_OSZCZEDNOSC_ROK,
+                      certyfikaty_zuzycie_rok=CERTYFIKATY_ZUZYCIE_ROK,
+                      oplaty_do_zerowania=OPLATY_DO_ZEROWANIA):
     """
     Oblicza oszczędności na podstawie danych z faktury
     według 4 filarów ustawy "Tani prąd"
@@ -111,60 +194,45 @@ def calculate_savings(invoice_data):
     zuzycie_kwh = invoice_data.get('zuzycie_kwh', 0)
     
     # Filar 4: Zerowanie opłat (mocowa, OZE, kogeneracyjna, przejściowa)
-    oplaty_do_zerowania = ['mocowa', 'oze', 'kogeneracyjna', 'przejściowa']
     filar4_savings = 0
     
     pozycje_after = []
     for pozycja in pozycje:
         nazwa_lower = pozycja['nazwa'].lower()
         zerowana = any(oplata in nazwa_lower for oplata in oplaty_do_zerowania)
-        
-        pozycja_after = {
-            'nazwa': pozycja['nazwa'],
-            'before': pozycja['wartosc_netto'],
-            'after': 0 if zerowana else pozycja['wartosc_netto'],
-            'kategoria': pozycja['kategoria'],
-            'zerowana': zerowana
-        }
+        wartosc_netto = pozycja['wartosc_netto']
         
         if zerowana:
-            filar4_savings += pozycja['wartosc_netto']
+            filar4_savings += wartosc_netto
         
-        pozycje_after.append(pozycja_after)
+        pozycje_after.append(PozycjaRozliczenia(
+            pozycja['nazwa'], pozycja['kategoria'], wartosc_netto,
+            0 if zerowana else wartosc_netto, zerowana
+        ))
     
     # Filar 2: Reforma certyfikatów (~80 zł/rok dla przeciętnego gospodarstwa 2200 kWh/rok)
     # Proporcjonalnie do zużycia
-    przecietne_zuzycie_rok = 2200
-    filar2_oszczednosc_rok = 80
-    
-    if zuzycie_kwh > 0:
-        # Szacujemy roczne zużycie na podstawie okresu faktury
-        # Zakładamy że faktura jest za 1 miesiąc (można to poprawić analizując okres)
-        zuzycie_rok_szacowane = zuzycie_kwh * 12
-        filar2_savings = (zuzycie_rok_szacowane / przecietne_zuzycie_rok) * filar2_oszczednosc_rok / 12
-    else:
-        filar2_savings = 0
+    filar2_savings = _filar2_savings(zuzycie_kwh, certyfikaty_oszczednosc_rok, certyfikaty_zuzycie_rok)
     
     # Filar 3: Obniżka taryf dystrybucyjnych o ~15% (limit WACC do NBP+3pp)
-    suma_dystrybucja = sum(p['after'] for p in pozycje_after if p['kategoria'] == 'dystrybucja')
-    filar3_savings = suma_dystrybucja * 0.15
+    suma_dystrybucja = sum(p.after for p in pozycje_after if p.kategoria == 'dystrybucja')
+    filar3_savings = suma_dystrybucja * obnizka_dystrybucji
     
     # Stosujemy Filar 3 do pozycji dystrybucyjnych
     for pozycja in pozycje_after:
-        if pozycja['kategoria'] == 'dystrybucja':
-            pozycja['after'] = pozycja['after'] * 0.85  # -15%
+        if pozycja.kategoria == 'dystrybucja':
+            pozycja.after = pozycja.after * (1 - obnizka_dystrybucji)
     
     # Odejmujemy Filar 2 od energii czynnej
     for pozycja in pozycje_after:
-        if 'energia czynna' in pozycja['nazwa'].lower():
-            pozycja['after'] = max(0, pozycja['after'] - filar2_savings)
+        if 'energia czynna' in pozycja.nazwa.lower():
+            pozycja.after = max(0, pozycja.after - filar2_savings)
             break
     
     # Suma netto po zmianach
-    suma_netto_after = sum(p['after'] for p in pozycje_after)
+    suma_netto_after = sum(p.after for p in pozycje_after)
     
     # Filar 1: VAT 23% → 5%
-    vat_after = 0.05
     vat_kwota_after = suma_netto_after * vat_after
     suma_brutto_after = suma_netto_after + vat_kwota_after
     
@@ -174,32 +242,31 @@ def calculate_savings(invoice_data):
     total_savings = suma_brutto_before - suma_brutto_after
     savings_percent = (total_savings / suma_brutto_before * 100) if suma_brutto_before > 0 else 0
     
+    # Obie strony porównania współdzielą listę pozycji — słowniki powstają dopiero przy serializacji
     return {
-        'before': {
-            'pozycje': [{'nazwa': p['nazwa'], 'wartosc': p['before'], 'kategoria': p['kategoria']} 
-                       for p in pozycje_after],
-            'suma_netto': round(suma_netto_before, 2),
-            'vat_procent': round(vat_before * 100, 0),
-            'vat_kwota': round(vat_kwota_before, 2),
-            'suma_brutto': round(suma_brutto_before, 2)
-        },
-        'after': {
-            'pozycje': [{'nazwa': p['nazwa'], 'wartosc': p['after'], 'kategoria': p['kategoria'], 
-                        'zerowana': p.get('zerowana', False)} 
-                       for p in pozycje_after],
-            'suma_netto': round(suma_netto_after, 2),
-            'vat_procent': round(vat_after * 100, 0),
-            'vat_kwota': round(vat_kwota_after, 2),
-            'suma_brutto': round(suma_brutto_after, 2)
-        },
-        'savings': {
-            'filar1_vat': round(filar1_savings, 2),
-            'filar2_certyfikaty': round(filar2_savings, 2),
-            'filar3_dystrybucja': round(filar3_savings, 2),
-            'filar4_oplaty': round(filar4_savings, 2),
-            'total': round(total_savings, 2),
-            'percent': round(savings_percent, 1)
-        },
+        'before': Rozliczenie(
+            pozycje_after,
+            round(suma_netto_before, 2),
+            round(vat_before * 100, 0),
+            round(vat_kwota_before, 2),
+            round(suma_brutto_before, 2)
+        ),
+        'after': Rozliczenie(
+            pozycje_after,
+            round(suma_netto_after, 2),
+            round(vat_after * 100, 0),
+            round(vat_kwota_after, 2),
+            round(suma_brutto_after, 2),
+            po_zmianach=True
+        ),
+        'savings': Oszczednosci(
+            round(filar1_savings, 2),
+            round(filar2_savings, 2),
+            round(filar3_savings, 2),
+            round(filar4_savings, 2),
+            round(total_savings, 2),
+            round(savings_percent, 1)
+        ),
         'metadata': {
             'sprzedawca': invoice_data.get('sprzedawca', ''),
             'numer_faktury': invoice_data.get('numer_faktury', ''),
@@ -210,6 +277,113 @@ def calculate_savings(invoice_data):
     }
 
 
+def _filar2_savings(zuzycie_kwh, certyfikaty_oszczednosc_rok, certyfikaty_zuzycie_rok):
+    """Filar 2: miesięczna oszczędność na certyfikatach proporcjonalna do zużycia"""
+    if zuzycie_kwh > 0:
+        # Szacujemy roczne zużycie na podstawie okresu faktury
+        # Zakładamy że faktura jest za 1 miesiąc (można to poprawić analizując okres)
+        zuzycie_rok_szacowane = zuzycie_kwh * 12
+        return (zuzycie_rok_szacowane / certyfikaty_zuzycie_rok) * certyfikaty_oszczednosc_rok / 12
+    return 0
+
+
+def calculate_savings_sweep(invoice_data, vat_values, obnizka_values,
+                            certyfikaty_oszczednosc_rok=CERTYFIKATY_OSZCZEDNOSC_ROK,
+                            certyfikaty_zuzycie_rok=CERTYFIKATY_ZUZYCIE_ROK,
+                            oplaty_do_zerowania=OPLATY_DO_ZEROWANIA):
+    """
+    Siatka scenariuszy (VAT × obniżka dystrybucji) dla jednej sparsowanej faktury.
+
+    Pozycje faktury są redukowane raz do kilku stałych niezależnych od parametrów
+    (suma pozycji bez zmian, suma dystrybucji, energia czynna), a cała siatka
+    to iloczyn zewnętrzny wektora sum netto po obniżce i wektora stawek VAT —
+    wynik identyczny z calculate_savings() dla każdej pary parametrów.
+    Wiersze macierzy odpowiadają vat_values, kolumny obnizka_values (ułamki, np. 0.05).
+    """
+    pozycje = invoice_data.get('pozycje', [])
+    vat_before = invoice_data.get('vat_procent', 23) / 100
+    suma_brutto_before = invoice_data.get('suma_brutto', 0)
+    zuzycie_kwh = invoice_data.get('zuzycie_kwh', 0)
+
+    filar2_savings = _filar2_savings(zuzycie_kwh, certyfikaty_oszczednosc_rok, certyfikaty_zuzycie_rok)
+
+    # Redukcja pozycji do stałych (jedno przejście po fakturze)
+    filar4_savings = 0
+    suma_stala = 0          # pozycje nieobjęte obniżką dystrybucji
+    suma_dystrybucja = 0    # pozycje dystrybucyjne po zerowaniu
+    energia_czynna = None   # (wartość po zerowaniu, czy dystrybucja) — pierwsza pozycja energii czynnej
+    for pozycja in pozycje:
+        nazwa_lower = pozycja['nazwa'].lower()
+        wartosc = pozycja['wartosc_netto']
+        if any(oplata in nazwa_lower for oplata in oplaty_do_zerowania):
+            filar4_savings += wartosc
+            wartosc = 0
+        dystrybucja = pozycja['kategoria'] == 'dystrybucja'
+        if dystrybucja:
+            suma_dystrybucja += wartosc
+        if energia_czynna is None and 'energia czynna' in nazwa_lower:
+            energia_czynna = (wartosc, dystrybucja)
+        elif not dystrybucja:
+            suma_stala += wartosc
+
+    # Wektor po obniżkach dystrybucji: suma netto po zmianach
+    suma_dystrybucja_bez_energii = suma_dystrybucja
+    if energia_czynna is not None and energia_czynna[1]:
+        suma_dystrybucja_bez_energii -= energia_czynna[0]
+    netto_after = []
+    for obnizka in obnizka_values:
+        netto = suma_stala + suma_dystrybucja_bez_energii * (1 - obnizka)
+        if energia_czynna is not None:
+            wartosc, dystrybucja = energia_czynna
+            if dystrybucja:
+                wartosc *= (1 - obnizka)
+            netto += max(0, wartosc - filar2_savings)
+        netto_after.append(netto)
+
+    # Iloczyn zewnętrzny: VAT (wiersze) × obniżka (kolumny)
+    brutto = [[netto * (1 + vat) for netto in netto_after] for vat in vat_values]
+    total = [[suma_brutto_before - b for b in row] for row in brutto]
+    percent = [[(t / suma_brutto_before * 100) if suma_brutto_before > 0 else 0 for t in row] for row in total]
+    filar1 = [[(vat_before - vat) * netto for netto in netto_after] for vat in vat_values]
+
+    return {
+        'vat_procent': [round(v * 100, 2) for v in vat_values],
+        'obnizka_dystrybucji_procent': [round(o * 100, 2) for o in obnizka_values],
+        'suma_brutto_before': round(suma_brutto_before, 2),
+        'suma_netto_after': [round(n, 2) for n in netto_after],
+        'suma_brutto_after': [[round(v, 2) for v in row] for row in brutto],
+        'filar1_vat': [[round(v, 2) for v in row] for row in filar1],
+        'filar2_certyfikaty': round(filar2_savings, 2),
+        'filar3_dystrybucja': [round(suma_dystrybucja * o, 2) for o in obnizka_values],
+        'filar4_oplaty': round(filar4_savings, 2),
+        'total': [[round(v, 2) for v in row] for row in total],
+        'percent': [[round(v, 1) for v in row] for row in percent],
+    }
+
+
+def parse_percent_range(value, default):
+    """
+    Parsuje zakres parametru w procentach: "5:23:1" (start:stop:krok, stop włącznie)
+    lub listę "5,8,23". Zwraca listę ułamków (np. [0.05, 0.06, ...]).
+    """
+    if not value:
+        return [default]
+    value = value.strip()
+    if ':' in value:
+        parts = [float(p) for p in value.split(':')]
+        if len(parts) not in (2, 3):
+            raise ValueError(f'Niepoprawny zakres: {value}')
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) == 3 else 1.0
+        if step <= 0 or stop < start:
+            raise ValueError(f'Niepoprawny zakres: {value}')
+        count = int(round((stop - start) / step)) + 1
+        if count > MAX_SWEEP_CELLS:
+            raise ValueError(f'Zbyt wiele wartości w zakresie: {value}')
+        return [round(start + i * step, 6) / 100 for i in range(count)]
+    return [float(p) / 100 for p in value.split(',') if p.strip()]
+
+
 @app.route('/')
 def index():
     """Strona główna z prostym HTML do testowania"""
@@ -277,148 +451,452 @@ def index():
     """
 
 
-@app.route('/api/analyze-invoice', methods=['POST'])
-def analyze_invoice():
+def _receive_upload(max_files=1):
     """
-    Endpoint do analizy faktury
-    Akceptuje PDF lub zdjęcie, zwraca strukturyzowane dane i wyliczone oszczędności
+    Wspólna walidacja uploadu: rate limit, rozmiar, format.
+    Pole "file" może wystąpić do max_files razy — zdjęcia kolejnych stron jednej faktury.
+    Zwraca (filepaths, file_ext, None) albo (None, None, odpowiedź_błędu).
     """
-    print("📨 Otrzymano request do /api/analyze-invoice")
-    print(f"   Method: {request.method}")
-    print(f"   Content-Type: {request.content_type}")
-    print(f"   Files: {list(request.files.keys())}")
-
     # Rate limiting
-    client_ip = request.remote_addr
+    client_ip = client_key()
     if not check_rate_limit(client_ip):
         print(f"⚠️  Rate limit exceeded for {client_ip}")
-        return jsonify({
+        return None, None, (jsonify({
             'error': 'Zbyt wiele requestów. Spróbuj ponownie za chwilę.',
             'retry_after': 60
-        }), 429
+        }), 429)
 
     # Sprawdź rozmiar pliku
     if request.content_length and request.content_length > MAX_FILE_SIZE:
-        return jsonify({
+        return None, None, (jsonify({
             'error': f'Plik jest za duży. Maksymalny rozmiar to {MAX_FILE_SIZE / 1024 / 1024:.0f} MB'
-        }), 413
+        }), 413)
 
     # Sprawdź czy plik został przesłany
     if 'file' not in request.files:
-        return jsonify({'error': 'Brak pliku'}), 400
+        return None, None, (jsonify({'error': 'Brak pliku'}), 400)
     
-    file = request.files['file']
+    files = request.files.getlist('file')
     
-    if file.filename == '':
-        return jsonify({'error': 'Nie wybrano pliku'}), 400
+    if any(file.filename == '' for file in files):
+        return None, None, (jsonify({'error': 'Nie wybrano pliku'}), 400)
     
-    if not allowed_file(file.filename):
-        return jsonify({'error': 'Niedozwolony format pliku. Użyj PDF, JPG lub PNG'}), 400
-
-    # Generuj unikalną nazwę pliku (UUID + timestamp)
-    original_filename = secure_filename(file.filename)
+    if not all(allowed_file(file.filename) for file in files):
+        return None, None, (jsonify({'error': 'Niedozwolony format pliku. Użyj PDF, JPG lub PNG'}), 400)
+
+    error = check_pages(len(files), [file.filename for file in files], max_files)
+    if error:
+        return None, None, (jsonify(error), 400)
+
+    filepaths = []
+    for file in files:
+        filepath, file_ext = upload_path(file.filename)
+        file.save(filepath)
+        filepaths.append(filepath)
+    return filepaths, file_ext, None
+
+
+def check_pages(count, filenames, max_files):
+    """Kilka plików w jednym uploadzie to tylko zdjęcia stron jednej faktury (max max_files).
+    Zwraca payload błędu albo None."""
+    if count > max_files:
+        if max_files == 1:
+            return {'error': 'Prześlij jeden plik'}
+        return {'error': f'Za dużo plików (max {max_files} zdjęć stron jednej faktury)'}
+    if count > 1 and any(name.rsplit('.', 1)[1].lower() == 'pdf' for name in filenames):
+        return {'error': 'Kilka plików można przesłać tylko jako zdjęcia stron jednej faktury (JPG, PNG)'}
+    return None
+
+
+def upload_path(filename):
+    """Unikalna ścieżka pliku tymczasowego (UUID + timestamp) i rozszerzenie z nazwy od klienta"""
+    original_filename = secure_filename(filename)
     file_ext = original_filename.rsplit('.', 1)[1].lower()
     unique_id = f"{uuid.uuid4().hex}_{int(datetime.now().timestamp() * 1000)}"
-    unique_filename = f"{unique_id}.{file_ext}"
-    filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
+    return os.path.join(UPLOAD_FOLDER, f"{unique_id}.{file_ext}"), file_ext
 
-    file.save(filepath)
-    
-    try:
-        # Parsuj fakturę w zależności od typu pliku
-        invoice_data = None
-        print(f"🔍 Parsowanie pliku: {unique_filename}")
-
-        if file_ext == 'pdf':
-            # Parsuj PDF używając zaawansowanego parsera
-            try:
-                invoice_data = parse_invoice(filepath)
-                print(f"✅ Faktura sparsowana: {invoice_data.get('numer_faktury', 'brak')}")
-            except Exception as e:
-                print(f"❌ Błąd parsowania PDF: {e}")
-                import traceback
-                traceback.print_exc()
-                return jsonify({
-                    'error': 'Nie udało się sparsować faktury PDF',
-                    'details': str(e)
-                }), 500
-        else:
-            # Dla obrazów użyj OCR
-            text = extract_text_from_image(filepath)
-            if not text:
-                return jsonify({'error': 'Nie udało się wyekstraktować tekstu z obrazu'}), 500
-
-            # TODO: Dodać parser dla obrazów
-            return jsonify({
-                'error': 'Parsowanie obrazów nie jest jeszcze zaimplementowane',
+
+def remove_upload(filepaths):
+    """Usuwa pliki tymczasowe uploadu i co jakiś czas czyści stare pliki"""
+    for filepath in filepaths:
+        try:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except Exception as e:
+            print(f"⚠️  Nie udało się usunąć pliku {filepath}: {e}")
+
+    # Wyczyść stare pliki co jakiś czas
+    import random
+    if random.random() < 0.1:  # 10% szans przy każdym requeście
+        cleanup_old_files(UPLOAD_FOLDER)
+
+
+def build_result(invoice_data):
+    """Buduje odpowiedź API z danych faktury: prognoza albo pełne obliczenie oszczędności"""
+    # Sprawdź typ dokumentu
+    typ_dokumentu = invoice_data.get('typ_dokumentu', 'faktura_rozliczeniowa')
+
+    if typ_dokumentu == 'prognoza':
+        # Prognoza: zwróć dane prognozy z informacją, że potrzebna jest faktura
+        print(f"📊 Wykryto prognozę: {invoice_data.get('numer_dokumentu_prognozowego', 'brak')}")
+        return {
+            'typ_dokumentu': 'prognoza',
+            'dane_prognozy': {
+                'sprzedawca': invoice_data.get('sprzedawca', ''),
+                'numer_dokumentu_prognozowego': invoice_data.get('numer_dokumentu_prognozowego', ''),
+                'numer_klienta': invoice_data.get('numer_klienta', ''),
+                'okres_rozliczeniowy': invoice_data.get('okres_rozliczeniowy', ''),
+                'zuzycie_kwh': invoice_data.get('zuzycie_kwh', 0),
+                'suma_netto': invoice_data.get('suma_netto', 0),
+                'suma_brutto': invoice_data.get('suma_brutto', 0),
+                'pozycje': invoice_data.get('pozycje', []),
+            },
+            'uwaga': invoice_data.get('uwaga', ''),
+            'info': 'Przesłany dokument to prognoza zużycia energii, nie faktura rozliczeniowa. '
+                    'Prognoza zawiera jedynie szacunkowe kwoty za sprzedaż i dystrybucję bez '
+                    'szczegółowego rozbicia na składniki (opłata sieciowa, OZE, kogeneracyjna, mocowa itd.). '
+                    'Aby obliczyć dokładne oszczędności z ustawy „Tani prąd", prześlij fakturę '
+                    'rozliczeniową — znajdziesz ją w eBOK swojego dostawcy.',
+            '_parser_method': 'pdfplumber+regex',
+            '_parser_tier': invoice_data.get('_parser_tier'),
+            **({'_regex_over_budget': invoice_data['_regex_over_budget']}
+               if invoice_data.get('_regex_over_budget') else {}),
+        }
+
+    # Faktura rozliczeniowa: pełne obliczenie oszczędności
+    result = calculate_savings(invoice_data)
+
+    # Dodaj informację o metodzie parsowania (i warstwie, która dała wynik) oraz typie dokumentu
+    result['_parser_method'] = 'pdfplumber+regex'
+    result['_parser_tier'] = invoice_data.get('_parser_tier')
+    if invoice_data.get('_tier_escalation'):
+        result['_tier_escalation'] = invoice_data['_tier_escalation']
+    if invoice_data.get('_regex_over_budget'):
+        result['_regex_over_budget'] = invoice_data['_regex_over_budget']
+    result['typ_dokumentu'] = 'faktura_rozliczeniowa'
+    return result
+
+
+def _analyze_file(filepaths, file_ext, content_hash='', deadline=None):
+    """
+    Parsuje zapisany upload (PDF albo zdjęcia stron jednej faktury) i liczy oszczędności.
+    content_hash: SHA-256 pliku — klucz magazynu IR (pomija ekstrakcję PDF, jeśli IR zapisany).
+    deadline: termin toru wykonania dla OCR (TimeoutError po jego upływie).
+    Zwraca (payload, status_http).
+    """
+    # Parsuj fakturę w zależności od typu pliku
+    invoice_data = None
+    print(f"🔍 Parsowanie pliku: {', '.join(os.path.basename(p) for p in filepaths)}")
+
+    if file_ext == 'pdf':
+        # Parsuj PDF używając zaawansowanego parsera (pakiet wielu faktur → segmenty równolegle)
+        try:
+            with metrics.track_parse():
+                documents = ir_store.parse_documents(filepaths[0], content_hash)
+            invoice_data = documents[0] if len(documents) == 1 else None
+            print(f"✅ Faktura sparsowana: {', '.join(d.get('numer_faktury') or 'brak' for d in documents)}")
+        except Exception as e:
+            print(f"❌ Błąd parsowania PDF: {e}")
+            import traceback
+            traceback.print_exc()
+            return {
+                'error': 'Nie udało się sparsować faktury PDF',
+                'details': str(e)
+            }, 500
+    else:
+        # Dla obrazów użyj OCR: strony równolegle, tekst w kolejności stron, parser tekstowy
+        with metrics.track_parse():
+            text = extract_text_from_images(filepaths, deadline)
+            if text:
+                invoice_data = parse_invoice_text(text)
+        if not text:
+            return {'error': 'Nie udało się wyekstraktować tekstu z obrazu'}, 500
+
+        if (invoice_data.get('typ_dokumentu') != 'prognoza'
+                and not invoice_data.get('pozycje') and not invoice_data.get('suma_brutto')):
+            return {
+                'error': 'Nie udało się odczytać faktury ze zdjęć',
                 'text_preview': text[:500]
-            }), 501
-
-        if not invoice_data:
-            return jsonify({'error': 'Nie udało się sparsować faktury'}), 500
-
-        # Sprawdź typ dokumentu
-        typ_dokumentu = invoice_data.get('typ_dokumentu', 'faktura_rozliczeniowa')
-
-        if typ_dokumentu == 'prognoza':
-            # Prognoza: zwróć dane prognozy z informacją, że potrzebna jest faktura
-            print(f"📊 Wykryto prognozę: {invoice_data.get('numer_dokumentu_prognozowego', 'brak')}")
-            result = {
-                'typ_dokumentu': 'prognoza',
-                'dane_prognozy': {
-                    'sprzedawca': invoice_data.get('sprzedawca', ''),
-                    'numer_dokumentu_prognozowego': invoice_data.get('numer_dokumentu_prognozowego', ''),
-                    'numer_klienta': invoice_data.get('numer_klienta', ''),
-                    'okres_rozliczeniowy': invoice_data.get('okres_rozliczeniowy', ''),
-                    'zuzycie_kwh': invoice_data.get('zuzycie_kwh', 0),
-                    'suma_netto': invoice_data.get('suma_netto', 0),
-                    'suma_brutto': invoice_data.get('suma_brutto', 0),
-                    'pozycje': invoice_data.get('pozycje', []),
-                },
-                'uwaga': invoice_data.get('uwaga', ''),
-                'info': 'Przesłany dokument to prognoza zużycia energii, nie faktura rozliczeniowa. '
-                        'Prognoza zawiera jedynie szacunkowe kwoty za sprzedaż i dystrybucję bez '
-                        'szczegółowego rozbicia na składniki (opłata sieciowa, OZE, kogeneracyjna, mocowa itd.). '
-                        'Aby obliczyć dokładne oszczędności z ustawy „Tani prąd", prześlij fakturę '
-                        'rozliczeniową — znajdziesz ją w eBOK swojego dostawcy.',
-                '_parser_method': 'pdfplumber+regex'
-            }
-            return jsonify(result), 200
+            }, 422
+
+    if file_ext == 'pdf' and len(documents) > 1:
+        # Pakiet: osobny wynik dla każdego dokumentu, w kolejności stron
+        results = []
+        for document in documents:
+            result = build_result(document)
+            result['strony'] = document.get('strony')
+            results.append(result)
+        return {
+            'typ_dokumentu': 'pakiet',
+            'liczba_dokumentow': len(results),
+            'dokumenty': results,
+            '_parser_method': 'pdfplumber+regex'
+        }, 200
+
+    if not invoice_data:
+        return {'error': 'Nie udało się sparsować faktury'}, 500
+
+    result = build_result(invoice_data)
+    if file_ext != 'pdf':
+        result['_parser_method'] = 'tesseract+regex'
+        result['liczba_zdjec'] = len(filepaths)
+    return result, 200
+
+
+CLIENT_BUSY = {
+    'error': 'Masz już analizy faktur w toku. Spróbuj ponownie za chwilę.',
+    'retry_after': RETRY_AFTER
+}
+
+LANE_BUSY = {
+    'error': 'Serwer analizuje teraz wiele faktur. Spróbuj ponownie za chwilę.',
+    'retry_after': RETRY_AFTER
+}
+
+ANALYSIS_TIMEOUT = {'error': 'Analiza trwała zbyt długo. Spróbuj wyraźniejszego zdjęcia lub mniejszego pliku.'}
+
+
+def cached_result(filepaths):
+    """(content_hash, body z cache albo None) dla zapisanego uploadu"""
+    content_hash = files_sha256(filepaths)
+    body = result_cache.get(content_hash)
+    if body is not None:
+        print(f"♻️  Wynik z cache: {content_hash[:12]}")
+    return content_hash, body
+
+
+def _over_budget(payload) -> bool:
+    """Czy któryś dokument wyniku (pojedynczy albo pakiet) wyczerpał budżet regex"""
+    documents = payload.get('dokumenty') if payload.get('typ_dokumentu') == 'pakiet' else [payload]
+    return any(document.get('_regex_over_budget') for document in documents or ())
+
+
+def analyze_and_cache(filepaths, file_ext, content_hash, deadline=None):
+    """Parsowanie uploadu (bez sprawdzania cache); wynik 200 trafia do cache i do czekających
+    na ten sam plik w innych workerach (single_flight). Zwraca (body_json, status)."""
+    payload, status = _analyze_file(filepaths, file_ext, content_hash, deadline)
+    body = dumps(payload)
+    if status == 200:
+        if _over_budget(payload):
+            # Wynik z pominiętymi oknami regex może być niepełny — bez cache (pamięć, SQLite)
+            # i bez udostępniania czekającym (każdy z nich odkłada go wtedy do swojego cache)
+            print(f"⏱️  Wynik {content_hash[:12]} z wyczerpanym budżetem regex — bez cache")
+        else:
+            result_cache.put(content_hash, body)
+            single_flight.publish(content_hash, body)
+        stats.record(payload)
+    return body, status
+
+
+def analyze_upload(filepaths, file_ext, client):
+    """
+    Analiza zapisanego uploadu z cache wyników; parsowanie w slocie sprawiedliwej kolejki klienta
+    w torze dobranym do szacowanego kosztu (szybki: PDF, ciężki: OCR zdjęć, długie PDF).
+    Ten sam plik analizowany właśnie w innym workerze — czeka na tamten wynik (single_flight).
+    Zwraca (body_json, status_http, content_hash); body 200 trafia do cache i ma ETag = hash.
+    """
+    content_hash, body = cached_result(filepaths)
+    if body is not None:
+        return body, 200, content_hash
+
+    lane = choose_lane(filepaths, file_ext)
+    try:
+        with single_flight.coalesce(content_hash, lane.timeout) as shared:
+            if shared is not None:
+                result_cache.put(content_hash, shared)
+                return shared, 200, content_hash
+            with lane.slot(client) as deadline:
+                body, status = analyze_and_cache(filepaths, file_ext, content_hash, deadline)
+    except ClientBusy:
+        print(f"⚖️  Klient {client} ma komplet analiz w toku — 429")
+        return dumps(CLIENT_BUSY), 429, content_hash
+    except LaneBusy as e:
+        print(f"🛤️  Tor {lane.name} pełny ({e}) — 503")
+        return dumps(LANE_BUSY), 503, content_hash
+    except TimeoutError:
+        print(f"⏱️  Tor {lane.name}: analiza przekroczyła {lane.timeout:g} s — 504")
+        return dumps(ANALYSIS_TIMEOUT), 504, content_hash
+    return body, status, content_hash
+
+
+def _cached_body_response(body, content_hash):
+    """Odpowiedź z gotowym JSON-em; hash treści pliku jako ETag"""
+    response = app.response_class(body, status=200, mimetype='application/json')
+    response.set_etag(content_hash)
+    return response
 
-        # Faktura rozliczeniowa: pełne obliczenie oszczędności
-        result = calculate_savings(invoice_data)
 
-        # Dodaj informację o metodzie parsowania i typie dokumentu
-        result['_parser_method'] = 'pdfplumber+regex'
-        result['typ_dokumentu'] = 'faktura_rozliczeniowa'
+@app.route('/api/analyze-invoice', methods=['POST'])
+@profiled
+def analyze_invoice():
+    """
+    Endpoint do analizy faktury
+    Akceptuje PDF lub zdjęcia stron jednej faktury (pole "file" powtórzone, w kolejności stron),
+    zwraca strukturyzowane dane i wyliczone oszczędności.
+    Wynik jest cache'owany po SHA-256 treści pliku (ETag odpowiedzi; dla zdjęć — files_sha256).
+    """
+    print("📨 Otrzymano request do /api/analyze-invoice")
+    print(f"   Method: {request.method}")
+    print(f"   Content-Type: {request.content_type}")
+    print(f"   Files: {list(request.files.keys())}")
 
-        return jsonify(result), 200
+    filepaths, file_ext, error = _receive_upload(max_files=MAX_IMAGE_PAGES)
+    if error:
+        return error
+    
+    try:
+        body, status, content_hash = analyze_upload(filepaths, file_ext, client_key())
+        if status != 200:
+            return app.response_class(body, status=status, mimetype='application/json')
+        return _cached_body_response(body, content_hash)
         
     except Exception as e:
         return jsonify({'error': f'Błąd przetwarzania: {str(e)}'}), 500
     
     finally:
-        # Usuń plik tymczasowy
-        try:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        except Exception as e:
-            print(f"⚠️  Nie udało się usunąć pliku {filepath}: {e}")
+        # Usuń pliki tymczasowe
+        remove_upload(filepaths)
 
-        # Wyczyść stare pliki co jakiś czas
-        import random
-        if random.random() < 0.1:  # 10% szans przy każdym requeście
-            cleanup_old_files(UPLOAD_FOLDER)
+
+@app.route('/api/analyze-invoice/by-hash', methods=['POST'])
+def analyze_invoice_by_hash():
+    """
+    Analiza bez uploadu: klient wysyła SHA-256 pliku ({"sha256": "..."} lub pole formularza).
+    200 z wynikiem, jeśli serwer niedawno analizował tę treść; 404 — wtedy klient wysyła plik.
+    Rate limit jak przy uploadzie, we własnym kubełku klienta (chybienie + upload to nie dwa uploady).
+    """
+    client_ip = client_key()
+    if not check_rate_limit(BY_HASH_RATE_KEY + client_ip):
+        print(f"⚠️  Rate limit exceeded for {client_ip} (by-hash)")
+        return jsonify({
+            'error': 'Zbyt wiele requestów. Spróbuj ponownie za chwilę.',
+            'retry_after': 60
+        }), 429
+
+    data = request.get_json(silent=True) or request.form
+    content_hash = normalize_sha256(data.get('sha256'))
+    if not content_hash:
+        return jsonify({'error': 'Brak lub niepoprawny hash SHA-256'}), 400
+
+    body = result_cache.get(content_hash)
+    if body is None:
+        return jsonify({'error': 'Nieznany hash — prześlij plik', 'sha256': content_hash}), 404
+
+    print(f"♻️  Wynik z cache (by-hash): {content_hash[:12]}")
+    return _cached_body_response(body, content_hash)
+
+
+@app.route('/api/savings-sweep', methods=['POST'])
+@profiled
+def savings_sweep():
+    """
+    Siatka scenariuszy oszczędności dla jednej faktury (dla analityków).
+    Pola formularza (procenty): vat="5:23:1", obnizka_dystrybucji="0:25:5",
+    opcjonalnie certyfikaty_rok (zł/rok), certyfikaty_zuzycie_rok (kWh/rok), oplaty_do_zerowania="mocowa,oze".
+    Faktura jest parsowana raz, cała siatka liczona jednym przebiegiem.
+    """
+    try:
+        vat_values = parse_percent_range(request.form.get('vat'), VAT_PO_REFORMIE)
+        obnizka_values = parse_percent_range(request.form.get('obnizka_dystrybucji'), OBNIZKA_DYSTRYBUCJI)
+        certyfikaty_rok = float(request.form.get('certyfikaty_rok', CERTYFIKATY_OSZCZEDNOSC_ROK))
+        certyfikaty_zuzycie = float(request.form.get('certyfikaty_zuzycie_rok', CERTYFIKATY_ZUZYCIE_ROK))
+    except ValueError as e:
+        return jsonify({'error': f'Niepoprawne parametry: {e}'}), 400
+    if certyfikaty_zuzycie <= 0:
+        return jsonify({'error': 'Niepoprawne parametry: certyfikaty_zuzycie_rok musi być > 0'}), 400
+    if len(vat_values) * len(obnizka_values) > MAX_SWEEP_CELLS:
+        return jsonify({'error': f'Zbyt duża siatka (max {MAX_SWEEP_CELLS} scenariuszy)'}), 400
+
+    oplaty = request.form.get('oplaty_do_zerowania')
+    oplaty_do_zerowania = (tuple(o.strip().lower() for o in oplaty.split(',') if o.strip())
+                           if oplaty is not None else OPLATY_DO_ZEROWANIA)
+
+    filepaths, file_ext, error = _receive_upload()
+    if error:
+        return error
+
+    try:
+        if file_ext != 'pdf':
+            return jsonify({'error': 'Sweep parametrów obsługuje tylko faktury PDF'}), 400
+
+        with choose_lane(filepaths, file_ext).slot(client_key()), metrics.track_parse():
+            invoice_data = parse_invoice(filepaths[0])
+        if invoice_data.get('typ_dokumentu') == 'prognoza':
+            return jsonify({'error': 'Sweep parametrów wymaga faktury rozliczeniowej, nie prognozy'}), 400
+
+        result = calculate_savings_sweep(
+            invoice_data, vat_values, obnizka_values,
+            certyfikaty_oszczednosc_rok=certyfikaty_rok,
+            certyfikaty_zuzycie_rok=certyfikaty_zuzycie,
+            oplaty_do_zerowania=oplaty_do_zerowania,
+        )
+        result['oplaty_do_zerowania'] = list(oplaty_do_zerowania)
+        result['metadata'] = {
+            'sprzedawca': invoice_data.get('sprzedawca', ''),
+            'numer_faktury': invoice_data.get('numer_faktury', ''),
+            'okres_rozliczeniowy': invoice_data.get('okres_rozliczeniowy', ''),
+            'zuzycie_kwh': invoice_data.get('zuzycie_kwh', 0),
+        }
+        return json_response(result)
+
+    except ClientBusy:
+        return jsonify(CLIENT_BUSY), 429
+
+    except LaneBusy:
+        return jsonify(LANE_BUSY), 503
+
+    except Exception as e:
+        return jsonify({'error': f'Błąd przetwarzania: {str(e)}'}), 500
+
+    finally:
+        remove_upload(filepaths)
+
+
+@app.after_request
+def record_worker_metrics(response):
+    """Po każdym requeście zapisz RSS workera (podstawa recyklingu w gunicorn.conf.py)"""
+    metrics.record_request()
+    return response
 
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
-    return jsonify({'status': 'ok', 'service': 'tani-prad-api'}), 200
+    """Health check endpoint (z metrykami pamięci bieżącego workera)"""
+    return jsonify(health_payload()), 200
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats_endpoint():
+    """Zagregowane statystyki analiz (bez danych pojedynczych faktur) dla dashboardu"""
+    try:
+        return jsonify(stats.snapshot()), 200
+    except sqlite3.Error as e:
+        return jsonify({'error': f'Statystyki niedostępne: {e}'}), 503
+
+
+def health_payload():
+    return {'status': 'ok', 'service': 'tani-prad-api', 'worker': metrics.snapshot(),
+            'lanes': {name: lane.snapshot() for name, lane in LANES.items()}}
+
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """
+    Readiness (load shedding): nasycenie całej usługi — parsowania w toku we wszystkich workerach,
+    kolejka połączeń, dostępność OCR, ostatnia latencja. 503 po przekroczeniu progów.
+    """
+    is_ready, details = metrics.readiness()
+    details['status'] = 'ready' if is_ready else 'saturated'
+    return jsonify(details), 200 if is_ready else 503
 
 
 if __name__ == '__main__':
+    cleanup_old_files(UPLOAD_FOLDER)
+    print_banner()
     print("🔌 Tani Prąd Backend - uruchamianie...")
     print("📋 Endpoint: POST /api/analyze-invoice")
+    print("#️⃣  By-hash: POST /api/analyze-invoice/by-hash")
+    print("📐 Sweep: POST /api/savings-sweep")
     print("💚 Health: GET /api/health")
+    print("🚦 Ready: GET /api/ready")
     app.run(host='0.0.0.0', port=8080, debug=True)
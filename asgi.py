@@ -0,0 +1,380 @@
+"""
+Wejście ASGI backendu "Tani prąd" — alternatywa dla app.py (Flask, sync workery gunicorna)
+Upload multipart odbierany jest asynchronicznie i zapisywany na dysk kawałkami, więc wolne
+połączenia (np. upload z telefonu) nie zajmują workera — kilka procesów obsłuży tysiące
+otwartych połączeń. Parsowanie PDF / OCR (CPU) idzie do puli wątków swojego toru (szybki /
+ciężki, scheduler.py), a pakiety wielu faktur dalej do puli procesów parsera. Na wolny slot
+toru czeka się w pętli zdarzeń, w sprawiedliwej kolejce klientów; po limicie czasu toru
+klient dostaje 504. Walidacja, cache wyników i analiza są wspólne z app.py.
+
+Uruchomienie (uvicorn nie jest w requirements.txt):
+  uvicorn asgi:app --host 0.0.0.0 --port 8080 --workers 2
+  gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+Endpointy: POST /api/analyze-invoice, POST /api/analyze-invoice/by-hash, GET /api/health,
+GET /api/stats, GET /api/ready. Sweep parametrów i strona testowa — tylko app.py.
+
+Wątki parsowania na proces = sloty torów (TANIPRAD_LANE_FAST_SLOTS, TANIPRAD_LANE_HEAVY_SLOTS).
+"""
+import asyncio
+import functools
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+import app as backend
+import metrics
+import profiling
+import single_flight
+import stats
+from models import dumps
+from result_cache import normalize_sha256
+from scheduler import LANES, ClientBusy, LaneBusy, choose_lane
+
+MAX_FORM_BODY = 64 * 1024  # by-hash: JSON / formularz bez pliku
+
+# Wątki, nie procesy: cache wyników, metryki workera i magazyn IR są stanem procesu.
+# Osobna pula na tor — fala OCR nie zajmie wątków tanich PDF-ów.
+_executors = {name: ThreadPoolExecutor(max_workers=lane.scheduler.slots, thread_name_prefix=f'taniprad-{name}')
+              for name, lane in LANES.items()}
+
+
+def _lane_capacity(lane) -> int:
+    """Parsowania toru naraz w całej usłudze: wątki puli w każdym procesie, najwyżej
+    limit workerów toru (slot flock zajmuje każde parsowanie)"""
+    capacity = metrics.WORKERS * lane.scheduler.slots
+    return min(capacity, lane.workers) if lane.workers else capacity
+
+
+# Próg nasycenia /api/ready: tu parsują pule wątków torów, a nie osobne sync workery
+READY_MAX_INFLIGHT = metrics.READY_MAX_INFLIGHT_ENV or sum(_lane_capacity(lane) for lane in LANES.values())
+
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+def _client(scope) -> str:
+    return backend.resolve_client_ip((scope.get('client') or ('',))[0], _header(scope, b'x-real-ip'))
+
+
+def _cors_headers(scope):
+    """Odpowiednik CORS(app, expose_headers=...) z app.py: dowolny origin, odsyłany w odpowiedzi"""
+    origin = _header(scope, b'origin')
+    if not origin:
+        return []
+    return [(b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'access-control-expose-headers', b'ETag, X-Request-ID'),
+            (b'vary', b'Origin')]
+
+
+async def _send(scope, send, status, body: bytes, headers=()):
+    headers = [(b'content-type', b'application/json'),
+               (b'content-length', str(len(body)).encode())] + list(headers) + _cors_headers(scope)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_json(scope, send, payload, status, headers=()):
+    await _send(scope, send, status, dumps(payload), headers)
+
+
+async def _run(func, *args):
+    """Wykonuje krótką blokującą operację (hash, pliki) w domyślnej puli pętli zdarzeń"""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def _read_body(receive, limit: int):
+    """Całe ciało requestu (małe); None, gdy przekracza limit albo klient się rozłączył"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > limit:
+            return None
+        if not message.get('more_body', False):
+            return bytes(body)
+
+
+async def _receive_upload(scope, receive):
+    """
+    Jak app._receive_upload, ale strumieniowo: rate limit i rozmiar przed odczytem ciała,
+    pola "file" (do MAX_IMAGE_PAGES zdjęć stron) zapisywane na dysk w miarę nadchodzenia danych.
+    Zwraca (filepaths, file_ext, None) albo (None, None, (payload, status)).
+    """
+    client_ip = _client(scope)
+    if not backend.check_rate_limit(client_ip):
+        print(f"⚠️  Rate limit exceeded for {client_ip}")
+        return None, None, ({'error': 'Zbyt wiele requestów. Spróbuj ponownie za chwilę.', 'retry_after': 60}, 429)
+
+    too_large = ({'error': f'Plik jest za duży. Maksymalny rozmiar to {backend.MAX_FILE_SIZE / 1024 / 1024:.0f} MB'}, 413)
+    content_length = _header(scope, b'content-length')
+    if content_length.isdigit() and int(content_length) > backend.MAX_FILE_SIZE:
+        return None, None, too_large
+
+    mimetype, options = parse_options_header(_header(scope, b'content-type'))
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        return None, None, ({'error': 'Brak pliku'}, 400)
+
+    decoder = MultipartDecoder(options['boundary'].encode('latin-1'), max_parts=16)
+    filepaths, filenames = [], []
+    file_ext = out = None
+    writing = False
+    received = 0
+    more_body = True
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                if not more_body:
+                    decoder.receive_data(None)
+                    continue
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    raise ConnectionError('klient przerwał upload')
+                chunk = message.get('body', b'')
+                received += len(chunk)
+                if received > backend.MAX_FILE_SIZE:
+                    raise OverflowError()
+                more_body = message.get('more_body', False)
+                decoder.receive_data(chunk)
+            elif isinstance(event, File) and event.name == 'file':
+                if event.filename == '':
+                    raise LookupError('Nie wybrano pliku')
+                if not backend.allowed_file(event.filename):
+                    raise LookupError('Niedozwolony format pliku. Użyj PDF, JPG lub PNG')
+                filenames.append(event.filename)
+                pages_error = backend.check_pages(len(filenames), filenames, backend.MAX_IMAGE_PAGES)
+                if pages_error:
+                    raise LookupError(pages_error['error'])
+                if out is not None:
+                    out.close()
+                filepath, file_ext = backend.upload_path(event.filename)
+                filepaths.append(filepath)
+                out = open(filepath, 'wb')
+                writing = True
+            elif isinstance(event, Data):
+                if writing:
+                    # Kawałki są małe (bufor serwera), zapis do page cache nie blokuje pętli zauważalnie
+                    out.write(event.data)
+                    writing = event.more_data
+            elif isinstance(event, Epilogue):
+                break
+            else:
+                writing = False  # kolejna część formularza (inne pola są ignorowane, jak w app.py)
+    except OverflowError:
+        error = too_large
+    except LookupError as e:
+        error = ({'error': str(e)}, 400)
+    except (ValueError, ConnectionError) as e:
+        error = ({'error': f'Niepoprawny upload: {e}'}, 400)
+    else:
+        if filepaths:
+            out.close()
+            return filepaths, file_ext, None
+        error = ({'error': 'Brak pliku'}, 400)
+
+    if out is not None:
+        out.close()
+    backend.remove_upload(filepaths)
+    return None, None, error
+
+
+def _analyze_profiled(lane, filepaths, file_ext, content_hash, client, request_id, forced, deadline):
+    """W wątku puli toru (slot kolejki już przydzielony): sloty wspólne dla workerów i analiza
+    objęta profilem — profiler śledzi wątek, który parsuje"""
+    with lane.shared_slots(client), profiling.profile_request(request_id, forced=forced):
+        return backend.analyze_and_cache(filepaths, file_ext, content_hash, deadline)
+
+
+def _cleanup(callbacks):
+    """Sprzątanie po analizie w kolejności dodania (blokada single_flight, pliki uploadu)"""
+    for callback in callbacks:
+        callback()
+
+
+async def _analyze(filepaths, file_ext, client, request_id, forced, cleanup):
+    """Jak app.analyze_upload: cache, wynik równoległej analizy tego samego pliku (single_flight),
+    a w końcu parsowanie w slocie toru dobranego do kosztu.
+    cleanup: sprzątanie po analizie — wołający wykonuje to, co zostanie w liście po powrocie"""
+    content_hash, body = await _run(backend.cached_result, filepaths)
+    if body is not None:
+        return body, 200, content_hash
+
+    lane = await _run(choose_lane, filepaths, file_ext)
+    shared, release = await single_flight.join_async(content_hash, lane.timeout)
+    cleanup.insert(0, release)
+    if shared is not None:
+        backend.result_cache.put(content_hash, shared)
+        return shared, 200, content_hash
+    return await _analyze_in_lane(lane, filepaths, file_ext, content_hash, client, request_id, forced, cleanup)
+
+
+async def _analyze_in_lane(lane, filepaths, file_ext, content_hash, client, request_id, forced, cleanup):
+    """Parsowanie w slocie toru (czekanie w pętli asyncio) z limitem czasu toru.
+    Od startu wątku sprzątanie (cleanup) przejmuje jego zakończenie: po 504 albo rozłączeniu
+    klienta wątek wciąż czyta pliki uploadu, a blokada lotu chroni przed drugim parsowaniem."""
+    try:
+        await lane.scheduler.acquire_async(client, lane.timeout)
+    except ClientBusy:
+        return dumps(backend.CLIENT_BUSY), 429, content_hash
+    except LaneBusy:
+        return dumps(backend.LANE_BUSY), 503, content_hash
+
+    deadline = time.monotonic() + lane.timeout
+    work = asyncio.get_running_loop().run_in_executor(
+        _executors[lane.name], _analyze_profiled,
+        lane, filepaths, file_ext, content_hash, client, request_id, forced, deadline)
+
+    deferred = cleanup[:]
+    cleanup.clear()
+
+    def finished(future):
+        # Slot, blokada lotu i pliki uploadu zwalniane dopiero, gdy wątek skończy — także po 504
+        lane.scheduler.release(client)
+        asyncio.get_running_loop().run_in_executor(None, _cleanup, deferred)
+        if not future.cancelled():
+            future.exception()  # po 504 nikt nie odbierze wyniku — bez ostrzeżenia asyncio
+
+    work.add_done_callback(finished)
+    try:
+        body, status = await asyncio.wait_for(asyncio.shield(work), lane.timeout)
+    except ClientBusy:
+        return dumps(backend.CLIENT_BUSY), 429, content_hash
+    except LaneBusy:
+        return dumps(backend.LANE_BUSY), 503, content_hash
+    except TimeoutError:  # asyncio.wait_for albo termin OCR
+        print(f"⏱️  Tor {lane.name}: analiza przekroczyła {lane.timeout:g} s — 504")
+        return dumps(backend.ANALYSIS_TIMEOUT), 504, content_hash
+    return body, status, content_hash
+
+
+async def analyze_invoice(scope, receive, send):
+    """POST /api/analyze-invoice — jak app.analyze_invoice (ETag = SHA-256 treści pliku)"""
+    print("📨 Otrzymano request do /api/analyze-invoice (ASGI)")
+    request_id = backend.clean_request_id(_header(scope, b'x-request-id'))
+    headers = [(b'x-request-id', request_id.encode())]
+
+    filepaths, file_ext, error = await _receive_upload(scope, receive)
+    if error:
+        return await _send_json(scope, send, *error, headers)
+
+    forced = profiling.token_matches(_header(scope, profiling.PROFILE_HEADER.lower().encode()))
+    cleanup = [functools.partial(backend.remove_upload, filepaths)]
+    try:
+        body, status, content_hash = await _analyze(filepaths, file_ext, _client(scope), request_id, forced, cleanup)
+    except Exception as e:
+        return await _send_json(scope, send, {'error': f'Błąd przetwarzania: {str(e)}'}, 500, headers)
+    finally:
+        await _run(_cleanup, cleanup)
+
+    if status == 200:
+        headers.append((b'etag', f'"{content_hash}"'.encode()))
+    await _send(scope, send, status, body, headers)
+
+
+async def analyze_invoice_by_hash(scope, receive, send):
+    """POST /api/analyze-invoice/by-hash — jak app.analyze_invoice_by_hash"""
+    client_ip = _client(scope)
+    if not backend.check_rate_limit(backend.BY_HASH_RATE_KEY + client_ip):
+        print(f"⚠️  Rate limit exceeded for {client_ip} (by-hash)")
+        return await _send_json(scope, send, {'error': 'Zbyt wiele requestów. Spróbuj ponownie za chwilę.',
+                                              'retry_after': 60}, 429)
+
+    raw = await _read_body(receive, MAX_FORM_BODY)
+    data = {}
+    if raw:
+        if parse_options_header(_header(scope, b'content-type'))[0] == 'application/json':
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                data = {}
+        else:
+            data = {k: v[0] for k, v in parse_qs(raw.decode('utf-8', 'replace')).items()}
+    content_hash = normalize_sha256(data.get('sha256') if isinstance(data, dict) else None)
+    if not content_hash:
+        return await _send_json(scope, send, {'error': 'Brak lub niepoprawny hash SHA-256'}, 400)
+
+    body = backend.result_cache.get(content_hash)
+    if body is None:
+        return await _send_json(scope, send, {'error': 'Nieznany hash — prześlij plik', 'sha256': content_hash}, 404)
+
+    print(f"♻️  Wynik z cache (by-hash): {content_hash[:12]}")
+    await _send(scope, send, 200, body, [(b'etag', f'"{content_hash}"'.encode())])
+
+
+async def health(scope, receive, send):
+    await _send_json(scope, send, backend.health_payload(), 200)
+
+
+async def stats_endpoint(scope, receive, send):
+    try:
+        payload = await _run(stats.snapshot)
+    except sqlite3.Error as e:
+        return await _send_json(scope, send, {'error': f'Statystyki niedostępne: {e}'}, 503)
+    await _send_json(scope, send, payload, 200)
+
+
+async def ready(scope, receive, send):
+    is_ready, details = metrics.readiness(READY_MAX_INFLIGHT)
+    details['status'] = 'ready' if is_ready else 'saturated'
+    await _send_json(scope, send, details, 200 if is_ready else 503)
+
+
+ROUTES = {
+    '/api/analyze-invoice': ('POST', analyze_invoice),
+    '/api/analyze-invoice/by-hash': ('POST', analyze_invoice_by_hash),
+    '/api/health': ('GET', health),
+    '/api/stats': ('GET', stats_endpoint),
+    '/api/ready': ('GET', ready),
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await _run(backend.cleanup_old_files, backend.UPLOAD_FOLDER)
+            threads = ', '.join(f'{name}: {lane.scheduler.slots}' for name, lane in LANES.items())
+            print(f"🔌 Tani Prąd Backend (ASGI) — wątki parsowania na proces ({threads})")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for executor in _executors.values():
+                executor.shutdown(wait=True)
+            metrics.unpublish()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """Aplikacja ASGI"""
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    route = ROUTES.get(scope['path'].rstrip('/') or '/')
+    if route is None:
+        return await _send_json(scope, send, {'error': 'Nie znaleziono'}, 404)
+
+    method, handler = route
+    if scope['method'] == 'OPTIONS':
+        # Preflight CORS
+        allow_headers = _header(scope, b'access-control-request-headers').encode('latin-1')
+        return await _send(scope, send, 200, b'', [(b'access-control-allow-methods', f'{method}, OPTIONS'.encode()),
+                                                   (b'access-control-allow-headers', allow_headers)])
+    if scope['method'] != method:
+        return await _send_json(scope, send, {'error': 'Niedozwolona metoda'}, 405, [(b'allow', method.encode())])
+
+    await handler(scope, receive, send)
+    metrics.record_request()
@@ -0,0 +1,74 @@
+"""
+Benchmark OCR zdjęć faktur: regiony z tekstem (TANIPRAD_OCR_ROI=1) vs jeden przebieg
+Tesseracta po całym obrazie (TANIPRAD_OCR_ROI=0)
+Dla każdego zdjęcia mierzy łączny czas extract_text w obu trybach (najlepszy z kilku
+powtórzeń) i liczbę wywołań tesseract, a na końcu sumę po wszystkich zdjęciach.
+Długość tekstu i liczba kwot (liczb z przecinkiem) pozwalają szybko porównać odczyt.
+Regiony są domyślne; gdy na zdjęciach z telefonu wychodzą wolniejsze — TANIPRAD_OCR_ROI=0.
+
+Użycie:
+  python3 bench_ocr.py zdjecia/*.jpg
+  python3 bench_ocr.py --repeat 5 faktura1.jpg faktura2.jpg
+"""
+import argparse
+import math
+import re
+import sys
+import time
+
+import ocr
+
+AMOUNT_RE = re.compile(r'\d+,\d{2}\b')
+
+
+def measure(filepath: str, roi: bool, repeat: int):
+    """(najlepszy czas w s, wywołania tesseract w jednym przebiegu, tekst) dla trybu roi"""
+    import pytesseract
+
+    calls = []
+    originals = {name: getattr(pytesseract, name) for name in ('image_to_data', 'image_to_string')}
+
+    def counted(call):
+        def wrapper(*args, **kwargs):
+            calls.append(call.__name__)
+            return call(*args, **kwargs)
+        return wrapper
+
+    ocr.OCR_ROI = roi
+    best, text = math.inf, ''
+    try:
+        for name, call in originals.items():
+            setattr(pytesseract, name, counted(call))
+        for _ in range(repeat):
+            calls.clear()
+            start = time.perf_counter()
+            text = ocr.extract_text(filepath)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        for name, call in originals.items():
+            setattr(pytesseract, name, call)
+    return best, len(calls), text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR: regiony vs cały obraz')
+    parser.add_argument('images', nargs='+', help='zdjęcia faktur')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    totals = {False: 0.0, True: 0.0}
+    print(f"{'zdjęcie':<32} {'tryb':<8} {'czas':>8} {'tesseract':>10} {'znaki':>7} {'kwoty':>6}")
+    for filepath in args.images:
+        for roi in (False, True):
+            seconds, calls, text = measure(filepath, roi, args.repeat)
+            totals[roi] += seconds
+            print(f"{filepath[-32:]:<32} {'regiony' if roi else 'całość':<8} {seconds:>7.2f}s {calls:>10} "
+                  f"{len(text):>7} {len(AMOUNT_RE.findall(text)):>6}")
+
+    print(f"\nRazem: całość {totals[False]:.2f} s, regiony {totals[True]:.2f} s "
+          f"({totals[True] / max(totals[False], 1e-9):.2f}×)")
+    return 0 if totals[True] <= totals[False] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
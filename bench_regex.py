@@ -0,0 +1,126 @@
+"""
+Benchmark i fuzzing wyrażeń regularnych parserów na złośliwie generowanym tekście
+Dla każdej rodziny tekstów (długie ciągi cyfr, powtórzone kotwice bez wartości, jedna
+gigantyczna linia, ...) mierzy czas parsowania przy rosnącym rozmiarze i liczy wykładnik
+wzrostu (nachylenie log(czas)/log(rozmiar)). Liniowy parser ma wykładnik ~1,
+kwadratowy ~2. Kod wyjścia 1, gdy któryś wykładnik przekroczy próg.
+
+Użycie:
+  python3 bench_regex.py                    # rozmiary domyślne
+  python3 bench_regex.py --sizes 20000,40000,80000,160000 --max-exponent 1.3
+  python3 bench_regex.py --fuzz 200         # dodatkowo losowe teksty (seed stały)
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+from parser_advanced import InvoiceParser
+from parser_simple import parse_invoice_simple
+from warmup import SAMPLE_LINES
+
+PROVIDERS = ('eon', 'pge', 'tauron', 'enea', 'unknown')
+
+
+def _repeat_to(unit: str, size: int) -> str:
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+# Rodziny złośliwych tekstów: rozmiar (znaki) -> tekst
+FAMILIES = {
+    # \d+ bez "kWh" — klasyczne kwadratowe cofanie na ciągu cyfr
+    'ciag_cyfr': lambda n: 'Zużycie energii elektrycznej ' + '1' * n,
+    'ciag_cyfr_linie': lambda n: _repeat_to('Energia czynna ' + '7' * 400 + '\n', n),
+    # Kotwica .*? powtarzana w jednej linii, bez wartości kończącej wzorzec
+    'kotwice_jedna_linia': lambda n: _repeat_to('Energia czynna 12 Razem energia 3 ', n),
+    'wartosc_ogolem': lambda n: _repeat_to('Wartość ogółem 23 1,0 23 ', n),
+    'zuzycie_kropki': lambda n: 'Zużycie energii elektrycznej ' + _repeat_to('1.', n),
+    # Wiele linii z kotwicami i niepełnymi sumami
+    'kotwice_linie': lambda n: _repeat_to('Razem wartość netto 1,00 zł\nplus kwota VAT\nDo zapłaty 1,0 2,0\n', n),
+    'liczby_z_przecinkiem': lambda n: _repeat_to('całodobowa kWh ' + '5' * 300 + ' 1,5050 ', n),
+    # Realistyczna faktura powielona — punkt odniesienia
+    'faktura_powielona': lambda n: _repeat_to('\n'.join(SAMPLE_LINES) + '\n', n),
+}
+
+
+def _parse_all(parser: InvoiceParser, text: str):
+    for provider in PROVIDERS:
+        parser._parse_invoice_data(text, [], provider)
+    parser._parse_forecast(text, [], 'lumi_pge')
+    parse_invoice_simple(text)
+
+
+def measure(text: str, repeat: int = 3) -> float:
+    """Najlepszy z `repeat` czasów parsowania tekstu przez wszystkie ścieżki (sekundy)"""
+    best = math.inf
+    for _ in range(repeat):
+        parser = InvoiceParser()
+        start = time.perf_counter()
+        _parse_all(parser, text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def growth_exponent(sizes, timings) -> float:
+    """Nachylenie prostej log(czas) ~ log(rozmiar) (metoda najmniejszych kwadratów)"""
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(max(t, 1e-6)) for t in timings]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+
+
+def fuzz(cases: int, size: int, seed: int = 0) -> float:
+    """Losowe teksty z fragmentów kotwic, cyfr i separatorów; zwraca najgorszy czas na 10 tys. znaków"""
+    rnd = random.Random(seed)
+    atoms = ['Energia czynna', 'Razem', 'energia', 'Zużycie', 'energii elektrycznej', 'kWh', 'Wartość ogółem',
+             '23', 'zł', 'Do zapłaty', 'Należność za faktyczne zużycie', 'PODSUMOWANIE:', 'Ogółem:',
+             'plus kwota VAT', 'całodobowa', 'Prognoza zużycia za okres:', ' ', '  ', '\n', ',', '.',
+             '1', '12', '999999', '0,5050', '01.12.2025', 'E/', 'FAKTURA VAT NR', 'ŁĄCZNE']
+    worst = 0.0
+    for _ in range(cases):
+        parts = []
+        length = 0
+        while length < size:
+            atom = rnd.choice(atoms) * (rnd.randint(1, 60) if rnd.random() < 0.1 else 1)
+            parts.append(atom)
+            length += len(atom)
+        text = ''.join(parts)
+        elapsed = measure(text, repeat=1)
+        worst = max(worst, elapsed / len(text) * 10000)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,20000,40000,80000')
+    parser.add_argument('--max-exponent', type=float, default=1.3)
+    parser.add_argument('--fuzz', type=int, default=0, help='liczba losowych tekstów')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    measure('\n'.join(SAMPLE_LINES))  # rozgrzewka (kompilacja wzorców)
+
+    failed = []
+    print(f"{'rodzina':<24}" + ''.join(f'{s:>11}' for s in sizes) + '   wykładnik')
+    for name, build in FAMILIES.items():
+        timings = [measure(build(size)) for size in sizes]
+        exponent = growth_exponent(sizes, timings)
+        flag = '' if exponent <= args.max_exponent else '  ❌'
+        if flag:
+            failed.append(name)
+        print(f"{name:<24}" + ''.join(f'{t * 1000:>9.1f}ms' for t in timings) + f'   {exponent:>6.2f}{flag}')
+
+    if args.fuzz:
+        worst = fuzz(args.fuzz, sizes[-1])
+        print(f"fuzz: {args.fuzz} tekstów × {sizes[-1]} znaków — najgorszy czas {worst * 1000:.2f} ms / 10 tys. znaków")
+
+    if failed:
+        print(f"❌ Wzrost nieliniowy: {', '.join(failed)}")
+        return 1
+    print("✅ Czas parsowania rośnie liniowo")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
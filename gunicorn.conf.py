@@ -0,0 +1,58 @@
+"""
+Konfiguracja gunicorna dla backendu "Tani prąd"
+Uruchomienie: gunicorn -c gunicorn.conf.py app:app
+
+Zmienne środowiskowe:
+  WEB_CONCURRENCY    liczba workerów (domyślnie 4)
+  TANIPRAD_PRELOAD   1 = ładuj aplikację i rozgrzewaj parser raz w masterze,
+                     workery dziedziczą stan przez fork (szybszy start i respawn)
+  TANIPRAD_MAX_RSS_MB    recykling workera po przekroczeniu RSS (domyślnie 512, 0 = wyłączone)
+  TANIPRAD_MAX_REQUESTS  recykling workera po N requestach (domyślnie 1000, 0 = wyłączone)
+"""
+import os
+import sys
+
+# Config ładowany spoza katalogu aplikacji (np. gunicorn --chdir ... -c /ścieżka/gunicorn.conf.py)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics  # noqa: E402
+
+bind = os.environ.get('TANIPRAD_BIND', '0.0.0.0:8080')
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+timeout = 120
+accesslog = '-'
+errorlog = '-'
+
+preload_app = os.environ.get('TANIPRAD_PRELOAD', '0') == '1'
+
+# Recykling po N requestach (jitter, żeby workery nie restartowały się jednocześnie)
+max_requests = metrics.MAX_REQUESTS
+max_requests_jitter = max(1, metrics.MAX_REQUESTS // 20) if metrics.MAX_REQUESTS else 0
+
+
+def on_starting(server):
+    """Master: w trybie preload aplikacja jest już załadowana — sprzątanie i rozgrzewka parsera przed forkiem"""
+    if not preload_app:
+        # Bez preload master nie importuje aplikacji (HUP przeładowuje kod w nowych workerach);
+        # stare pliki usuwa okresowe sprzątanie przy requestach
+        return
+
+    from app import UPLOAD_FOLDER, cleanup_old_files, print_banner
+    cleanup_old_files(UPLOAD_FOLDER)
+    print_banner()
+
+    from warmup import warm_parser
+    warm_parser()
+
+
+def post_request(worker, req, environ, resp):
+    """Worker: po każdym requeście sprawdź RSS — przy przekroczeniu dokończ pracę i zrestartuj się"""
+    reason = metrics.recycle_reason()
+    if reason and worker.alive:
+        worker.log.warning("♻️  Recykling workera %s: %s", worker.pid, reason)
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    """Worker: usuń plik stanu używany przez /api/ready"""
+    metrics.unpublish()
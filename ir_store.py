@@ -0,0 +1,218 @@
+"""
+Magazyn reprezentacji pośredniej (IR) faktur kluczowany hashem treści pliku (SHA-256)
+IR = wynik kosztownej ekstrakcji pdfplumber (tekst, tabele, dostawca) dla każdego
+dokumentu w PDF. Parsowanie pól z IR trwa milisekundy — po zmianie logiki parsera
+cały korpus można przeliczyć bez ponownego otwierania PDF-ów.
+
+IR warstwy tekstowej (tier 'tekst': tylko 1. strona, bez tabel) zapisany przy obsłudze
+requestu nie nadaje się do przeliczenia pełnym parserem — reprocess z --zrodla ekstrahuje
+taki plik ponownie z PDF (dopasowanego po hashu) i zastępuje jego IR pełnym. `add` zapisuje
+od razu pełny IR.
+
+IR zawiera pełny tekst faktur (dane osobowe) — magazyn jest wyłączony,
+dopóki nie ustawiono TANIPRAD_IR_DIR.
+
+Użycie:
+  python3 ir_store.py add <faktura.pdf>...        # pełna ekstrakcja (z tabelami) i zapis IR
+  python3 ir_store.py reprocess [wyniki.jsonl] [--zrodla KATALOG]
+                                                  # parsowanie całego korpusu z IR; IR warstwy
+                                                  # tekstowej ponownie z PDF-ów w KATALOGU
+  python3 ir_store.py bench [powtórzenia]         # benchmark parsowania z IR
+"""
+import gzip
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from parser_advanced import IR_VERSION, TEXT_TIER, TIER_TEXT, InvoiceParser
+
+IR_DIR = os.environ.get('TANIPRAD_IR_DIR', '')
+
+_SUFFIX = '.ir.json.gz'
+
+
+def enabled() -> bool:
+    return bool(IR_DIR)
+
+
+def _ir_path(content_hash: str) -> str:
+    return os.path.join(IR_DIR, content_hash + _SUFFIX)
+
+
+def load(content_hash: str) -> Optional[List[Dict]]:
+    """IR dokumentów pliku albo None (brak, uszkodzony lub ze starszej wersji ekstrakcji)"""
+    if not enabled() or not content_hash:
+        return None
+    try:
+        with gzip.open(_ir_path(content_hash), 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Nieczytelny IR {content_hash[:12]}: {e}")
+        return None
+    documents = data.get('dokumenty') or []
+    if data.get('ir_version') != IR_VERSION or any(d.get('ir_version') != IR_VERSION for d in documents):
+        return None
+    return documents
+
+
+def save(content_hash: str, documents: List[Dict]):
+    """Zapisuje IR dokumentów pliku (atomowo: plik tymczasowy + rename)"""
+    if not enabled() or not content_hash:
+        return
+    data = {'ir_version': IR_VERSION, 'sha256': content_hash, 'zapisano': time.time(), 'dokumenty': documents}
+    try:
+        os.makedirs(IR_DIR, exist_ok=True)
+        tmp = f"{_ir_path(content_hash)}.{os.getpid()}.tmp"
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, _ir_path(content_hash))
+    except OSError as e:
+        print(f"⚠️  Nie udało się zapisać IR: {e}")
+
+
+def replayable(documents: List[Dict]) -> bool:
+    """Czy IR pliku zawiera wszystko, czego potrzebuje pełny parser (bez IR warstwy tekstowej)"""
+    return all(ir.get('tier') != TIER_TEXT for ir in documents)
+
+
+def parse_documents(filepath: str, content_hash: str = '', tiered: bool = TEXT_TIER) -> List[Dict]:
+    """Wyniki parsowania dokumentów pliku PDF (jak parse_invoice_bundle), z IR z magazynu jeśli jest.
+    Świeżo wyekstrahowany IR jest zapisywany, chyba że parsowanie wyczerpało budżet regex.
+    tiered=False: pełna ekstrakcja z tabelami — IR do przeliczania korpusu (replayable)."""
+    parser = InvoiceParser()
+    documents = load(content_hash)
+    if documents is not None and (tiered or replayable(documents)):
+        return [parser.parse_ir(ir) for ir in documents]
+
+    documents = parser.extract_bundle_ir(filepath, tiered=tiered)
+    results = [parser.parse_ir(ir) for ir in documents]
+    if any(result.get('_regex_over_budget') for result in results):
+        print(f"⏱️  IR {content_hash[:12]}: wyczerpany budżet regex — bez zapisu")
+    else:
+        save(content_hash, documents)
+    return results
+
+
+def iter_corpus() -> Iterator[Tuple[str, List[Dict]]]:
+    """(hash, IR dokumentów) dla wszystkich plików w magazynie w bieżącej wersji IR"""
+    try:
+        names = sorted(os.listdir(IR_DIR)) if enabled() else []
+    except OSError:
+        names = []
+    for name in names:
+        if name.endswith(_SUFFIX):
+            content_hash = name[:-len(_SUFFIX)]
+            documents = load(content_hash)
+            if documents is not None:
+                yield content_hash, documents
+
+
+def _sources(sources_dir: Optional[str]) -> Dict[str, str]:
+    """hash treści -> ścieżka PDF-a z katalogu źródeł (rekurencyjnie)"""
+    from result_cache import file_sha256
+
+    sources = {}
+    for root, _, names in os.walk(sources_dir) if sources_dir else ():
+        for name in names:
+            if name.lower().endswith('.pdf'):
+                path = os.path.join(root, name)
+                sources[file_sha256(path)] = path
+    return sources
+
+
+def reprocess(output_path: Optional[str] = None, sources_dir: Optional[str] = None) -> Dict:
+    """Parsuje cały korpus z IR bieżącą logiką parsera; opcjonalnie zapisuje wyniki (JSON Lines).
+    Pliki z IR warstwy tekstowej ekstrahowane są ponownie (z tabelami) z PDF-ów w sources_dir,
+    a ich IR zastępowany pełnym; bez źródła liczone jako 'bez_zrodla' (wynik tylko z 1. strony)."""
+    parser = InvoiceParser()
+    stats = {'pliki': 0, 'dokumenty': 0, 'bledy': 0, 'niespojne_tekst': 0, 'ponowna_ekstrakcja': 0,
+             'bez_zrodla': 0}
+    sources = _sources(sources_dir)
+    out = open(output_path, 'w', encoding='utf-8') if output_path else None
+    start = time.perf_counter()
+    try:
+        for content_hash, documents in iter_corpus():
+            stats['pliki'] += 1
+            if not replayable(documents):
+                if content_hash in sources:
+                    print(f"📄 {content_hash[:12]}: IR warstwy tekstowej — ponowna ekstrakcja z PDF")
+                    documents = parser.extract_bundle_ir(sources[content_hash])
+                    save(content_hash, documents)
+                    stats['ponowna_ekstrakcja'] += 1
+                else:
+                    stats['bez_zrodla'] += 1
+            for index, ir in enumerate(documents):
+                stats['dokumenty'] += 1
+                try:
+                    result = parser.parse_ir(ir)
+                except Exception as e:
+                    stats['bledy'] += 1
+                    print(f"❌ {content_hash[:12]}#{index}: {e}")
+                    continue
+                if ir.get('tier') == TIER_TEXT and parser.consistency_problems(result):
+                    # IR warstwy tekstowej bez źródła — nowy parser potrzebowałby tabel, których nie ma
+                    stats['niespojne_tekst'] += 1
+                    print(f"⚠️  {content_hash[:12]}#{index}: warstwa tekstowa niespójna po zmianie parsera")
+                if out:
+                    out.write(json.dumps({'sha256': content_hash, 'dokument': index, 'wynik': result},
+                                         ensure_ascii=False, default=str) + '\n')
+    finally:
+        if out:
+            out.close()
+    stats['czas_s'] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def bench(repeat: int = 5) -> Dict:
+    """Odtwarza korpus IR repeat razy i mierzy czas samego parsowania pól"""
+    parser = InvoiceParser()
+    corpus = [ir for _, documents in iter_corpus() for ir in documents]
+    timings = []
+    for _ in range(repeat):
+        for ir in corpus:
+            start = time.perf_counter()
+            parser.parse_ir(ir)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    if not timings:
+        return {'dokumenty': 0}
+    return {
+        'dokumenty': len(corpus),
+        'parsowan': len(timings),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'max_ms': round(timings[-1], 3),
+        'suma_s': round(sum(timings) / 1000, 3),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    from result_cache import file_sha256
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not enabled() and command:
+        print("❌ Ustaw TANIPRAD_IR_DIR (katalog magazynu IR)")
+        sys.exit(1)
+
+    if command == 'add' and len(sys.argv) > 2:
+        for filepath in sys.argv[2:]:
+            content_hash = file_sha256(filepath)
+            documents = parse_documents(filepath, content_hash, tiered=False)
+            print(f"✅ {filepath}: {content_hash[:12]} ({len(documents)} dok.)")
+    elif command == 'reprocess':
+        args = sys.argv[2:]
+        sources_dir = None
+        if '--zrodla' in args:
+            position = args.index('--zrodla')
+            sources_dir = args[position + 1] if position + 1 < len(args) else None
+            del args[position:position + 2]
+        print(json.dumps(reprocess(args[0] if args else None, sources_dir), ensure_ascii=False))
+    elif command == 'bench':
+        print(json.dumps(bench(int(sys.argv[2]) if len(sys.argv) > 2 else 5), ensure_ascii=False))
+    else:
+        print(__doc__)
@@ -0,0 +1,387 @@
+"""
+Test obciążeniowy backendu mieszanką ruchu jak na produkcji (tylko biblioteka standardowa)
+Wysyła na /api/analyze-invoice losowo wybrane uploady wg wag kategorii:
+  pdf         faktury PDF z korpusu (unikalna treść — dopisany komentarz po %%EOF, bez trafień w cache)
+  prognoza    prognozy PDF z korpusu (pliki z "prognoz" w nazwie)
+  zdjecie     zdjęcia faktur z korpusu (.jpg/.png, unikalna treść)
+  duplikat    te same 3 faktury bez zmian (podwójne kliknięcia — cache, single-flight)
+  za_duzy     plik ponad limit rozmiaru (413)
+  uszkodzony  losowe bajty z nagłówkiem %PDF
+Każdy request ma inny X-Real-IP z puli --clients (rate limit i kolejka działają jak dla
+wielu użytkowników; backend ufa temu nagłówkowi od połączeń z localhost).
+
+Raport dla każdej konfiguracji: przepustowość, latencja p50/p95/p99 (ogółem i wg kategorii),
+odsetek błędów (5xx, zerwane połączenia) i 429, statusy HTTP, szczytowa pamięć (RSS)
+drzewa procesów serwera. Z --server skrypt sam uruchamia każdą konfigurację (świeży
+TANIPRAD_RUN_DIR), czeka na /api/health, mierzy i zatrzymuje serwer.
+
+Użycie:
+  python3 loadtest.py --corpus faktury/ --duration 60 --concurrency 16
+  python3 loadtest.py --corpus faktury/ --rate 5 --duration 120 \\
+      --server 'sync2=WEB_CONCURRENCY=2 gunicorn -c gunicorn.conf.py app:app' \\
+      --server 'sync4=WEB_CONCURRENCY=4 gunicorn -c gunicorn.conf.py app:app' \\
+      --server 'asgi2=gunicorn -c gunicorn.conf.py -w 2 -k uvicorn.workers.UvicornWorker asgi:app' \\
+      --json wyniki.json
+  python3 loadtest.py --corpus faktury/ --mix pdf=80,zdjecie=20 --pid $(pgrep -o gunicorn)
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+DEFAULT_MIX = 'pdf=55,prognoza=10,zdjecie=15,duplikat=12,za_duzy=4,uszkodzony=4'
+HOT_FILES = 3             # faktury wysyłane jako duplikaty
+REQUEST_TIMEOUT = 180     # s — dłużej niż timeout gunicorna (120 s)
+MEMORY_INTERVAL = 0.5     # s — próbkowanie RSS serwera
+STARTUP_TIMEOUT = 60      # s — czekanie na /api/health uruchomionego serwera
+
+CONTENT_TYPES = {'pdf': 'application/pdf', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def load_corpus(directory: str) -> dict:
+    """Kategoria -> [(nazwa pliku, treść)]"""
+    corpus = defaultdict(list)
+    for name in sorted(os.listdir(directory)):
+        ext = name.rsplit('.', 1)[-1].lower()
+        if ext not in CONTENT_TYPES:
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            data = f.read()
+        if ext == 'pdf':
+            corpus['prognoza' if 'prognoz' in name.lower() else 'pdf'].append((name, data))
+        else:
+            corpus['zdjecie'].append((name, data))
+    return corpus
+
+
+def parse_mix(spec: str, corpus: dict) -> dict:
+    """'pdf=55,zdjecie=15' -> wagi kategorii; kategorie bez plików w korpusie są pomijane"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        needs = 'pdf' if name == 'duplikat' else name
+        if needs in ('pdf', 'prognoza', 'zdjecie') and not corpus.get(needs):
+            print(f"⚠️  Brak plików dla kategorii {name} w korpusie — pomijam")
+            continue
+        mix[name] = float(weight or 1)
+    if not mix:
+        raise SystemExit('❌ Pusta mieszanka ruchu')
+    return mix
+
+
+class Upload:
+    """Generator uploadów: kategoria -> (nazwa pliku, treść) gotowe do wysłania"""
+
+    def __init__(self, corpus: dict, max_size: int):
+        self.corpus = corpus
+        self.oversized = b'%PDF-1.4\n' + os.urandom(1024 * 1024) * (max_size // (1024 * 1024) + 1)
+
+    def make(self, category: str, rnd: random.Random):
+        unique = f'\n% loadtest {uuid.uuid4().hex}\n'.encode()
+        if category in ('pdf', 'prognoza', 'zdjecie'):
+            name, data = rnd.choice(self.corpus[category])
+            return name, data + unique  # dane po końcu pliku nie zmieniają PDF-a ani obrazu
+        if category == 'duplikat':
+            return rnd.choice(self.corpus['pdf'][:HOT_FILES])
+        if category == 'za_duzy':
+            return 'za_duzy.pdf', self.oversized
+        return 'uszkodzony.pdf', b'%PDF-1.4\n' + os.urandom(rnd.randint(1000, 50000)) + unique
+
+
+def multipart(filename: str, data: bytes):
+    boundary = uuid.uuid4().hex
+    ext = filename.rsplit('.', 1)[-1].lower()
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: {CONTENT_TYPES.get(ext, "application/octet-stream")}\r\n\r\n').encode()
+    return f'multipart/form-data; boundary={boundary}', head + data + f'\r\n--{boundary}--\r\n'.encode()
+
+
+def send(url, category: str, filename: str, data: bytes, client_ip: str):
+    """Jeden request; (kategoria, status albo 0 przy błędzie połączenia, latencja s)"""
+    parts = urlsplit(url)
+    content_type, body = multipart(filename, data)
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=REQUEST_TIMEOUT)
+    try:
+        conn.request('POST', '/api/analyze-invoice', body,
+                     {'Content-Type': content_type, 'X-Real-IP': client_ip, 'X-Request-ID': uuid.uuid4().hex})
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = 0
+    finally:
+        conn.close()
+    return category, status, time.perf_counter() - start
+
+
+def _children(pid: int) -> list:
+    """Procesy potomne (rekurencyjnie) z /proc"""
+    parents = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents[ppid].append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(parents.get(current, ()))
+    return tree
+
+
+def _rss(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class MemorySampler(threading.Thread):
+    """Szczytowy RSS drzewa procesów serwera (suma i największy pojedynczy proces)"""
+
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak_total = self.peak_process = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(MEMORY_INTERVAL):
+            sizes = [_rss(pid) for pid in _children(self.pid)]
+            self.peak_total = max(self.peak_total, sum(sizes))
+            self.peak_process = max(self.peak_process, max(sizes, default=0))
+
+    def stop(self) -> dict:
+        self._done.set()
+        self.join()
+        return {'rss_szczyt_suma_mb': round(self.peak_total / 2**20, 1),
+                'rss_szczyt_proces_mb': round(self.peak_process / 2**20, 1)}
+
+
+def percentile(sorted_values: list, p: float):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def run_load(args, mix: dict, uploads: Upload) -> dict:
+    """Obciążenie przez --duration s: pętla zamknięta (--concurrency wątków) albo otwarta (--rate req/s)"""
+    results = []
+    lock = threading.Lock()
+    rnd = random.Random(args.seed)
+    categories, weights = list(mix), list(mix.values())
+    clients = [f'10.{i // 250 % 250}.{i % 250}.{rnd.randint(1, 250)}' for i in range(args.clients)]
+    deadline = time.monotonic() + args.duration
+    dropped = 0
+
+    def one(local_rnd):
+        category = local_rnd.choices(categories, weights)[0]
+        filename, data = uploads.make(category, local_rnd)
+        result = send(args.url, category, filename, data, local_rnd.choice(clients))
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    if args.rate:
+        # Pętla otwarta: przyjścia Poissona niezależne od odpowiedzi serwera (jak prawdziwi użytkownicy)
+        slots = threading.Semaphore(args.concurrency)
+        threads = []
+
+        def guarded(seed):
+            try:
+                one(random.Random(seed))
+            finally:
+                slots.release()
+
+        while time.monotonic() < deadline:
+            time.sleep(rnd.expovariate(args.rate))
+            if not slots.acquire(blocking=False):
+                dropped += 1  # klient sam jest nasycony — wynik nie byłby wiarygodny
+                continue
+            thread = threading.Thread(target=guarded, args=(rnd.random(),), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    else:
+        def loop(seed):
+            local_rnd = random.Random(seed)
+            while time.monotonic() < deadline:
+                one(local_rnd)
+
+        threads = [threading.Thread(target=loop, args=(rnd.random(),), daemon=True) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    return summarize(results, elapsed, dropped)
+
+
+def summarize(results: list, elapsed: float, dropped: int) -> dict:
+    statuses = Counter(status for _, status, _ in results)
+    total = len(results)
+    latencies = sorted(latency for _, _, latency in results)
+    per_category = defaultdict(list)
+    category_statuses = defaultdict(Counter)
+    for category, status, latency in results:
+        per_category[category].append(latency)
+        category_statuses[category][status] += 1
+
+    def ms(value):
+        return round(value * 1000) if value is not None else None
+
+    errors = sum(count for status, count in statuses.items() if status == 0 or status >= 500)
+    return {
+        'requesty': total,
+        'czas_s': round(elapsed, 1),
+        'przepustowosc_rps': round(total / elapsed, 2) if elapsed else 0,
+        'udane_rps': round(statuses.get(200, 0) / elapsed, 2) if elapsed else 0,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'bledy_proc': round(errors / total * 100, 1) if total else 0,
+        'odrzucone_429_proc': round(statuses.get(429, 0) / total * 100, 1) if total else 0,
+        'pominiete_przez_klienta': dropped,
+        'statusy': {str(status): count for status, count in sorted(statuses.items())},
+        'kategorie': {
+            category: {'n': len(values), 'p50_ms': ms(percentile(sorted(values), 50)),
+                       'p95_ms': ms(percentile(sorted(values), 95)), 'p99_ms': ms(percentile(sorted(values), 99)),
+                       'statusy': {str(status): count for status, count in sorted(category_statuses[category].items())}}
+            for category, values in sorted(per_category.items())
+        },
+    }
+
+
+def _health(url: str) -> bool:
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=2)
+    try:
+        conn.request('GET', '/api/health')
+        return conn.getresponse().status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        conn.close()
+
+
+def start_server(command: str, url: str):
+    """Uruchamia konfigurację (własna grupa procesów, świeży katalog stanu) i czeka na /api/health"""
+    parts = urlsplit(url)
+    env = dict(os.environ, TANIPRAD_RUN_DIR=tempfile.mkdtemp(prefix='taniprad-loadtest-'),
+               TANIPRAD_BIND=f'{parts.hostname}:{parts.port or 80}', PYTHONUNBUFFERED='1')
+    env.pop('TANIPRAD_RESULT_DB', None)  # każda konfiguracja startuje z pustym cache
+    process = subprocess.Popen(command, shell=True, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'❌ Serwer zakończył się przy starcie (kod {process.returncode}): {command}')
+        if _health(url):
+            return process
+        time.sleep(0.5)
+    stop_server(process)
+    raise SystemExit(f'❌ Serwer nie odpowiada na /api/health po {STARTUP_TIMEOUT} s: {command}')
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def print_report(name: str, report: dict):
+    print(f"\n📈 {name}: {report['requesty']} requestów w {report['czas_s']} s — "
+          f"{report['przepustowosc_rps']} req/s ({report['udane_rps']} udanych/s)")
+    print(f"   latencja p50/p95/p99: {report['p50_ms']} / {report['p95_ms']} / {report['p99_ms']} ms")
+    print(f"   błędy: {report['bledy_proc']}%   429: {report['odrzucone_429_proc']}%   "
+          f"statusy: {report['statusy']}")
+    if report.get('pominiete_przez_klienta'):
+        print(f"   ⚠️  pominięte przez nasycenie klienta: {report['pominiete_przez_klienta']} (zwiększ --concurrency)")
+    if 'rss_szczyt_suma_mb' in report:
+        print(f"   pamięć serwera (szczyt): {report['rss_szczyt_suma_mb']} MB łącznie, "
+              f"{report['rss_szczyt_proces_mb']} MB największy proces")
+    for category, values in report['kategorie'].items():
+        print(f"   {category:<11} n={values['n']:<5} p50 {values['p50_ms']} ms  p95 {values['p95_ms']} ms  "
+              f"p99 {values['p99_ms']} ms  {values['statusy']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--corpus', required=True, help='katalog z fakturami PDF i zdjęciami')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'wagi kategorii (domyślnie {DEFAULT_MIX})')
+    parser.add_argument('--duration', type=float, default=60, help='czas pomiaru [s]')
+    parser.add_argument('--concurrency', type=int, default=8, help='wątki klienta / max requestów w toku')
+    parser.add_argument('--rate', type=float, default=0, help='pętla otwarta: średnio req/s (0 = pętla zamknięta)')
+    parser.add_argument('--clients', type=int, default=200, help='liczba symulowanych adresów IP')
+    parser.add_argument('--max-size-mb', type=float, default=10, help='limit uploadu serwera (dla kategorii za_duzy)')
+    parser.add_argument('--server', action='append', default=[], metavar='NAZWA=KOMENDA',
+                        help='konfiguracja uruchamiana przez skrypt (można powtórzyć)')
+    parser.add_argument('--pid', type=int, help='PID mastera już działającego serwera (pomiar pamięci)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='zapis raportów do pliku JSON')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    mix = parse_mix(args.mix, corpus)
+    uploads = Upload(corpus, int(args.max_size_mb * 1024 * 1024))
+    print(f"🧪 Mieszanka: {mix}; korpus: { {k: len(v) for k, v in corpus.items()} }")
+
+    configs = [tuple(spec.split('=', 1)) for spec in args.server] or [('serwer', None)]
+    reports = {}
+    for name, command in configs:
+        process = start_server(command, args.url) if command else None
+        pid = process.pid if process else args.pid
+        sampler = MemorySampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+        try:
+            print(f"🚀 {name}: {args.duration:g} s, " +
+                  (f"{args.rate:g} req/s" if args.rate else f"{args.concurrency} wątków"))
+            report = run_load(args, mix, uploads)
+        finally:
+            if sampler:
+                memory = sampler.stop()
+            if process:
+                stop_server(process)
+        if sampler:
+            report.update(memory)
+        reports[name] = report
+        print_report(name, report)
+
+    if len(reports) > 1:
+        print(f"\n{'konfiguracja':<14}{'req/s':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'błędy%':>8}{'429%':>7}{'RSS MB':>8}")
+        for name, r in reports.items():
+            print(f"{name:<14}{r['przepustowosc_rps']:>8}{r['p50_ms']:>8}{r['p95_ms']:>8}{r['p99_ms']:>8}"
+                  f"{r['bledy_proc']:>8}{r['odrzucone_429_proc']:>7}{r.get('rss_szczyt_suma_mb', '-'):>8}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Metryki procesu workera: pamięć rezydentna (RSS) i liczba obsłużonych requestów
+Aktualizowane po każdym requeście; gunicorn.conf.py na ich podstawie recyklinguje workera,
+a /api/health je raportuje.
+
+Stan parsowania (w toku, ostatnia latencja) każdy worker publikuje w małym pliku
+w TANIPRAD_RUN_DIR — /api/ready agreguje je dla całej usługi.
+"""
+import json
+import os
+import resource
+import shutil
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# Limity (0 = wyłączone)
+MAX_RSS_MB = int(os.environ.get('TANIPRAD_MAX_RSS_MB', '512'))
+MAX_REQUESTS = int(os.environ.get('TANIPRAD_MAX_REQUESTS', '1000'))
+
+# Readiness: katalog stanu workerów i progi nasycenia
+RUN_DIR = os.environ.get('TANIPRAD_RUN_DIR', '/tmp/taniprad-run')
+# Sync worker odpowiadający na /api/ready sam nie parsuje — w toku może być najwyżej
+# workers - 1 parsowań, i to jest próg nasycenia (wszystkie pozostałe workery zajęte).
+# ASGI liczy próg ze slotów torów (asgi.READY_MAX_INFLIGHT) i podaje go do readiness.
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', '4'))
+READY_MAX_INFLIGHT_ENV = int(os.environ.get('TANIPRAD_READY_MAX_INFLIGHT', '0'))
+READY_MAX_INFLIGHT = READY_MAX_INFLIGHT_ENV or max(1, WORKERS - 1)
+READY_MAX_QUEUE = int(os.environ.get('TANIPRAD_READY_MAX_QUEUE', '8'))
+LISTEN_PORT = int(os.environ.get('TANIPRAD_BIND', '0.0.0.0:8080').rsplit(':', 1)[-1])
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_lock = Lock()
+_state = {
+    'pid': os.getpid(),
+    'started': time.time(),
+    'requests': 0,
+    'rss_bytes': 0,
+    'children_rss_bytes': 0,
+    'children_rss_at': float('-inf'),  # time.monotonic ostatniego odczytu
+    'peak_rss_bytes': 0,
+    'in_flight': 0,
+    'last_parse_s': None,
+    'last_parse_at': None,
+}
+_ocr_available = None
+_child_pid_sources = []
+CHILDREN_RSS_INTERVAL = 5.0  # s między odczytami RSS procesów potomnych
+
+
+def rss_bytes() -> int:
+    """Bieżąca pamięć rezydentna procesu (Linux: /proc/self/statm, inaczej szczyt z getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # macOS zwraca bajty, Linux kilobajty — tu tylko fallback bez /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def register_child_pids(source):
+    """Źródło pid-ów procesów potomnych workera liczonych do RSS (np. pula parsera):
+    funkcja bez argumentów zwracająca pid-y"""
+    _child_pid_sources.append(source)
+
+
+def _child_pids() -> list:
+    pids = []
+    for source in _child_pid_sources:
+        try:
+            pids.extend(source())
+        except Exception:
+            continue
+    return pids
+
+
+def children_rss_bytes() -> int:
+    """Łączny RSS znanych procesów potomnych workera (zarejestrowanych przez register_child_pids).
+    Czytany najwyżej co CHILDREN_RSS_INTERVAL s — po każdym requeście wystarcza ostatni odczyt."""
+    now = time.monotonic()
+    with _lock:
+        _reset_after_fork()
+        if now - _state['children_rss_at'] < CHILDREN_RSS_INTERVAL:
+            return _state['children_rss_bytes']
+    total = 0
+    for pid in _child_pids():
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            continue
+    with _lock:
+        _state['children_rss_bytes'] = total
+        _state['children_rss_at'] = now
+    return total
+
+
+def _reset_after_fork():
+    """Stan master-a odziedziczony przez fork nie dotyczy nowego workera"""
+    if _state['pid'] != os.getpid():
+        _state.update(pid=os.getpid(), started=time.time(), requests=0, rss_bytes=0, children_rss_bytes=0,
+                      children_rss_at=float('-inf'), peak_rss_bytes=0, in_flight=0, last_parse_s=None,
+                      last_parse_at=None)
+
+
+def record_request() -> int:
+    """Zapisuje zakończony request i zmierzony RSS workera. Zwraca RSS w bajtach."""
+    rss = rss_bytes()
+    with _lock:
+        _reset_after_fork()
+        _state['requests'] += 1
+        _state['rss_bytes'] = rss
+        _state['peak_rss_bytes'] = max(_state['peak_rss_bytes'], rss)
+    return rss
+
+
+def recycle_reason():
+    """Powód recyklingu workera (przekroczony RSS workera razem z procesami potomnymi) lub None"""
+    children_rss = children_rss_bytes()
+    with _lock:
+        _reset_after_fork()
+        rss = _state['rss_bytes'] + children_rss
+    if MAX_RSS_MB and rss > MAX_RSS_MB * 1024 * 1024:
+        return f"RSS {rss / 1024 / 1024:.0f} MB (z procesami potomnymi) > limit {MAX_RSS_MB} MB"
+    return None
+
+
+def snapshot() -> dict:
+    """Metryki bieżącego workera do raportowania w /api/health"""
+    rss = rss_bytes()
+    children_rss = children_rss_bytes()
+    with _lock:
+        _reset_after_fork()
+        _state['peak_rss_bytes'] = max(_state['peak_rss_bytes'], rss)
+        state = dict(_state, rss_bytes=rss, children_rss_bytes=children_rss)
+    return {
+        'pid': state['pid'],
+        'uptime_s': round(time.time() - state['started'], 1),
+        'requests': state['requests'],
+        'rss_mb': round(state['rss_bytes'] / 1024 / 1024, 1),
+        'children_rss_mb': round(state['children_rss_bytes'] / 1024 / 1024, 1),
+        'peak_rss_mb': round(state['peak_rss_bytes'] / 1024 / 1024, 1),
+        'max_rss_mb': MAX_RSS_MB,
+        'max_requests': MAX_REQUESTS,
+    }
+
+
+@contextmanager
+def track_parse():
+    """Oznacza parsowanie w toku (PDF lub OCR) i zapisuje jego latencję"""
+    with _lock:
+        _reset_after_fork()
+        _state['in_flight'] += 1
+    _publish()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _state['in_flight'] -= 1
+            _state['last_parse_s'] = round(elapsed, 3)
+            _state['last_parse_at'] = time.time()
+        _publish()
+
+
+def _state_path(pid: int) -> str:
+    return os.path.join(RUN_DIR, f'worker-{pid}.json')
+
+
+def _publish():
+    """Zapisuje stan parsowania workera (atomowo: plik tymczasowy + rename)"""
+    with _lock:
+        data = {k: _state[k] for k in ('pid', 'in_flight', 'last_parse_s', 'last_parse_at')}
+    try:
+        os.makedirs(RUN_DIR, exist_ok=True)
+        tmp = _state_path(data['pid']) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, _state_path(data['pid']))
+    except OSError as e:
+        print(f"⚠️  Nie udało się zapisać stanu workera: {e}")
+
+
+def unpublish():
+    """Usuwa plik stanu workera (wywoływane przy wyjściu workera)"""
+    try:
+        os.remove(_state_path(os.getpid()))
+    except OSError:
+        pass
+
+
+def _workers_state() -> list:
+    """Stan wszystkich żywych workerów; pliki martwych procesów są usuwane"""
+    states = []
+    try:
+        names = os.listdir(RUN_DIR)
+    except OSError:
+        return states
+    for name in names:
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        path = os.path.join(RUN_DIR, name)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            os.kill(data['pid'], 0)
+        except ProcessLookupError:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        except (OSError, ValueError, KeyError):
+            continue
+        states.append(data)
+    return states
+
+
+def listen_queue_depth(port: int = LISTEN_PORT):
+    """Liczba połączeń czekających w kolejce accept() gniazda nasłuchującego (Linux, /proc/net/tcp*).
+    Dla gniazd w stanie LISTEN kolumna rx_queue to bieżąca długość kolejki. None jeśli niedostępne."""
+    port_hex = f':{port:04X}'
+    depth = None
+    for proc_file in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(proc_file) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[3] == '0A' and fields[1].endswith(port_hex):
+                        depth = (depth or 0) + int(fields[4].split(':')[1], 16)
+        except (OSError, StopIteration, IndexError, ValueError):
+            continue
+    return depth
+
+
+def ocr_available() -> bool:
+    """Czy binarka tesseract jest dostępna (sprawdzane raz na proces)"""
+    global _ocr_available
+    if _ocr_available is None:
+        _ocr_available = shutil.which('tesseract') is not None
+    return _ocr_available
+
+
+def readiness(max_in_flight: int = READY_MAX_INFLIGHT):
+    """Nasycenie usługi: (gotowa, szczegóły). Niegotowa, gdy przekroczony próg parsowań w toku lub kolejki."""
+    workers = _workers_state()
+    in_flight = sum(w.get('in_flight', 0) for w in workers)
+    busy_workers = sum(1 for w in workers if w.get('in_flight') and w['pid'] != os.getpid())
+    queue = listen_queue_depth()
+    finished = [w for w in workers if w.get('last_parse_at')]
+    last = max(finished, key=lambda w: w['last_parse_at']) if finished else None
+
+    reasons = []
+    if max_in_flight and in_flight >= max_in_flight:
+        reasons.append(f'parsowania w toku: {in_flight} >= {max_in_flight}')
+    if READY_MAX_QUEUE and queue is not None and queue > READY_MAX_QUEUE:
+        reasons.append(f'kolejka połączeń: {queue} > {READY_MAX_QUEUE}')
+
+    return not reasons, {
+        'in_flight': in_flight,
+        'busy_workers': busy_workers,
+        'queue_depth': queue,
+        'workers_reporting': len(workers),
+        'ocr_available': ocr_available(),
+        'last_parse_s': last['last_parse_s'] if last else None,
+        'last_parse_age_s': round(time.time() - last['last_parse_at'], 1) if last else None,
+        'limits': {'max_in_flight': max_in_flight, 'max_queue': READY_MAX_QUEUE},
+        'reasons': reasons,
+    }
@@ -0,0 +1,86 @@
+"""
+Typowane rekordy wyników kalkulatora (klasy z __slots__)
+oraz szybka serializacja odpowiedzi JSON (orjson, jeśli jest zainstalowany)
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson jest opcjonalny — fallback na json ze stdlib
+    orjson = None
+
+
+class PozycjaRozliczenia:
+    """Pozycja faktury: wartość netto przed i po zmianach ustawy"""
+    __slots__ = ('nazwa', 'kategoria', 'before', 'after', 'zerowana')
+
+    def __init__(self, nazwa: str, kategoria: str, before: float, after: float, zerowana: bool = False):
+        self.nazwa = nazwa
+        self.kategoria = kategoria
+        self.before = before
+        self.after = after
+        self.zerowana = zerowana
+
+    def __repr__(self):
+        return f"PozycjaRozliczenia({self.nazwa!r}, {self.kategoria!r}, {self.before!r} → {self.after!r})"
+
+
+class Rozliczenie:
+    """Sumy faktury po jednej stronie porównania (przed lub po zmianach).
+    Obie strony współdzielą tę samą listę pozycji — strona 'after' czyta pole after."""
+    __slots__ = ('pozycje', 'suma_netto', 'vat_procent', 'vat_kwota', 'suma_brutto', 'po_zmianach')
+
+    def __init__(self, pozycje: list, suma_netto: float, vat_procent: float, vat_kwota: float,
+                 suma_brutto: float, po_zmianach: bool = False):
+        self.pozycje = pozycje
+        self.suma_netto = suma_netto
+        self.vat_procent = vat_procent
+        self.vat_kwota = vat_kwota
+        self.suma_brutto = suma_brutto
+        self.po_zmianach = po_zmianach
+
+    def to_dict(self) -> dict:
+        if self.po_zmianach:
+            pozycje = [{'nazwa': p.nazwa, 'wartosc': p.after, 'kategoria': p.kategoria, 'zerowana': p.zerowana}
+                       for p in self.pozycje]
+        else:
+            pozycje = [{'nazwa': p.nazwa, 'wartosc': p.before, 'kategoria': p.kategoria}
+                       for p in self.pozycje]
+        return {
+            'pozycje': pozycje,
+            'suma_netto': self.suma_netto,
+            'vat_procent': self.vat_procent,
+            'vat_kwota': self.vat_kwota,
+            'suma_brutto': self.suma_brutto,
+        }
+
+
+class Oszczednosci:
+    """Oszczędności w rozbiciu na 4 filary ustawy"""
+    __slots__ = ('filar1_vat', 'filar2_certyfikaty', 'filar3_dystrybucja', 'filar4_oplaty', 'total', 'percent')
+
+    def __init__(self, filar1_vat: float, filar2_certyfikaty: float, filar3_dystrybucja: float,
+                 filar4_oplaty: float, total: float, percent: float):
+        self.filar1_vat = filar1_vat
+        self.filar2_certyfikaty = filar2_certyfikaty
+        self.filar3_dystrybucja = filar3_dystrybucja
+        self.filar4_oplaty = filar4_oplaty
+        self.total = total
+        self.percent = percent
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _json_default(obj):
+    """Serializacja rekordów — wywoływana przez encoder tylko dla nie-JSON-owych typów"""
+    if isinstance(obj, (Rozliczenie, Oszczednosci)):
+        return obj.to_dict()
+    raise TypeError(f'Obiekt typu {type(obj).__name__} nie jest serializowalny do JSON')
+
+
+def dumps(obj) -> bytes:
+    """Serializuje odpowiedź API do JSON (bytes, UTF-8)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default)
+    return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,257 @@
+"""
+OCR zdjęć faktur (Tesseract), opcjonalnie ograniczony do regionów z tekstem
+Przed OCR obraz jest binaryzowany (próg Otsu), a profile projekcji (suma "atramentu"
+w wierszach i kolumnach, liczona przez zmniejszenie obrazu filtrem BOX) wyznaczają
+bloki tekstu i tabele. Tesseract czyta stronę z zamaskowanym tłem (poza regionami
+biało) jednym wywołaniem; kolumny kwot — drugim wywołaniem, tylko one na białym tle,
+z białą listą cyfr i interpunkcji, bo przecinki w kwotach są najczęstszym błędem
+odczytu. Każde wywołanie pytesseract to osobny proces tesseract (ładowanie modelu
+języka), więc na stronę przypadają najwyżej dwa, niezależnie od liczby regionów.
+Słowa składane są z powrotem w linie według współrzędnych, tak jak w tekście z PDF.
+Zdjęcia kolejnych stron jednej faktury OCR-owane są równolegle (pula wątków — pracę
+wykonują procesy tesseract), tekst składany w kolejności stron.
+
+Zmienne środowiskowe:
+  TANIPRAD_OCR_ROI       0 = jeden przebieg Tesseracta po całym obrazie (jak dawniej);
+                         porównanie obu trybów na zdjęciach: bench_ocr.py
+  TANIPRAD_OCR_THREADS   strony OCR-owane jednocześnie w procesie (domyślnie 4)
+
+Termin (deadline, time.monotonic) z toru wykonania przekazywany jest do Tesseracta jako
+timeout procesu — po jego upływie OCR kończy się TimeoutError zamiast blokować worker.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from typing import List, Tuple
+
+OCR_LANG = 'pol'
+OCR_ROI = os.environ.get('TANIPRAD_OCR_ROI', '1') == '1'
+OCR_THREADS = int(os.environ.get('TANIPRAD_OCR_THREADS', '4'))
+
+# Strony idą równolegle — wątki OpenMP samego Tesseracta tylko by z nimi konkurowały
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+ANALYSIS_WIDTH = 1000       # szerokość obrazu do analizy układu (px)
+INK_THRESHOLD = 2           # min. średni "atrament" wiersza/kolumny (0-255), poniżej = tło
+BLOCK_GAP_LINES = 1.2       # przerwa między liniami (× wysokość linii), od której zaczyna się nowy blok
+COLUMN_GAP_LINES = 1.5      # przerwa w bloku (× wysokość linii) rozdzielająca kolumny tabeli
+MIN_TABLE_COLUMNS = 3
+NUMERIC_SHARE = 0.6         # udział cyfr w kolumnie, od którego to kolumna kwot
+
+TEXT_CONFIG = '--psm 3'     # zamaskowana strona: automatyczny podział na bloki
+AMOUNT_CONFIG = '--psm 6 -c tessedit_char_whitelist=0123456789,.-%'
+
+Box = Tuple[int, int, int, int]     # (lewo, góra, prawo, dół) jak w PIL
+Word = Tuple[int, int, int, str]    # (góra, wysokość, lewo, tekst)
+
+_pool = None
+_pool_pid = None
+
+
+def _otsu(histogram: List[int]) -> int:
+    """Próg binaryzacji Otsu z histogramu obrazu w skali szarości"""
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg = weight_bg = 0
+    best, threshold = -1.0, 128
+    for i, h in enumerate(histogram):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+
+def _profile(binary, rows: bool) -> List[int]:
+    """Średni atrament każdego wiersza (rows) albo kolumny — zmniejszenie do 1 px filtrem BOX"""
+    from PIL import Image
+
+    size = (1, binary.height) if rows else (binary.width, 1)
+    return list(binary.resize(size, Image.BOX).getdata())
+
+
+def _runs(profile: List[int], min_gap: int = 1) -> List[Tuple[int, int]]:
+    """Przedziały [start, koniec) z atramentem; przerwy krótsze niż min_gap są sklejane"""
+    runs = []
+    start = None
+    for i, value in enumerate(profile):
+        if value > INK_THRESHOLD:
+            if start is None:
+                start = i
+        elif start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(profile)))
+
+    merged = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] < min_gap:
+            merged[-1] = (merged[-1][0], run[1])
+        else:
+            merged.append(run)
+    return merged
+
+
+def find_regions(gray) -> List[Tuple[Box, bool, int]]:
+    """
+    Regiony do OCR: (box w pikselach obrazu, czy kolumna tabeli, numer kolumny).
+    Linie tekstu z profilu wierszy łączone są w bloki; blok z co najmniej
+    MIN_TABLE_COLUMNS kolumnami rozdzielonymi szeroką przerwą to tabela.
+    """
+    from PIL import Image
+
+    scale = min(1.0, ANALYSIS_WIDTH / gray.width)
+    small = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))), Image.BOX) \
+        if scale < 1.0 else gray
+    threshold = _otsu(small.histogram())
+    binary = small.point([255 if v <= threshold else 0 for v in range(256)])  # atrament = 255
+
+    lines = [run for run in _runs(_profile(binary, rows=True)) if run[1] - run[0] >= 3]
+    if not lines:
+        return []
+    line_height = median(end - start for start, end in lines)
+
+    blocks = [list(lines[0])]
+    for start, end in lines[1:]:
+        if start - blocks[-1][1] < BLOCK_GAP_LINES * line_height:
+            blocks[-1][1] = end
+        else:
+            blocks.append([start, end])
+
+    pad = max(2, int(line_height * 0.3))
+    regions = []
+    for top, bottom in blocks:
+        columns = _runs(_profile(binary.crop((0, top, binary.width, bottom)), rows=False),
+                        min_gap=int(COLUMN_GAP_LINES * line_height))
+        if not columns:
+            continue
+        is_table = len(columns) >= MIN_TABLE_COLUMNS
+        if not is_table:
+            columns = [(columns[0][0], columns[-1][1])]
+        for number, (left, right) in enumerate(columns):
+            box = (max(0, int((left - pad) / scale)), max(0, int((top - pad) / scale)),
+                   min(gray.width, int((right + pad) / scale) + 1), min(gray.height, int((bottom + pad) / scale) + 1))
+            regions.append((box, is_table, number))
+    return regions
+
+
+def _remaining(deadline: float = None) -> float:
+    """Sekundy do terminu dla timeoutu pytesseract (0 = bez limitu). TimeoutError po terminie."""
+    if deadline is None:
+        return 0
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError('OCR: przekroczony limit czasu')
+    return remaining
+
+
+def _tesseract(call, *args, deadline: float = None, **kwargs):
+    """Wywołanie pytesseract z timeoutem do terminu; przerwany proces → TimeoutError"""
+    try:
+        return call(*args, timeout=_remaining(deadline), **kwargs)
+    except RuntimeError as e:
+        if 'timeout' in str(e).lower():
+            raise TimeoutError('OCR: przekroczony limit czasu') from e
+        raise
+
+
+def _masked(gray, boxes: List[Box]):
+    """Obraz wielkości oryginału: regiony boxes bez zmian, reszta biała (współrzędne słów jak w oryginale)"""
+    from PIL import Image
+
+    page = Image.new('L', gray.size, 255)
+    for box in boxes:
+        page.paste(gray.crop(box), box[:2])
+    return page
+
+
+def _ocr_words(image, config: str, deadline: float = None) -> List[Word]:
+    """Słowa obrazu (image_to_data) — jedno wywołanie tesseract"""
+    import pytesseract
+
+    data = _tesseract(pytesseract.image_to_data, image, lang=OCR_LANG, config=config,
+                      output_type=pytesseract.Output.DICT, deadline=deadline)
+    words = []
+    for text, left, top, height, conf in zip(data['text'], data['left'], data['top'], data['height'], data['conf']):
+        text = text.strip()
+        if text and float(conf) >= 0:
+            words.append((top, height, left, text))
+    return words
+
+
+def _in_box(word: Word, box: Box) -> bool:
+    """Czy słowo (jego lewa krawędź i środek w pionie) leży w regionie"""
+    top, height, left, _ = word
+    return box[0] <= left < box[2] and box[1] <= top + height / 2 < box[3]
+
+
+def _is_numeric(words: List[Word]) -> bool:
+    chars = ''.join(word[3] for word in words)
+    return bool(chars) and sum(ch.isdigit() for ch in chars) / len(chars) >= NUMERIC_SHARE
+
+
+def assemble_lines(words: List[Word]) -> str:
+    """Składa słowa z wielu regionów w linie: wspólny środek w pionie, kolejność od lewej"""
+    lines = []  # [środek linii, wysokość, słowa]
+    for top, height, left, text in sorted(words, key=lambda w: w[0] + w[1] / 2):
+        center = top + height / 2
+        if lines and abs(center - lines[-1][0]) < max(height, lines[-1][1]) / 2:
+            lines[-1][2].append((left, text))
+        else:
+            lines.append([center, height, [(left, text)]])
+    return '\n'.join(' '.join(text for _, text in sorted(line[2])) for line in lines)
+
+
+def extract_text(filepath: str, deadline: float = None) -> str:
+    """Tekst ze zdjęcia faktury: OCR regionów z tekstem, w razie braku regionów — całego obrazu"""
+    import pytesseract
+    from PIL import Image, ImageOps
+
+    gray = ImageOps.exif_transpose(Image.open(filepath)).convert('L')  # zdjęcia z telefonu: orientacja z EXIF
+    if OCR_ROI:
+        start = time.perf_counter()
+        regions = find_regions(gray)
+        words = _ocr_words(_masked(gray, [box for box, _, _ in regions]), TEXT_CONFIG, deadline) if regions else []
+        # Kolumny tabeli poza pierwszą (opis pozycji): kwoty czytane ponownie tylko cyframi
+        amounts = [box for box, is_table, number in regions
+                   if is_table and number > 0 and _is_numeric([w for w in words if _in_box(w, box)])]
+        if amounts:
+            words = [w for w in words if not any(_in_box(w, box) for box in amounts)]
+            words.extend(_ocr_words(_masked(gray, amounts), AMOUNT_CONFIG, deadline))
+        if words:
+            area = sum((b[2] - b[0]) * (b[3] - b[1]) for b, _, _ in regions) / (gray.width * gray.height)
+            print(f"🔤 OCR: {len(regions)} regionów ({area:.0%} obrazu, {len(amounts)} kolumn kwot) "
+                  f"w {time.perf_counter() - start:.2f} s")
+            return assemble_lines(words)
+
+    return _tesseract(pytesseract.image_to_string, gray, lang=OCR_LANG, deadline=deadline)
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Pula OCR stron tworzona leniwie w procesie workera (wątki nie przeżywają fork)"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ThreadPoolExecutor(max_workers=OCR_THREADS, thread_name_prefix='taniprad-ocr')
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def extract_pages_text(filepaths: List[str], deadline: float = None) -> str:
+    """Tekst faktury ze zdjęć kolejnych stron: OCR stron równolegle, tekst w kolejności plików.
+    Czas ≈ najwolniejsza strona, nie suma stron."""
+    if len(filepaths) == 1:
+        return extract_text(filepaths[0], deadline)
+    start = time.perf_counter()
+    texts = list(_get_pool().map(extract_text, filepaths, [deadline] * len(filepaths)))
+    print(f"🔤 OCR {len(filepaths)} stron w {time.perf_counter() - start:.2f} s")
+    return '\n'.join(texts)
@@ -4,11 +4,147 @@ Wykorzystuje pdfplumber do ekstrakcji tabel i strukturyzowanych danych
 Obsługuje dostawców: E.ON, PGE, TAURON, Lumi PGE (i podobne formaty)
 Rozróżnia typ dokumentu: faktura rozliczeniowa vs prognoza
 """
+import multiprocessing
+import os
 import re
-import pdfplumber
-from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
 from decimal import Decimal
 
+from table_index import TableIndex
+from text_index import REGEX_MAX_WINDOW, TextIndex
+
+# Pakiety wielu faktur w jednym PDF (eBOK): kotwice początku dokumentu w nagłówku strony
+SEGMENT_ANCHOR_RE = re.compile(r'(?:FAKTURA\s+VAT\s+NR|Prognoza/EE/)\s*([\w/.-]+)', re.IGNORECASE)
+SEGMENT_HEAD_LINES = 15
+
+# Wersja reprezentacji pośredniej (IR: tekst, tabele, dostawca po ekstrakcji)
+# — podbijać przy każdej zmianie ekstrakcji, która zmienia tekst lub tabele
+IR_VERSION = 1
+
+# Wersja wyniku parsowania (pola faktury z IR / tekstu) — klucz trwałego cache wyników
+# (result_cache.ResultStore); podbijać przy każdej zmianie parsowania lub kształtu odpowiedzi
+PARSER_VERSION = 5
+
+# Parsowanie warstwowe: najpierw sam tekst 1. strony (bez wyszukiwania tabel),
+# pełna ekstrakcja tabel tylko gdy wynik nie przejdzie kontroli spójności
+TEXT_TIER = os.environ.get('TANIPRAD_TEXT_TIER', '1') == '1'
+TIER_TEXT = 'tekst'
+TIER_TABLES = 'tabele'
+TIER_OCR = 'ocr'                  # tekst z OCR zdjęć — parsowany jak warstwa tekstowa
+TIER_TOTALS_TOLERANCE = 0.05      # zł: |netto + VAT - brutto|
+TIER_ITEMS_TOLERANCE = 0.01       # względna: |suma pozycji - suma netto|
+TIER_KWH_RANGE = (10, 100000)     # kWh w okresie rozliczeniowym
+TIER_PRICE_RANGE = (0.05, 10.0)   # zł netto za kWh (z opłatami stałymi)
+TIER_FORECAST_AMOUNT_RANGE = (1.0, 100000.0)  # zł brutto prognozy
+# Metadane pokazywane w UI — warstwa tekstowa czyta tylko 1. stronę, a część dostawców
+# drukuje je dalej (np. okres ENEA na str. 2); brak któregoś = pełna ekstrakcja
+TIER_METADATA_FIELDS = ('numer_faktury', 'data_faktury', 'okres_rozliczeniowy')
+
+# Równoległe parsowanie segmentów — liczba procesów puli na workera. Każdy worker usługi
+# ma własną pulę, więc domyślnie rdzenie hosta dzielone są między workery (WEB_CONCURRENCY)
+WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY', '4'))
+PARSE_PROCESSES = (int(os.environ.get('TANIPRAD_PARSE_PROCESSES', '0'))
+                   or max(1, (os.cpu_count() or 1) // max(1, WEB_WORKERS)))
+
+# Długi dokument (roczne rozliczenie, wiele liczników): zakresy stron ekstrahowane w puli
+# procesów od tej liczby stron (0 = wyłączone); zakres ma co najmniej PAGE_CHUNK_MIN_PAGES stron.
+# Pomiar (pula już uruchomiona): strona ~15-25 ms, dodatkowy zakres (otwarcie PDF w procesie
+# puli, przesłanie tekstu i tabel) ~20-40 ms — od 8 stron w 2 procesach zysk ≥ ~70 ms.
+# Przy PARSE_PROCESSES = 1 (host jednordzeniowy) podział jest pomijany
+PAGE_PARALLEL_MIN_PAGES = int(os.environ.get('TANIPRAD_PAGE_PARALLEL_MIN_PAGES', '8'))
+PAGE_CHUNK_MIN_PAGES = 4
+
+_process_pool = None
+_process_pool_pid = None
+
+PAGE_COUNT_CACHE_SIZE = 64
+_page_counts = {}  # (ścieżka, rozmiar, mtime_ns) -> liczba stron
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Pula procesów tworzona leniwie, osobno w każdym procesie (np. workerze gunicorna).
+    Procesy startowane przez forkserver, nie fork: workery mają wątki (tory ASGI, OCR, SQLite),
+    a fork wielowątkowego procesu może zostawić w dziecku zablokowany lock."""
+    global _process_pool, _process_pool_pid
+    if _process_pool is None or _process_pool_pid != os.getpid():
+        _process_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES,
+                                            mp_context=multiprocessing.get_context('forkserver'))
+        _process_pool_pid = os.getpid()
+    return _process_pool
+
+
+def pool_pids() -> List[int]:
+    """Pid-y procesów puli tego workera i jej forkservera — RSS workera w metrics (recykling)"""
+    if _process_pool is None or _process_pool_pid != os.getpid():
+        return []
+    pids = list(getattr(_process_pool, '_processes', None) or ())
+    from multiprocessing import forkserver
+
+    server_pid = getattr(forkserver._forkserver, '_forkserver_pid', None)
+    if server_pid:
+        pids.append(server_pid)
+    return pids
+
+
+def _reset_process_pool():
+    """Porzuca uszkodzoną pulę (np. po zabiciu procesu potomnego) — następne użycie utworzy nową"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _process_pool = None
+
+
+def _extract_segment(filepath: str, pages: List[int], tiered: bool = False) -> Dict:
+    """Ekstrahuje IR zakresu stron (numeracja od 1) w procesie puli (segmenty już są równoległe —
+    bez dzielenia na zakresy stron)"""
+    parser = InvoiceParser()
+    if tiered:
+        return parser.extract_ir_tiered(filepath, pages=pages, parallel=False)
+    return parser.extract_ir(filepath, pages=pages, parallel=False)
+
+
+def _extract_page_range(filepath: str, pages: List[int]) -> Tuple[str, List]:
+    """Surowy tekst i tabele zakresu stron (numeracja od 1) w procesie puli"""
+    import pdfplumber
+
+    with pdfplumber.open(filepath, pages=pages) as pdf:
+        return InvoiceParser()._extract_pages(pdf)
+
+
+def page_count(filepath: str) -> int:
+    """Liczba stron z pypdfium2 (bez parsowania treści); 0, gdy się nie da.
+    Zapamiętywana na plik (ścieżka, rozmiar, mtime) — szacowanie kosztu toru (scheduler),
+    wykrywanie segmentów i podział na zakresy stron czytają ją raz na upload."""
+    try:
+        stat = os.stat(filepath)
+    except (OSError, TypeError, ValueError):
+        return 0
+    key = (filepath, stat.st_size, stat.st_mtime_ns)
+    if key not in _page_counts:
+        try:
+            import pypdfium2
+            document = pypdfium2.PdfDocument(filepath)
+            try:
+                count = len(document)
+            finally:
+                document.close()
+        except Exception:
+            return 0
+        if len(_page_counts) >= PAGE_COUNT_CACHE_SIZE:
+            _page_counts.clear()  # uploady to pliki tymczasowe — stare wpisy i tak nie wrócą
+        _page_counts[key] = count
+    return _page_counts[key]
+
+
+def _page_chunks(pages: List[int]) -> List[List[int]]:
+    """Ciągłe zakresy stron dla puli: najwyżej tyle, ile procesów ma pula tego workera
+    (PARSE_PROCESSES — jego część rdzeni hosta), nie krótsze niż PAGE_CHUNK_MIN_PAGES"""
+    count = min(PARSE_PROCESSES, max(1, len(pages) // PAGE_CHUNK_MIN_PAGES))
+    size = -(-len(pages) // count)
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
 
 class InvoiceParser:
     """Parser faktur za energię elektryczną"""
@@ -50,42 +186,300 @@ class InvoiceParser:
                 'opł. moc',
             ]
         }
+        self._index = None
+        self._tables = None
+
+    def _text_index(self, text: str) -> TextIndex:
+        """Indeks tekstu bieżącego dokumentu — budowany raz, współdzielony przez ekstraktory"""
+        if self._index is None or self._index.text is not text:
+            self._index = TextIndex(text)
+        return self._index
+
+    def _table_index(self, tables: List) -> TableIndex:
+        """Znormalizowane tabele bieżącego dokumentu — budowane raz, współdzielone przez parsery tabel"""
+        if self._tables is None or self._tables.source is not tables:
+            self._tables = TableIndex(tables)
+        return self._tables
+
+    def parse_pdf_bundle(self, filepath: str, tiered: bool = False) -> List[Dict]:
+        """Parsuje PDF, który może zawierać wiele dokumentów (np. roczny pakiet faktur z eBOK).
+        Zwraca listę wyników w kolejności stron."""
+        return [self.parse_ir(ir) for ir in self.extract_bundle_ir(filepath, tiered=tiered)]
+
+    def extract_bundle_ir(self, filepath: str, tiered: bool = False) -> List[Dict]:
+        """Ekstrahuje IR każdego dokumentu w PDF. Segmenty ekstrahowane osobno w puli procesów.
+        tiered: najpierw warstwa tekstowa (extract_ir_tiered)."""
+        segments = self._detect_segments(filepath)
+        if len(segments) <= 1:
+            return [self.extract_ir_tiered(filepath) if tiered else self.extract_ir(filepath)]
+
+        print(f"📚 Pakiet dokumentów: {len(segments)} segmentów")
+        page_ranges = [[page + 1 for page in segment] for segment in segments]
+        try:
+            pool = _get_process_pool()
+            documents = list(pool.map(_extract_segment, [filepath] * len(page_ranges), page_ranges,
+                                      [tiered] * len(page_ranges)))
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠️  Pula procesów niedostępna ({e}) — ekstrakcja sekwencyjna")
+            _reset_process_pool()
+            documents = [_extract_segment(filepath, pages, tiered) for pages in page_ranges]
+
+        for ir, pages in zip(documents, page_ranges):
+            ir['strony'] = [pages[0], pages[-1]]
+        return documents
+
+    def _detect_segments(self, filepath: str) -> List[List[int]]:
+        """Dzieli dokument na segmenty (listy stron od 0) wg kotwic w nagłówkach stron.
+        Nowy segment zaczyna strona z kotwicą innego dokumentu niż bieżący segment.
+        Tekst stron z pypdfium2 (zależność pdfplumbera) — dziesiątki razy szybciej niż layout pdfminer.
+        Jednostronicowy PDF (liczba stron zwykle już znana z wyboru toru) nie jest otwierany."""
+        if page_count(filepath) == 1:
+            return [[0]]
+        try:
+            import pypdfium2
+            document = pypdfium2.PdfDocument(filepath)
+        except Exception as e:
+            print(f"⚠️  Nie udało się wykryć segmentów ({e}) — dokument jako całość")
+            return []
+
+        segments = []
+        current_id = None
+        try:
+            for index in range(len(document)):
+                page = document[index]
+                textpage = page.get_textpage()
+                head = '\n'.join(textpage.get_text_range().splitlines()[:SEGMENT_HEAD_LINES])
+                textpage.close()
+                page.close()
+
+                match = SEGMENT_ANCHOR_RE.search(head)
+                doc_id = re.sub(r'\s+', ' ', match.group(0)).upper() if match else None
+
+                if not segments or (doc_id and current_id and doc_id != current_id):
+                    segments.append([index])
+                    current_id = doc_id
+                else:
+                    segments[-1].append(index)
+                    current_id = current_id or doc_id
+        finally:
+            document.close()
+        return segments
+
+    def parse_pdf(self, filepath: str, pages: Optional[List[int]] = None) -> Dict:
+        """Główna metoda parsowania PDF (filepath: ścieżka lub obiekt plikowy;
+        pages: opcjonalnie tylko wybrane strony, numeracja od 1)"""
+        return self.parse_ir(self.extract_ir(filepath, pages=pages))
+
+    def extract_ir(self, filepath: str, pages: Optional[List[int]] = None, parallel: bool = True) -> Dict:
+        """Ekstrakcja (kosztowna część parsowania): tekst, tabele i dostawca jako IR.
+        IR to zwykły słownik JSON-owalny — można go zapisać i sparsować ponownie bez PDF.
+        parallel: długi dokument dzielony na zakresy stron ekstrahowane w puli procesów."""
+        import pdfplumber  # leniwie — pdfminer ładowany przy pierwszym parsowaniu
+
+        extracted = self._extract_pages_parallel(filepath, pages) if parallel else None
+        if extracted is not None:
+            text, tables = extracted
+        else:
+            with pdfplumber.open(filepath, pages=pages) as pdf:
+                # Ekstraktuj tekst i tabele — strona po stronie, z releasem cache
+                text, tables = self._extract_pages(pdf)
+
+        # Sprawdź czy tekst ma podwojone znaki (TAURON)
+        if self._is_text_duplicated(text):
+            text = self._dedup_text(text)
+            tables = self._dedup_tables(tables)
+
+        return {
+            'ir_version': IR_VERSION,
+            'tier': TIER_TABLES,
+            'text': text,
+            'tables': tables,
+            'provider': self._detect_provider(text),
+        }
 
-    def parse_pdf(self, filepath: str) -> Dict:
-        """Główna metoda parsowania PDF"""
-        with pdfplumber.open(filepath) as pdf:
-            # Ekstraktuj tekst
-            text = self._extract_text(pdf)
-
-            # Ekstraktuj tabele
-            tables = self._extract_tables(pdf)
-
-            # Sprawdź czy tekst ma podwojone znaki (TAURON)
-            needs_dedup = self._is_text_duplicated(text)
-            if needs_dedup:
-                text = self._dedup_text(text)
-                tables = self._dedup_tables(tables)
+    def _extract_pages_parallel(self, filepath, pages: Optional[List[int]]):
+        """(tekst, tabele) długiego dokumentu z zakresów stron ekstrahowanych w puli procesów,
+        złożone w kolejności stron — jak _extract_pages. None: dokument krótki albo nie z pliku."""
+        if not PAGE_PARALLEL_MIN_PAGES or PARSE_PROCESSES < 2 or not isinstance(filepath, str):
+            return None
+        pages = pages or list(range(1, page_count(filepath) + 1))
+        if len(pages) < PAGE_PARALLEL_MIN_PAGES:
+            return None
+
+        chunks = _page_chunks(pages)
+        print(f"📑 Długi dokument: {len(pages)} stron w {len(chunks)} zakresach równolegle")
+        try:
+            pool = _get_process_pool()
+            parts = list(pool.map(_extract_page_range, [filepath] * len(chunks), chunks))
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠️  Pula procesów niedostępna ({e}) — ekstrakcja sekwencyjna")
+            _reset_process_pool()
+            return None
+        return ''.join(text for text, _ in parts), [table for _, tables in parts for table in tables]
+
+    def extract_text_ir(self, filepath: str, pages: Optional[List[int]] = None) -> Dict:
+        """Warstwa tekstowa: IR z samego tekstu pierwszej strony (bez wyszukiwania tabel)"""
+        import pdfplumber
+
+        with pdfplumber.open(filepath, pages=pages[:1] if pages else [1]) as pdf:
+            page = pdf.pages[0]
+            try:
+                text = page.extract_text() or ""
+            finally:
+                self._release_page(page)
+
+        if self._is_text_duplicated(text):
+            text = self._dedup_text(text)
+
+        return {
+            'ir_version': IR_VERSION,
+            'tier': TIER_TEXT,
+            'text': text,
+            'tables': [],
+            'provider': self._detect_provider(text),
+        }
 
-            # Wykryj dostawcę
-            provider = self._detect_provider(text)
+    def text_ir(self, text: str, tier: str = TIER_OCR) -> Dict:
+        """IR z gotowego tekstu (OCR zdjęć stron) — bez tabel"""
+        return {
+            'ir_version': IR_VERSION,
+            'tier': tier,
+            'text': text,
+            'tables': [],
+            'provider': self._detect_provider(text),
+        }
 
-            # Wykryj typ dokumentu (faktura vs prognoza)
-            doc_type = self._detect_document_type(text, provider)
+    def parse_text(self, text: str) -> Dict:
+        """Parsuje fakturę z tekstu (np. OCR zdjęć stron złożony w kolejności stron)"""
+        return self.parse_ir(self.text_ir(text))
+
+    def extract_ir_tiered(self, filepath: str, pages: Optional[List[int]] = None, parallel: bool = True) -> Dict:
+        """IR warstwy tekstowej, jeśli jej wynik jest spójny; inaczej pełna ekstrakcja z tabelami.
+        Powody eskalacji zapisywane są w IR (pole 'eskalacja')."""
+        ir = self.extract_text_ir(filepath, pages=pages)
+        problems = self.consistency_problems(self.parse_ir(ir))
+        if not problems:
+            return ir
+
+        print(f"🔎 Warstwa tekstowa niespójna ({'; '.join(problems)}) — ekstrakcja tabel")
+        ir = self.extract_ir(filepath, pages=pages, parallel=parallel)
+        ir['eskalacja'] = problems
+        return ir
+
+    def consistency_problems(self, result: Dict) -> List[str]:
+        """Kontrole spójności wyniku faktury lub prognozy; pusta lista = wynik wiarygodny"""
+        if result.get('_regex_over_budget'):
+            return [f"budżet regex wyczerpany ({len(result['_regex_over_budget'])} wzorców)"]
+        if result.get('typ_dokumentu') == self.DOC_TYPE_FORECAST:
+            return self._forecast_problems(result)
+        if result.get('typ_dokumentu') != self.DOC_TYPE_INVOICE:
+            return [f"typ dokumentu: {result.get('typ_dokumentu')}"]
+
+        problems = []
+        missing = [field for field in TIER_METADATA_FIELDS if not result.get(field)]
+        if missing:
+            problems.append(f"brak metadanych ({', '.join(missing)})")
+
+        netto = result.get('suma_netto') or 0
+        vat = result.get('vat_kwota') or 0
+        brutto = result.get('suma_brutto') or 0
+        if netto <= 0 or brutto <= 0:
+            problems.append('brak sum')
+        elif abs(netto + vat - brutto) > TIER_TOTALS_TOLERANCE:
+            problems.append(f'netto + VAT != brutto ({netto} + {vat} != {brutto})')
+
+        items = result.get('pozycje') or []
+        items_sum = sum(item.get('wartosc_netto', 0) for item in items)
+        if not items:
+            problems.append('brak pozycji')
+        elif netto > 0 and abs(items_sum - netto) > max(TIER_TOTALS_TOLERANCE, netto * TIER_ITEMS_TOLERANCE):
+            problems.append(f'suma pozycji {items_sum:.2f} != suma netto {netto}')
+
+        kwh = result.get('zuzycie_kwh') or 0
+        if not TIER_KWH_RANGE[0] <= kwh <= TIER_KWH_RANGE[1]:
+            problems.append(f'zużycie {kwh} kWh poza zakresem')
+        elif netto > 0 and not TIER_PRICE_RANGE[0] <= netto / kwh <= TIER_PRICE_RANGE[1]:
+            problems.append(f'cena {netto / kwh:.2f} zł/kWh poza zakresem')
+
+        return problems
+
+    def _forecast_problems(self, result: Dict) -> List[str]:
+        """Kontrole prognozy: numer, okres i wiarygodne kwoty. _parse_forecast korzysta tylko
+        z tekstu, więc pełna ekstrakcja pomaga jedynie, gdy czegoś brak na 1. stronie.
+        Pozycje prognozy nie muszą sumować się do netto (nie wszystkie składniki są wypisane)."""
+        problems = []
+        if not (result.get('numer_dokumentu_prognozowego') or result.get('numer_faktury')):
+            problems.append('brak numeru prognozy')
+        if not result.get('okres_rozliczeniowy'):
+            problems.append('brak okresu prognozy')
+
+        netto = result.get('suma_netto') or 0
+        vat = result.get('vat_kwota') or 0
+        brutto = result.get('suma_brutto') or 0
+        if not TIER_FORECAST_AMOUNT_RANGE[0] <= brutto <= TIER_FORECAST_AMOUNT_RANGE[1]:
+            problems.append(f'kwota prognozy {brutto} zł poza zakresem')
+        elif netto > 0 and (vat < 0 or abs(netto + vat - brutto) > TIER_TOTALS_TOLERANCE):
+            problems.append(f'netto + VAT != brutto ({netto} + {vat} != {brutto})')
+
+        kwh = result.get('zuzycie_kwh') or 0
+        if kwh and not TIER_KWH_RANGE[0] <= kwh <= TIER_KWH_RANGE[1]:
+            problems.append(f'zużycie {kwh} kWh poza zakresem')
+        return problems
+
+    def parse_ir(self, ir: Dict) -> Dict:
+        """Parsowanie pól (tania część) z IR zwróconego przez extract_ir / extract_text_ir"""
+        if ir.get('ir_version') != IR_VERSION:
+            raise ValueError(f"Nieobsługiwana wersja IR: {ir.get('ir_version')} (oczekiwana {IR_VERSION})")
+
+        text, tables, provider = ir['text'], ir['tables'], ir['provider']
+        tier = ir.get('tier', TIER_TABLES)
+        # Indeks tekstu bywa współdzielony z poprzednim parsowaniem tego samego IR (kontrola
+        # spójności warstwy tekstowej) — budżet regex liczony osobno dla każdego parsowania
+        self._text_index(text).reset_budget()
+
+        # Wykryj typ dokumentu (faktura vs prognoza)
+        doc_type = self._detect_document_type(text, provider)
+
+        if doc_type == self.DOC_TYPE_FORECAST:
+            # Prognoza: wyciągnij podstawowe dane i zwróć informację
+            result = self._parse_forecast(text, tables, provider)
+            result['typ_dokumentu'] = self.DOC_TYPE_FORECAST
+        elif tier in (TIER_TEXT, TIER_OCR):
+            # Warstwa tekstowa / OCR: parsery tekstowe + brakujące sumy/zużycie z parsera regex
+            result = self._parse_text_tier(text, provider)
+            result['typ_dokumentu'] = self.DOC_TYPE_INVOICE
+        else:
+            # Faktura rozliczeniowa: pełne parsowanie
+            result = self._parse_invoice_data(text, tables, provider)
+            result['typ_dokumentu'] = self.DOC_TYPE_INVOICE
+
+        result['_parser_tier'] = tier
+        index = self._text_index(text)
+        if index.over_budget:
+            # Część wzorców nie przeszukała całego tekstu — wynik może być niepełny (nie do cache)
+            result['_regex_over_budget'] = list(index.over_budget)
+        if ir.get('eskalacja'):
+            result['_tier_escalation'] = list(ir['eskalacja'])
+        if 'strony' in ir:
+            result['strony'] = list(ir['strony'])
+        return result
 
-            if doc_type == self.DOC_TYPE_FORECAST:
-                # Prognoza: wyciągnij podstawowe dane i zwróć informację
-                result = self._parse_forecast(text, tables, provider)
-                result['typ_dokumentu'] = self.DOC_TYPE_FORECAST
-                return result
-            else:
-                # Faktura rozliczeniowa: pełne parsowanie
-                result = self._parse_invoice_data(text, tables, provider)
-                result['typ_dokumentu'] = self.DOC_TYPE_INVOICE
-                return result
+    def _parse_text_tier(self, text: str, provider: str) -> Dict:
+        """Parsuje fakturę bez tabel: parsery tekstowe dostawców, luki uzupełnia parse_invoice_simple"""
+        from parser_simple import parse_invoice_simple
+
+        result = self._parse_invoice_data(text, [], provider)
+        simple = parse_invoice_simple(text, self._text_index(text))
+        if not result.get('suma_netto') and simple['suma_netto']:
+            for key in ('suma_netto', 'vat_kwota', 'suma_brutto'):
+                result[key] = simple[key]
+        if not result.get('zuzycie_kwh') and simple['zuzycie_kwh']:
+            result['zuzycie_kwh'] = simple['zuzycie_kwh']
+        return result
 
     def _detect_document_type(self, text: str, provider: str) -> str:
         """Rozpoznaje typ dokumentu: faktura rozliczeniowa vs prognoza"""
-        text_lower = text.lower()
+        index = self._text_index(text)
 
         # Wzorce jednoznacznie wskazujące na PROGNOZĘ
         forecast_indicators = [
@@ -112,11 +506,11 @@ class InvoiceParser:
 
         # Lumi PGE: "Podsumowanie" + "Prognoza zużycia energii" = prognoza
         if provider == 'lumi_pge':
-            if any(kw in text_lower for kw in ['prognoza zużycia energii', 'prognoza/ee/']):
+            if any(index.contains(kw) for kw in ['prognoza zużycia energii', 'prognoza/ee/']):
                 return self.DOC_TYPE_FORECAST
 
-        forecast_score = sum(1 for kw in forecast_indicators if kw in text_lower)
-        invoice_score = sum(1 for kw in invoice_indicators if kw in text_lower)
+        forecast_score = sum(1 for kw in forecast_indicators if index.contains(kw))
+        invoice_score = sum(1 for kw in invoice_indicators if index.contains(kw))
 
         if forecast_score > invoice_score:
             return self.DOC_TYPE_FORECAST
@@ -145,40 +539,43 @@ class InvoiceParser:
                       "Aby uzyskać pełną analizę oszczędności, prześlij fakturę rozliczeniową z pełnym rozbiciem."
         }
 
-        text_lower = text.lower()
+        index = self._text_index(text)
 
         # Numer dokumentu prognozowego (Lumi PGE: "Prognoza/EE/15539487/26/01/1")
-        match = re.search(r'(Prognoza/EE/[\d/]+)', text, re.IGNORECASE)
+        match = index.search(r'(Prognoza/EE/[\d/]+)', 'prognoza/ee/', re.IGNORECASE)
         if match:
             result['numer_dokumentu_prognozowego'] = match.group(1)
 
         # Numer klienta
-        match = re.search(r'(?:Tw[oó]j\s+numer\s+Klienta|nr\s+Klienta|IDENTYFIKATOR\s+KLIENTA):?\s*(\d+)', text, re.IGNORECASE)
+        match = index.search(r'(?:Tw[oó]j\s+numer\s+Klienta|nr\s+Klienta|IDENTYFIKATOR\s+KLIENTA):?\s*(\d+)', 'klienta',
+                             re.IGNORECASE)
         if match:
             result['numer_klienta'] = match.group(1)
 
         # Okres prognozy (Lumi: "Prognoza zużycia za okres:\n...\n01.01.2026 - 31.01.2026")
         # Data może być na innej linii niż nagłówek
         date_pattern = r'\d{2}[./]\d{2}[./]\d{4}'
-        match = re.search(rf'Prognoza\s+zużycia\s+za\s+okres:?\s*\n.*?\n?\s*({date_pattern})\s*[-–]\s*({date_pattern})', text, re.IGNORECASE)
+        match = index.search(rf'Prognoza\s+zużycia\s+za\s+okres:?\s*\n.{{0,200}}?\n?\s*({date_pattern})\s*[-–]\s*({date_pattern})',
+                             'prognoza', re.IGNORECASE, span=3)
         if match:
             result['okres_rozliczeniowy'] = f"{match.group(1)} - {match.group(2)}"
         else:
             # Generyczny fallback
             patterns = [
-                rf'za\s+okres\s+od\s+({date_pattern})\s+do\s+({date_pattern})',
-                rf'okres:?\s*({date_pattern})\s*[-–]\s*({date_pattern})',
+                (rf'za\s+okres\s+od\s+({date_pattern})\s+do\s+({date_pattern})', 'okres'),
+                (rf'okres:?\s*({date_pattern})\s*[-–]\s*({date_pattern})', 'okres'),
             ]
-            for pattern in patterns:
-                match = re.search(pattern, text, re.IGNORECASE)
+            for pattern, anchor in patterns:
+                match = index.search(pattern, anchor, re.IGNORECASE)
                 if match:
                     result['okres_rozliczeniowy'] = f"{match.group(1)} - {match.group(2)}"
                     break
 
         # Kwoty z prognozy (Lumi: tabela ze Sprzedaż/Dystrybucja)
         # Szukaj "Sprzedaż energii elektrycznej" + kwoty
-        sprzedaz_match = re.search(r'Sprzedaż\s+energii\s+elektrycznej\s+(\d+)\s+([\d,]+)\s+\d+%?\s+([\d,]+)', text)
-        dystrybucja_match = re.search(r'Dystrybucja\s+energii\s+elektrycznej\s+(\d+)\s+([\d,]+)\s+\d+%?\s+([\d,]+)', text)
+        sprzedaz_match = index.search(r'Sprzedaż\s+energii\s+elektrycznej\s+(\d+)\s+([\d,]+)\s+\d+%?\s+([\d,]+)', 'sprzedaż')
+        dystrybucja_match = index.search(r'Dystrybucja\s+energii\s+elektrycznej\s+(\d+)\s+([\d,]+)\s+\d+%?\s+([\d,]+)',
+                                         'dystrybucja')
 
         if sprzedaz_match:
             zuzycie = self._clean_number(sprzedaz_match.group(1))
@@ -202,7 +599,7 @@ class InvoiceParser:
             })
 
         # Suma — "Razem" lub "Do zapłaty"
-        match = re.search(r'Razem\s+([\d,]+)\s+([\d,]+)', text)
+        match = index.search(r'Razem\s+([\d,]+)\s+([\d,]+)', 'razem')
         if match:
             result['suma_netto'] = self._clean_number(match.group(1))
             result['suma_brutto'] = self._clean_number(match.group(2))
@@ -210,12 +607,12 @@ class InvoiceParser:
 
         # Fallback: "Do zapłaty" / "Ile powinieneś zapłacić"
         if result['suma_brutto'] == 0:
-            match = re.search(r'(?:Do\s+zapłaty|Ile\s+powinieneś\s+zapłacić\??)\s*([\d.,]+)\s*zł', text, re.IGNORECASE)
+            match = index.search(r'(?:Do\s+zapłaty|Ile\s+powinieneś\s+zapłacić\??)\s*([\d.,]+)\s*zł', 'zapła', re.IGNORECASE)
             if match:
                 result['suma_brutto'] = self._clean_number(match.group(1))
 
         # Numer faktury rozliczeniowej, na którą powołuje się prognoza
-        match = re.search(r'poprzedniej\s+faktury\s+(\w+)', text, re.IGNORECASE)
+        match = index.search(r'poprzedniej\s+faktury\s+(\w+)', 'poprzedniej', re.IGNORECASE)
         if match:
             result['numer_faktury_rozliczeniowej'] = match.group(1)
 
@@ -240,39 +637,50 @@ class InvoiceParser:
             deduped.append(new_table)
         return deduped
 
-    def _extract_text(self, pdf) -> str:
-        """Ekstraktuje cały tekst z PDF"""
-        text = ""
+    def _iter_pages(self, pdf):
+        """Strumieniowa ekstrakcja: (tekst, tabele) strona po stronie.
+        Po każdej stronie zwalnia jej layout i textmap, więc szczytowe zużycie pamięci
+        nie rośnie z liczbą stron."""
         for page in pdf.pages:
-            page_text = page.extract_text()
+            try:
+                yield page.extract_text() or "", page.extract_tables() or []
+            finally:
+                self._release_page(page)
+
+    def _release_page(self, page):
+        """Zwalnia cache strony pdfplumber (layout, obiekty, textmap)"""
+        page.close()
+        # pdfplumber 0.11: close() nie czyści lru_cache textmapy (trzyma znaki strony)
+        get_textmap = getattr(page, 'get_textmap', None)
+        if get_textmap is not None and hasattr(get_textmap, 'cache_clear'):
+            get_textmap.cache_clear()
+
+    def _extract_pages(self, pdf) -> Tuple[str, List[List[List[str]]]]:
+        """Ekstraktuje cały tekst i wszystkie tabele z PDF w jednym przebiegu po stronach"""
+        text = ""
+        all_tables = []
+        for page_text, tables in self._iter_pages(pdf):
             if page_text:
                 text += page_text + "\n"
-        return text
-
-    def _extract_tables(self, pdf) -> List[List[List[str]]]:
-        """Ekstraktuje wszystkie tabele z PDF"""
-        all_tables = []
-        for page in pdf.pages:
-            tables = page.extract_tables()
             if tables:
                 all_tables.extend(tables)
-        return all_tables
+        return text, all_tables
 
     def _detect_provider(self, text: str) -> str:
         """Wykrywa dostawcę energii na podstawie tekstu faktury"""
-        text_lower = text.lower()
+        index = self._text_index(text)
         # Lumi PGE musi być sprawdzane PRZED PGE (bo zawiera "PGE Obrót" w danych)
-        if 'lumi' in text_lower and ('lumipge' in text_lower or 'lumi' in text_lower):
+        if index.contains('lumi'):
             return 'lumi_pge'
-        elif 'pge obrót' in text_lower or 'gkpge.pl' in text_lower or 'pge-obrot' in text_lower:
+        elif index.contains('pge obrót') or index.contains('gkpge.pl') or index.contains('pge-obrot'):
             return 'pge'
-        elif 'tauron' in text_lower or 'ttaauurroonn' in text_lower:
+        elif index.contains('tauron') or index.contains('ttaauurroonn'):
             return 'tauron'
-        elif 'e.on' in text_lower or 'eon energie' in text_lower:
+        elif index.contains('e.on') or index.contains('eon energie'):
             return 'eon'
-        elif 'enea' in text_lower:
+        elif index.contains('enea'):
             return 'enea'
-        elif 'energa' in text_lower:
+        elif index.contains('energa'):
             return 'energa'
         return 'unknown'
 
@@ -400,7 +808,9 @@ class InvoiceParser:
             if enea_meta:
                 return enea_meta
 
-        # Numer faktury
+        index = self._text_index(text)
+
+        # Numer faktury (kotwica: "faktur" — wspólna dla wszystkich wzorców)
         patterns = [
             # PGE: FAKTURA VAT NR  81304134/97R/2025
             r'FAKTURA\s+VAT\s+NR\s+([\w/]+)',
@@ -412,7 +822,7 @@ class InvoiceParser:
             r'Nr\s+faktury:?\s*([\w/.-]+)',
         ]
         for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+            match = index.search(pattern, 'faktur', re.IGNORECASE)
             if match:
                 metadata['numer_faktury'] = match.group(1).strip()
                 break
@@ -420,18 +830,18 @@ class InvoiceParser:
         # Data faktury — obsługa DD.MM.YYYY i DD/MM/YYYY
         date_pattern = r'\d{2}[./]\d{2}[./]\d{4}'
         patterns = [
-            rf'[Zz]\s+dnia\s+({date_pattern})',
-            rf'Data\s+wystawienia\s*\n?\s*({date_pattern})',
-            rf'Data\s+faktury:?\s*({date_pattern})',
-            rf'Data\s+wystawienia:?\s*({date_pattern})',
+            (rf'[Zz]\s+dnia\s+({date_pattern})', 'dnia'),
+            (rf'Data\s+wystawienia\s*\n?\s*({date_pattern})', 'data'),
+            (rf'Data\s+faktury:?\s*({date_pattern})', 'data'),
+            (rf'Data\s+wystawienia:?\s*({date_pattern})', 'data'),
         ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
+        for pattern, anchor in patterns:
+            match = index.search(pattern, anchor)
             if match:
                 metadata['data_faktury'] = match.group(1)
                 break
 
-        # Okres rozliczeniowy — obsługa DD.MM.YYYY i DD/MM/YYYY
+        # Okres rozliczeniowy — obsługa DD.MM.YYYY i DD/MM/YYYY (kotwica: "okres")
         patterns = [
             rf'w\s+okresie\s+od\s+({date_pattern})\s+do\s+({date_pattern})',
             rf'za\s+okres\s+od\s+({date_pattern})\s+do\s+({date_pattern})',
@@ -440,7 +850,7 @@ class InvoiceParser:
             rf'Rozliczenie\s+za\s+okres\s+od\s+({date_pattern})\s+do\s+({date_pattern})',
         ]
         for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+            match = index.search(pattern, 'okres', re.IGNORECASE)
             if match:
                 metadata['okres_rozliczeniowy'] = f"{match.group(1)} - {match.group(2)}"
                 break
@@ -450,14 +860,16 @@ class InvoiceParser:
     def _parse_metadata_tauron(self, text: str) -> Optional[Dict]:
         """Parsuje metadane z faktury TAURON — specjalny format."""
         metadata = {}
-        lines = text.split('\n')
+        index = self._text_index(text)
+        lines = index.lines
 
-        for i, line in enumerate(lines):
+        for i in index.lines_with('numer faktury'):
+            line = lines[i]
             # Szukaj linii z nagłówkami TAURON
             if 'Data wystawienia' in line and 'Numer faktury' in line:
                 # Następna linia powinna zawierać wartości
                 if i + 1 < len(lines):
-                    values_line = lines[i + 1].strip()
+                    values_line = lines[i + 1].strip()[:REGEX_MAX_WINDOW]
                     # Format: "14/01/2026 E/TM2/UG541227/0002/26 04/12/2025 - 07/01/2026"
                     date_pattern = r'\d{2}/\d{2}/\d{4}'
                     # Data wystawienia — pierwsza data
@@ -479,7 +891,8 @@ class InvoiceParser:
                         return metadata
 
         # Fallback: szukaj numeru faktury TAURON w osobnych liniach
-        for i, line in enumerate(lines):
+        for i in index.lines_with('e/'):
+            line = lines[i]
             if line.strip().startswith('E/') and '/' in line and len(line.strip()) < 40:
                 metadata.setdefault('numer_faktury', line.strip())
                 break
@@ -494,20 +907,21 @@ class InvoiceParser:
         Za okres od 24/12/2025 do 24/01/2026 (na str. 2)
         """
         metadata = {}
+        index = self._text_index(text)
         date_pattern = r'\d{2}/\d{2}/\d{4}'
 
         # Numer faktury ENEA: P/XXXXXXXX/XXXX/XX
-        match = re.search(r'FAKTURA\s+VAT\s+NR\s+(P/[\w/]+)\s*[-–]', text, re.IGNORECASE)
+        match = index.search(r'FAKTURA\s+VAT\s+NR\s+(P/[\w/]+)\s*[-–]', 'faktura', re.IGNORECASE)
         if match:
             metadata['numer_faktury'] = match.group(1).strip()
 
         # Data wystawienia
-        match = re.search(rf'Data\s+wystawienia:?\s*({date_pattern})', text, re.IGNORECASE)
+        match = index.search(rf'Data\s+wystawienia:?\s*({date_pattern})', 'data', re.IGNORECASE)
         if match:
             metadata['data_faktury'] = match.group(1)
 
         # Okres rozliczeniowy — na str. 2: "Za okres od 24/12/2025 do 24/01/2026"
-        match = re.search(rf'[Zz]a\s+okres\s+od\s+({date_pattern})\s+do\s+({date_pattern})', text)
+        match = index.search(rf'[Zz]a\s+okres\s+od\s+({date_pattern})\s+do\s+({date_pattern})', 'okres')
         if match:
             metadata['okres_rozliczeniowy'] = f"{match.group(1)} - {match.group(2)}"
 
@@ -532,32 +946,20 @@ class InvoiceParser:
         PGE pakuje wszystkie pozycje w jedną wieloliniową komórkę — trzeba je rozdzielić po \\n."""
         aggregated = {}  # nazwa -> {'netto': float, 'kategoria': str}
 
-        for table in tables:
-            if not table:
-                continue
-
+        for table in self._table_index(tables).tables:
             # Szukaj tabeli ze szczegółami (kolumny: Strefa, Opis, ..., Wartość netto, Stawka VAT)
-            header_idx = None
-            for idx, row in enumerate(table):
-                if not row:
-                    continue
-                row_text = ' '.join([str(cell) for cell in row if cell]).lower()
-                if 'opis' in row_text and ('wartość' in row_text or 'netto' in row_text):
-                    header_idx = idx
-                    break
-
+            header_idx = table.header(['opis'], ['wartość', 'netto'])
             if header_idx is None:
                 continue
 
-            header = table[header_idx]
-            col_opis = self._find_column_index(header, ['opis'])
-            col_netto = self._find_column_index(header, ['wartość\nnetto', 'wartość netto'])
+            col_opis = table.column(header_idx, ['opis'])
+            col_netto = table.column(header_idx, ['wartość\nnetto', 'wartość netto'])
 
             if col_opis is None or col_netto is None:
                 continue
 
             # PGE: dane są w wieloliniowych komórkach — rozdziel po \n
-            for row in table[header_idx + 1:]:
+            for row in table.rows[header_idx + 1:]:
                 if not row or len(row) <= max(col_opis, col_netto):
                     continue
 
@@ -622,16 +1024,12 @@ class InvoiceParser:
         aggregated = {}  # nazwa -> {'netto': float, 'kategoria': str}
         current_section = None
 
-        for table in tables:
-            if not table:
-                continue
-
-            for row in table:
+        for table in self._table_index(tables).tables:
+            for row_idx, row in enumerate(table.rows):
                 if not row:
                     continue
 
-                row_text = ' '.join([str(cell) for cell in row if cell])
-                row_lower = row_text.lower()
+                row_lower = table.lower(row_idx)
 
                 # Pomiń nagłówki
                 if 'nazwa' in row_lower and ('netto' in row_lower or 'wartość' in row_lower or 'jednostka' in row_lower):
@@ -684,7 +1082,7 @@ class InvoiceParser:
                         continue
 
                     # Wyciągnij liczby z linii
-                    numbers = re.findall(r'[\d]+[,.][\d]+', line)
+                    numbers = re.findall(r'(?<!\d)\d+[,.]\d+', line)
 
                     if len(numbers) >= 3:
                         # Linia z danymi — wyciągnij wartość netto
@@ -745,12 +1143,14 @@ class InvoiceParser:
     def _parse_items_tauron_text(self, text: str) -> List[Dict]:
         """Parsuje pozycje TAURON z tekstu (fallback gdy tabele nie działają)"""
         items = []
-        lines = text.split('\n')
+        index = self._text_index(text)
         current_section = None
 
-        for line in lines:
-            line_stripped = line.strip()
-            line_lower = line_stripped.lower()
+        # Przed pierwszym nagłówkiem sekcji nie ma pozycji — start od pierwszej kotwicy
+        starts = index.lines_with('sprzedaż energii elektrycznej') + index.lines_with('dystrybucja energii elektrycznej')
+        for i in range(min(starts, default=len(index.lines)), len(index.lines)):
+            line_stripped = index.lines[i].strip()
+            line_lower = index.lower[i].strip()
 
             # Detekcja sekcji
             if 'sprzedaż energii elektrycznej' in line_lower:
@@ -761,7 +1161,7 @@ class InvoiceParser:
                 continue
             elif any(kw in line_lower for kw in ['razem za sprzedaż', 'razem za dystrybucję']):
                 # Wyciągnij sumę sekcji z linii "Razem za sprzedaż energii XX,XX YY,YY ZZ,ZZ"
-                numbers = re.findall(r'[\d]+[,.][\d]+', line_stripped)
+                numbers = re.findall(r'(?<!\d)\d+[,.]\d+', line_stripped)
                 if numbers and current_section:
                     netto_val = self._clean_number(numbers[0])
                     if netto_val > 0:
@@ -780,7 +1180,7 @@ class InvoiceParser:
             # Szukaj linii z pozycjami zawierającymi kwoty
             # TAURON format tekstu: "Nazwa kWh cena wartość_netto VAT% kwota_VAT wartość_brutto"
             # lub: "całodobowa 70 kWh 0,50500 35,35 23 8,13 43,48"
-            numbers = re.findall(r'[\d]+[,.][\d]+', line_stripped)
+            numbers = re.findall(r'(?<!\d)\d+[,.]\d+', line_stripped)
             if len(numbers) >= 3:
                 # Wyciągnij nazwę (tekst na początku linii)
                 match = re.match(r'^([A-Za-zęóąśłżźćńĘÓĄŚŁŻŹĆŃ\s.]+)', line_stripped)
@@ -833,7 +1233,7 @@ class InvoiceParser:
           Wartości 0,00 pomijamy (pozycje bez naliczenia).
         """
         aggregated = {}
-        lines = text.split('\n')
+        index = self._text_index(text)
         current_section = None
         current_subname = None
 
@@ -854,9 +1254,11 @@ class InvoiceParser:
             re.IGNORECASE
         )
 
-        for line in lines:
-            line_stripped = line.strip()
-            line_lower = line_stripped.lower()
+        # Przed pierwszym nagłówkiem sekcji nie ma pozycji — start od pierwszej kotwicy
+        starts = index.lines_with('rozliczenie - sprzedaż energii') + index.lines_with('rozliczenie - usługa dystrybucji')
+        for i in range(min(starts, default=len(index.lines)), len(index.lines)):
+            line_stripped = index.lines[i].strip()
+            line_lower = index.lower[i].strip()
 
             if not line_stripped:
                 continue
@@ -889,7 +1291,7 @@ class InvoiceParser:
                     continue
 
                 # Wyciągnij wszystkie liczby zmiennoprzecinkowe (z przecinkiem)
-                numbers_float = re.findall(r'\d+,\d+', line_stripped)
+                numbers_float = re.findall(r'(?<!\d)\d+,\d+', line_stripped)
                 if not numbers_float:
                     continue
 
@@ -952,32 +1354,19 @@ class InvoiceParser:
             return items_from_text
 
         # Fallback: parsuj z tabel
-        for table in tables:
-            if not table:
-                continue
-
+        for table in self._table_index(tables).tables:
             # Znajdź nagłówek tabeli
-            header_idx = None
-            for idx, row in enumerate(table):
-                if not row:
-                    continue
-                row_text = ' '.join([str(cell) for cell in row if cell]).lower()
-                if any(kw in row_text for kw in ['pozycja', 'opis', 'nazwa']):
-                    if any(kw in row_text for kw in ['netto', 'wartość', 'brutto']):
-                        header_idx = idx
-                        break
-
+            header_idx = table.header(['pozycja', 'opis', 'nazwa'], ['netto', 'wartość', 'brutto'])
             if header_idx is None:
                 continue
 
             # Znajdź indeksy kolumn
-            header = table[header_idx]
-            col_pozycja = self._find_column_index(header, ['pozycja', 'opis', 'nazwa', 'rozliczenie z tytułu'])
-            col_netto = self._find_column_index(header, ['netto', 'wartość netto'])
-            col_brutto = self._find_column_index(header, ['brutto', 'wartość brutto'])
+            col_pozycja = table.column(header_idx, ['pozycja', 'opis', 'nazwa', 'rozliczenie z tytułu'])
+            col_netto = table.column(header_idx, ['netto', 'wartość netto'])
+            col_brutto = table.column(header_idx, ['brutto', 'wartość brutto'])
 
             # Parsuj wiersze
-            for row in table[header_idx + 1:]:
+            for row in table.rows[header_idx + 1:]:
                 if not row or len(row) < 2:
                     continue
 
@@ -1007,13 +1396,15 @@ class InvoiceParser:
     def _parse_items_from_text_eon(self, text: str) -> List[Dict]:
         """Parsuje pozycje szczegółowe z tekstu (format E.ON)"""
         items = []
-        lines = text.split('\n')
+        index = self._text_index(text)
 
-        # Szukaj sekcji "Sprzedaż energii elektrycznej"
+        # Szukaj sekcji "Sprzedaż energii elektrycznej" — przed pierwszą nie ma pozycji
         in_sprzedaz = False
         in_dystrybucja = False
+        starts = index.lines_with('sprzedaż energii elektrycznej') + index.lines_with('dystrybucja energii elektrycznej')
 
-        for i, line in enumerate(lines):
+        for i in range(min(starts, default=len(index.lines)), len(index.lines)):
+            line = index.lines[i]
             # Wykryj sekcje
             if 'Sprzedaż energii elektrycznej' in line:
                 in_sprzedaz = True
@@ -1087,23 +1478,13 @@ class InvoiceParser:
         # Jeśli nie znaleziono mapowania, zwróć oryginał z dużej litery
         return name[0].upper() + name[1:] if name else name
 
-    def _find_column_index(self, header: List, keywords: List[str]) -> Optional[int]:
-        """Znajduje indeks kolumny po słowach kluczowych"""
-        for idx, cell in enumerate(header):
-            if not cell:
-                continue
-            cell_lower = str(cell).lower()
-            for keyword in keywords:
-                if keyword in cell_lower:
-                    return idx
-        return None
-
     def _parse_totals(self, text: str, tables: List, provider: str) -> Dict:
         """Parsuje sumy z faktury"""
         totals = {}
 
         # E.ON: "Należność za faktyczne zużycie NETTO VAT% VAT BRUTTO"
-        match = re.search(r'Należność za faktyczne zużycie\s+([\d,]+)\s+\d+\s+([\d,]+)\s+([\d,]+)', text)
+        match = self._text_index(text).search(r'Należność za faktyczne zużycie\s+([\d,]+)\s+\d+\s+([\d,]+)\s+([\d,]+)',
+                                              'należność za faktyczne zużycie')
         if match:
             totals['suma_netto'] = self._clean_number(match.group(1))
             totals['vat_kwota'] = self._clean_number(match.group(2))
@@ -1127,21 +1508,14 @@ class InvoiceParser:
 
         # Szukaj tabeli "Wartość ogółem w rozbiciu na stawki VAT"
         # Format: [opis, stawka_vat, netto, kwota_vat, brutto]
-        for table in tables:
-            if not table:
-                continue
-            for row in table:
+        for table in self._table_index(tables).tables:
+            for row_idx, row in enumerate(table.rows):
                 if not row:
                     continue
-                row_text = ' '.join([str(cell) for cell in row if cell])
-                if 'wartość ogółem' in row_text.lower() and 'rozbiciu' in row_text.lower():
+                row_lower = table.lower(row_idx)
+                if 'wartość ogółem' in row_lower and 'rozbiciu' in row_lower:
                     # Wyciągnij wartości z komórek
-                    numbers = []
-                    for cell in row:
-                        if cell:
-                            val = self._clean_number(str(cell))
-                            if val > 0:
-                                numbers.append(val)
+                    numbers = table.numbers(row_idx, self._clean_number)
                     # Format: [23, netto, vat, brutto] lub [netto, vat, brutto]
                     if len(numbers) >= 3:
                         # Ostatnie 3 to netto, vat, brutto
@@ -1151,41 +1525,9 @@ class InvoiceParser:
                         totals['vat_procent'] = 23
                         return totals
 
-        # Szukaj "Należność za okres" w wieloliniowej komórce tabeli
-        for table in tables:
-            if not table:
-                continue
-            for row in table:
-                if not row:
-                    continue
-                # Sprawdź kolumnę "Rozliczenie finansowe ogółem"
-                for ci, cell in enumerate(row):
-                    if cell and 'należność za okres' in str(cell).lower():
-                        # Wartość netto jest w kolumnie z indeksem 2 (wieloliniowa)
-                        # Weź pierwszą wartość z kolumny netto
-                        netto_col = None
-                        vat_col = None
-                        brutto_col = None
-                        for ci2, cell2 in enumerate(row):
-                            if cell2:
-                                vals = str(cell2).split('\n')
-                                first_val = self._clean_number(vals[0])
-                                if first_val > 100:
-                                    if netto_col is None:
-                                        netto_col = first_val
-                                    elif brutto_col is None:
-                                        brutto_col = first_val
-                        # Szukamy kolumn z VAT
-                        for ci2, cell2 in enumerate(row):
-                            if cell2:
-                                vals = str(cell2).split('\n')
-                                first_val = self._clean_number(vals[0])
-                                if 0 < first_val < netto_col if netto_col else 0:
-                                    if vat_col is None:
-                                        vat_col = first_val
-
         # Fallback: szukaj w tekście "Ogółem: NETTO VAT BRUTTO"
-        match = re.search(r'Ogółem:\s*([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)', text)
+        index = self._text_index(text)
+        match = index.search(r'Ogółem:\s*([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)', 'ogółem:')
         if match:
             n = self._clean_number(match.group(1))
             v = self._clean_number(match.group(2))
@@ -1201,7 +1543,8 @@ class InvoiceParser:
         netto_total = 0
         vat_total = 0
         brutto_total = 0
-        for match in re.finditer(r'Razem\s+wartość\s+netto\s+([\d.,]+)\s*zł\s*\n\s*plus\s+kwota\s+VAT\s+([\d.,]+)\s*zł\s*\n\s*Razem\s+wartość\s+brutto\s+([\d.,]+)', text):
+        for match in index.finditer(r'Razem\s+wartość\s+netto\s+([\d.,]+)\s*zł\s*\n\s*plus\s+kwota\s+VAT\s+([\d.,]+)\s*zł\s*\n'
+                                    r'\s*Razem\s+wartość\s+brutto\s+([\d.,]+)', 'razem', span=4):
             netto_total += self._clean_number(match.group(1))
             vat_total += self._clean_number(match.group(2))
             brutto_total += self._clean_number(match.group(3))
@@ -1220,17 +1563,14 @@ class InvoiceParser:
         totals = {}
 
         # TAURON tabela: "Wynik rozliczenia ( 1 + 2 )" lub "Do zapłaty" z kolumnami netto/vat/brutto
-        for table in tables:
-            if not table:
-                continue
-            for row in table:
+        for table in self._table_index(tables).tables:
+            for row_idx, row in enumerate(table.rows):
                 if not row:
                     continue
-                row_text = ' '.join([str(cell) for cell in row if cell])
-                row_lower = row_text.lower()
+                row_lower = table.lower(row_idx)
 
                 if 'do zapłaty' in row_lower or 'wynik rozliczenia' in row_lower:
-                    numbers = [self._clean_number(str(cell)) for cell in row if cell and self._clean_number(str(cell)) > 0]
+                    numbers = table.numbers(row_idx, self._clean_number)
                     # Filtruj — szukaj zestawu netto, vat, brutto
                     if len(numbers) >= 3:
                         # Sprawdź czy to netto + vat = brutto (z tolerancją)
@@ -1245,7 +1585,7 @@ class InvoiceParser:
 
         # Fallback: szukaj w tekście
         # TAURON: "Do zapłaty 108,57 24,97 133,54"
-        match = re.search(r'Do\s+zapłaty\s+([\d,]+)\s+([\d,]+)\s+([\d,]+)', text)
+        match = self._text_index(text).search(r'Do\s+zapłaty\s+([\d,]+)\s+([\d,]+)\s+([\d,]+)', 'zapłaty')
         if match:
             n = self._clean_number(match.group(1))
             v = self._clean_number(match.group(2))
@@ -1270,13 +1610,10 @@ class InvoiceParser:
         'Do zapłaty: 493,86 zł'
         """
         totals = {}
-        date_pattern = r'\d{2}/\d{2}/\d{4}'
+        index = self._text_index(text)
 
         # Metoda 1: szukaj wiersza "PODSUMOWANIE:" w tekście
-        match = re.search(
-            r'PODSUMOWANIE:\s*([\d,]+)\s+([\d,]+)\s+([\d,]+)',
-            text, re.IGNORECASE
-        )
+        match = index.search(r'PODSUMOWANIE:\s*([\d,]+)\s+([\d,]+)\s+([\d,]+)', 'podsumowanie:', re.IGNORECASE)
         if match:
             n = self._clean_number(match.group(1))
             v = self._clean_number(match.group(2))
@@ -1289,16 +1626,13 @@ class InvoiceParser:
                 return totals
 
         # Metoda 2: szukaj tabeli "Wynik rozliczenia w rozbiciu na stawki VAT"
-        for table in tables:
-            if not table:
-                continue
-            for row in table:
+        for table in self._table_index(tables).tables:
+            for row_idx, row in enumerate(table.rows):
                 if not row:
                     continue
-                row_text = ' '.join([str(cell) for cell in row if cell])
-                row_lower = row_text.lower()
+                row_lower = table.lower(row_idx)
                 if 'podsumowanie' in row_lower or 'wynik rozliczenia' in row_lower:
-                    numbers = [self._clean_number(str(c)) for c in row if c and self._clean_number(str(c)) > 0]
+                    numbers = table.numbers(row_idx, self._clean_number)
                     # Szukaj trójki netto+vat=brutto
                     for i in range(len(numbers) - 2):
                         n, v, b = numbers[i], numbers[i + 1], numbers[i + 2]
@@ -1310,7 +1644,7 @@ class InvoiceParser:
                             return totals
 
         # Metoda 3: "Do zapłaty: 493,86 zł"
-        match = re.search(r'Do\s+zapłaty:\s*([\d,]+)\s*zł', text, re.IGNORECASE)
+        match = index.search(r'Do\s+zapłaty:\s*([\d,]+)\s*zł', 'zapłaty:', re.IGNORECASE)
         if match:
             brutto = self._clean_number(match.group(1))
             if brutto > 0:
@@ -1326,18 +1660,10 @@ class InvoiceParser:
         """Generyczny parser sum z tabel"""
         totals = {}
 
-        for table in tables:
-            if not table:
-                continue
-
-            for row in table:
-                if not row:
-                    continue
-
-                row_text = ' '.join([str(cell) for cell in row if cell])
-
-                if any(keyword in row_text.lower() for keyword in ['razem', 'suma', 'do zapłaty']):
-                    numbers = re.findall(r'[\d,]+[.,]?\d*', row_text)
+        for table in self._table_index(tables).tables:
+            for row_idx in range(len(table.rows)):
+                if any(keyword in table.lower(row_idx) for keyword in ['razem', 'suma', 'do zapłaty']):
+                    numbers = re.findall(r'[\d,]+[.,]?\d*', table.text(row_idx))
                     numbers = [self._clean_number(n) for n in numbers if self._clean_number(n) > 0]
 
                     if len(numbers) >= 3:
@@ -1351,19 +1677,20 @@ class InvoiceParser:
 
     def _parse_consumption(self, text: str, tables: List, provider: str) -> float:
         """Parsuje zużycie energii w kWh"""
+        index = self._text_index(text)
 
-        # Wzorce specyficzne dla dostawców
+        # Wzorce specyficzne dla dostawców (kotwica: "zużycie" — w każdym wzorcu)
         specific_patterns = []
 
         if provider == 'tauron':
             specific_patterns = [
                 r'Łączne\s+zużycie\s+energii\s+(\d+)\s*kWh',
-                r'Twoje\s+zużycie.*?(\d+)\s*kWh',
+                r'Twoje\s+zużycie.{0,200}?(?<!\d)(\d+)\s*kWh',
             ]
         elif provider in ('pge', 'lumi_pge'):
             specific_patterns = [
                 # PGE: "Zużycie energii elektrycznej za 2024 rok 2.359 kWh" (separator tysięcy!)
-                r'Zużycie\s+energii\s+elektrycznej.*?([\d.]+)\s*kWh',
+                r'Zużycie\s+energii\s+elektrycznej.{0,200}?(?<![\d.])([\d.]+)\s*kWh',
             ]
         elif provider == 'enea':
             specific_patterns = [
@@ -1374,7 +1701,7 @@ class InvoiceParser:
             ]
 
         for pattern in specific_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+            match = index.search(pattern, 'zużycie', re.IGNORECASE)
             if match:
                 consumption = self._clean_consumption_number(match.group(1))
                 if 50 <= consumption <= 100000:
@@ -1382,13 +1709,13 @@ class InvoiceParser:
 
         # Generyczne wzorce
         patterns = [
-            r'Zużycie:?\s*(\d+)\s*kWh',
-            r'Energia\s+czynna.*?(\d+)\s*kWh',
-            r'Razem\s+energia.*?(\d+)\s*kWh',
+            (r'Zużycie:?\s*(\d+)\s*kWh', 'zużycie'),
+            (r'Energia\s+czynna.{0,200}?(?<!\d)(\d+)\s*kWh', 'energia'),
+            (r'Razem\s+energia.{0,200}?(?<!\d)(\d+)\s*kWh', 'razem'),
         ]
 
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern, anchor in patterns:
+            match = index.search(pattern, anchor, re.IGNORECASE)
             if match:
                 consumption = self._clean_number(match.group(1))
                 if 50 <= consumption <= 100000:
@@ -1401,7 +1728,7 @@ class InvoiceParser:
                 return total_kwh
 
         # Generyczny fallback: (\d+) kWh — ale ostrożnie, tylko sensowne wartości
-        match = re.search(r'(\d+)\s*kWh', text, re.IGNORECASE)
+        match = index.search(r'(?<!\d)(\d+)\s*kWh', 'kwh', re.IGNORECASE, span=1)
         if match:
             consumption = self._clean_number(match.group(1))
             if 50 <= consumption <= 100000:
@@ -1416,7 +1743,7 @@ class InvoiceParser:
                     continue
                 for cell in row:
                     if cell and 'kWh' in str(cell):
-                        match = re.search(r'(\d+)\s*kWh', str(cell))
+                        match = re.search(r'(?<!\d)(\d+)\s*kWh', str(cell))
                         if match:
                             consumption = self._clean_number(match.group(1))
                             if 50 <= consumption <= 100000:
@@ -1428,31 +1755,19 @@ class InvoiceParser:
         """PGE: sumuje zużycie energii czynnej z tabel szczegółowych"""
         total_kwh = 0.0
 
-        for table in tables:
-            if not table:
-                continue
-
-            header_idx = None
-            for idx, row in enumerate(table):
-                if not row:
-                    continue
-                row_text = ' '.join([str(cell) for cell in row if cell]).lower()
-                if 'opis' in row_text and 'ilość' in row_text:
-                    header_idx = idx
-                    break
-
+        for table in self._table_index(tables).tables:
+            header_idx = table.header(['opis'], ['ilość'])
             if header_idx is None:
                 continue
 
-            header = table[header_idx]
-            col_opis = self._find_column_index(header, ['opis'])
-            col_ilosc = self._find_column_index(header, ['ilość'])
-            col_jm = self._find_column_index(header, ['j. m', 'j.m', 'jednostka'])
+            col_opis = table.column(header_idx, ['opis'])
+            col_ilosc = table.column(header_idx, ['ilość'])
+            col_jm = table.column(header_idx, ['j. m', 'j.m', 'jednostka'])
 
             if col_opis is None or col_ilosc is None:
                 continue
 
-            for row in table[header_idx + 1:]:
+            for row in table.rows[header_idx + 1:]:
                 if not row or len(row) < max(col_opis, col_ilosc) + 1:
                     continue
 
@@ -1475,6 +1790,18 @@ def parse_invoice(filepath: str) -> Dict:
     return parser.parse_pdf(filepath)
 
 
+def parse_invoice_text(text: str) -> Dict:
+    """Funkcja pomocnicza: parsuje fakturę z tekstu OCR"""
+    parser = InvoiceParser()
+    return parser.parse_text(text)
+
+
+def parse_invoice_bundle(filepath: str, tiered: bool = TEXT_TIER) -> List[Dict]:
+    """Funkcja pomocnicza: parsuje PDF z jednym lub wieloma dokumentami"""
+    parser = InvoiceParser()
+    return parser.parse_pdf_bundle(filepath, tiered=tiered)
+
+
 # Test
 if __name__ == "__main__":
     import sys
@@ -2,11 +2,14 @@
 Prosty parser faktury bez użycia Claude API
 Używa wyrażeń regularnych do ekstrakcji danych
 Obsługuje formaty: E.ON, PGE, TAURON
+Wzorce uruchamiane są przez indeks tekstu z budżetem (text_index)
 """
 import re
 
+from text_index import TextIndex
 
-def parse_invoice_simple(text):
+
+def parse_invoice_simple(text, index=None):
     """
     Parsuje fakturę za energię używając regex
     """
@@ -22,9 +25,10 @@ def parse_invoice_simple(text):
         "suma_brutto": 0
     }
 
+    index = index or TextIndex(text)  # indeks wywołującego: wspólny budżet i lista over_budget
     date_pattern = r'\d{2}[./]\d{2}[./]\d{4}'
 
-    # Numer faktury — różne formaty
+    # Numer faktury — różne formaty (kotwica: "faktur")
     patterns = [
         r'FAKTURA\s+VAT\s+NR\s+([\w/]+)',
         r'Numer\s+faktury\s*\n\s*([\w/.-]+)',
@@ -32,24 +36,24 @@ def parse_invoice_simple(text):
         r'Nr\s+faktury:?\s*([\w/.-]+)',
     ]
     for p in patterns:
-        match = re.search(p, text, re.IGNORECASE)
+        match = index.search(p, 'faktur', re.IGNORECASE)
         if match:
             result["numer_faktury"] = match.group(1).strip()
             break
 
     # Data faktury
     patterns = [
-        rf'[Zz]\s+dnia\s+({date_pattern})',
-        rf'Data\s+wystawienia\s*\n?\s*({date_pattern})',
-        rf'Data\s+faktury:?\s*({date_pattern})',
+        (rf'[Zz]\s+dnia\s+({date_pattern})', 'dnia'),
+        (rf'Data\s+wystawienia\s*\n?\s*({date_pattern})', 'data'),
+        (rf'Data\s+faktury:?\s*({date_pattern})', 'data'),
     ]
-    for p in patterns:
-        match = re.search(p, text)
+    for p, anchor in patterns:
+        match = index.search(p, anchor)
         if match:
             result["data_faktury"] = match.group(1)
             break
 
-    # Okres rozliczeniowy
+    # Okres rozliczeniowy (kotwica: "okres")
     patterns = [
         rf'w\s+okresie\s+od\s+({date_pattern})\s+do\s+({date_pattern})',
         rf'za\s+okres\s+od\s+({date_pattern})\s+do\s+({date_pattern})',
@@ -58,14 +62,15 @@ def parse_invoice_simple(text):
         rf'okres:?\s*({date_pattern})\s*[-–]\s*({date_pattern})',
     ]
     for p in patterns:
-        match = re.search(p, text, re.IGNORECASE)
+        match = index.search(p, 'okres', re.IGNORECASE)
         if match:
             result["okres_rozliczeniowy"] = f"{match.group(1)} - {match.group(2)}"
             break
 
     # Sumy — różne formaty
     # E.ON: "Należność za faktyczne zużycie NETTO VAT% VAT BRUTTO"
-    match = re.search(r'Należność za faktyczne zużycie\s+([\d,]+)\s+\d+\s+([\d,]+)\s+([\d,]+)', text)
+    match = index.search(r'Należność za faktyczne zużycie\s+([\d,]+)\s+\d+\s+([\d,]+)\s+([\d,]+)',
+                         'należność za faktyczne zużycie')
     if match:
         result["suma_netto"] = float(match.group(1).replace(',', '.'))
         result["vat_kwota"] = float(match.group(2).replace(',', '.'))
@@ -73,7 +78,7 @@ def parse_invoice_simple(text):
 
     # PGE: "Wartość ogółem w rozbiciu na stawki VAT 23 NETTO VAT BRUTTO"
     if result["suma_netto"] == 0:
-        match = re.search(r'Wartość\s+ogółem.*?23\s+([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)', text)
+        match = index.search(r'Wartość\s+ogółem.{0,200}?23\s+([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)', 'ogółem')
         if match:
             result["suma_netto"] = float(match.group(1).replace(',', '.'))
             result["vat_kwota"] = float(match.group(2).replace(',', '.'))
@@ -81,7 +86,7 @@ def parse_invoice_simple(text):
 
     # TAURON/generyczny: "Do zapłaty NETTO VAT BRUTTO"
     if result["suma_netto"] == 0:
-        match = re.search(r'Do\s+zapłaty\s+([\d,]+)\s+([\d,]+)\s+([\d,]+)', text)
+        match = index.search(r'Do\s+zapłaty\s+([\d,]+)\s+([\d,]+)\s+([\d,]+)', 'zapłaty')
         if match:
             n = float(match.group(1).replace(',', '.'))
             v = float(match.group(2).replace(',', '.'))
@@ -93,19 +98,22 @@ def parse_invoice_simple(text):
 
     # Zużycie kWh
     consumption_patterns = [
-        r'Łączne\s+zużycie\s+energii\s+(\d+)\s*kWh',
-        r'Zużycie:?\s*(\d+)\s*kWh',
-        r'Zużycie\s+energii\s+elektrycznej.*?([\d.]+)\s*kWh',
-        r'(\d+)\s*kWh',
+        (r'Łączne\s+zużycie\s+energii\s+(\d+)\s*kWh', 'zużycie'),
+        (r'Zużycie:?\s*(\d+)\s*kWh', 'zużycie'),
+        (r'Zużycie\s+energii\s+elektrycznej.{0,200}?(?<![\d.])([\d.]+)\s*kWh', 'zużycie'),
+        (r'(?<!\d)(\d+)\s*kWh', 'kwh'),
     ]
-    for p in consumption_patterns:
-        match = re.search(p, text, re.IGNORECASE)
+    for p, anchor in consumption_patterns:
+        match = index.search(p, anchor, re.IGNORECASE)
         if match:
             val_str = match.group(1).replace(' ', '')
             # Obsługa separatora tysięcy (2.359 = 2359)
             if re.match(r'^\d{1,3}\.\d{3}$', val_str):
                 val_str = val_str.replace('.', '')
-            val = float(val_str)
+            try:
+                val = float(val_str)
+            except ValueError:  # same kropki ("..."), bez cyfr
+                continue
             if 50 <= val <= 100000:
                 result["zuzycie_kwh"] = val
                 break
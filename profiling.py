@@ -0,0 +1,110 @@
+"""
+Profilowanie requestów analizy faktur na produkcji
+- na żądanie: nagłówek X-Profile-Token zgodny z TANIPRAD_PROFILE_TOKEN → cProfile (plik .prof, pstats)
+- automatycznie: request wolniejszy niż TANIPRAD_PROFILE_SLOW_MS → próbki stosu z samplera
+  (plik .folded, format flamegraph: "funkcja;funkcja;... liczba_próbek")
+Profile zawierają tylko nazwy funkcji i plików źródłowych — bez treści PDF.
+"""
+import cProfile
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_DIR = os.environ.get('TANIPRAD_PROFILE_DIR', '/tmp/taniprad-profiles')
+PROFILE_TOKEN = os.environ.get('TANIPRAD_PROFILE_TOKEN', '')
+PROFILE_SLOW_MS = int(os.environ.get('TANIPRAD_PROFILE_SLOW_MS', '0'))
+SAMPLE_INTERVAL_MS = int(os.environ.get('TANIPRAD_PROFILE_SAMPLE_MS', '10'))
+PROFILE_KEEP = int(os.environ.get('TANIPRAD_PROFILE_KEEP', '200'))
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+
+def token_matches(token) -> bool:
+    """Czy nagłówek admina włącza profilowanie (porównanie w stałym czasie)"""
+    return bool(PROFILE_TOKEN) and bool(token) and hmac.compare_digest(str(token), PROFILE_TOKEN)
+
+
+class StackSampler(threading.Thread):
+    """Wątek próbkujący stos wskazanego wątku co interval sekund (koszt ~pomijalny przy 10 ms)"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='taniprad-stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def _profile_path(request_id: str, elapsed_ms: float, ext: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(PROFILE_DIR, f"{stamp}_{request_id}_{elapsed_ms:.0f}ms.{ext}")
+
+
+def _prune():
+    """Zostawia PROFILE_KEEP najnowszych profili"""
+    try:
+        names = sorted(n for n in os.listdir(PROFILE_DIR) if n.endswith(('.prof', '.folded')))
+        for name in names[:-PROFILE_KEEP] if PROFILE_KEEP else []:
+            os.remove(os.path.join(PROFILE_DIR, name))
+    except OSError:
+        pass
+
+
+@contextmanager
+def profile_request(request_id: str, forced: bool = False):
+    """Profiluje blok: cProfile gdy forced, sampler gdy ustawiony próg wolnych requestów"""
+    if not forced and not PROFILE_SLOW_MS:
+        yield
+        return
+
+    profiler = sampler = None
+    if forced:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        sampler = StackSampler(threading.get_ident(), SAMPLE_INTERVAL_MS / 1000)
+        sampler.start()
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        try:
+            if profiler is not None:
+                profiler.disable()
+                path = _profile_path(request_id, elapsed_ms, 'prof')
+                profiler.dump_stats(path)
+                print(f"🔬 Profil (na żądanie) zapisany: {path}")
+                _prune()
+            else:
+                sampler.stop()
+                if elapsed_ms >= PROFILE_SLOW_MS and sampler.counts:
+                    path = _profile_path(request_id, elapsed_ms, 'folded')
+                    with open(path, 'w') as f:
+                        for stack, count in sampler.counts.most_common():
+                            f.write(f"{stack} {count}\n")
+                    print(f"🐢 Wolny request {request_id} ({elapsed_ms:.0f} ms) — profil: {path}")
+                    _prune()
+        except OSError as e:
+            print(f"⚠️  Nie udało się zapisać profilu: {e}")
@@ -0,0 +1,184 @@
+"""
+Cache wyników analizy faktur kluczowany hashem treści pliku (SHA-256)
+Przechowuje gotowe, zserializowane odpowiedzi JSON — trafienie nie wymaga
+ani ponownego uploadu (POST /api/analyze-invoice/by-hash), ani parsowania.
+
+Dwa poziomy: LRU w pamięci workera (L1) i opcjonalnie trwały magazyn SQLite (L2,
+TANIPRAD_RESULT_DB) wspólny dla wszystkich workerów i przeżywający deploy / restart.
+L2 kluczowany jest hashem treści i wersją parsera — po zmianie parsera stare wyniki
+przestają trafiać. Odpowiedzi zapisywane są skompresowane (zlib), z TTL i limitem
+rozmiaru bazy (najstarsze wpisy usuwane jako pierwsze).
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+
+CACHE_TTL_SECONDS = int(os.environ.get('TANIPRAD_CACHE_TTL', '3600'))
+CACHE_MAX_ENTRIES = int(os.environ.get('TANIPRAD_CACHE_MAX_ENTRIES', '256'))
+
+# Trwały magazyn wyników (pusta ścieżka = wyłączony; wyniki zawierają dane z faktur, więc
+# plik tylko dla właściciela i krótki TTL — powtórna analiza tej samej faktury to zwykle te same dni)
+RESULT_DB = os.environ.get('TANIPRAD_RESULT_DB', '')
+RESULT_DB_TTL_SECONDS = int(os.environ.get('TANIPRAD_RESULT_DB_TTL', str(24 * 3600)))
+RESULT_DB_MAX_MB = int(os.environ.get('TANIPRAD_RESULT_DB_MAX_MB', '256'))
+RESULT_DB_EVICT_EVERY = 100  # zapisów między sprawdzeniami TTL i rozmiaru
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def file_sha256(filepath: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 pliku liczony strumieniowo"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def files_sha256(filepaths) -> str:
+    """Klucz treści uploadu: SHA-256 pliku, a dla kilku zdjęć stron — SHA-256 z hashy
+    kolejnych plików (hex, rozdzielone "\\n"); kolejność stron zmienia klucz"""
+    if len(filepaths) == 1:
+        return file_sha256(filepaths[0])
+    return hashlib.sha256('\n'.join(file_sha256(p) for p in filepaths).encode()).hexdigest()
+
+
+def normalize_sha256(value) -> str:
+    """Zwraca hash małymi literami albo '' jeśli to nie jest poprawny SHA-256 hex"""
+    value = str(value or '').strip().lower()
+    return value if _SHA256_RE.match(value) else ''
+
+
+class ResultStore:
+    """
+    Trwały magazyn odpowiedzi w SQLite: (hash treści, wersja parsera) -> odpowiedź (zlib).
+    WAL — workery czytają równolegle, zapis nie blokuje odczytów. Połączenie na wątek
+    i proces (po fork workera otwierane od nowa). Błędy bazy nigdy nie psują analizy:
+    odczyt zwraca wtedy None, zapis jest pomijany.
+    """
+
+    def __init__(self, path: str, version: int, ttl_seconds: int = RESULT_DB_TTL_SECONDS,
+                 max_bytes: int = RESULT_DB_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.version = version
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._puts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+        # Baza tylko dla właściciela (jak single_flight.publish); nowe -wal i -shm SQLite tworzy
+        # z uprawnieniami pliku bazy, istniejące (np. z wcześniejszej wersji) są zawężane
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.chmod(self.path + suffix, 0o600)
+        conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                     ' sha256 TEXT NOT NULL, parser_version INTEGER NOT NULL,'
+                     ' stored_at REAL NOT NULL, size INTEGER NOT NULL, body BLOB NOT NULL,'
+                     ' PRIMARY KEY (sha256, parser_version)) WITHOUT ROWID')
+        conn.execute('CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at)')
+        self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str):
+        try:
+            row = self._connect().execute(
+                'SELECT body FROM results WHERE sha256 = ? AND parser_version = ? AND stored_at > ?',
+                (key, self.version, time.time() - self.ttl_seconds)).fetchone()
+            return zlib.decompress(row[0]) if row else None
+        except (sqlite3.Error, zlib.error, OSError) as e:
+            print(f"⚠️  Odczyt magazynu wyników: {e}")
+            return None
+
+    def put(self, key: str, body: bytes):
+        data = zlib.compress(body, 6)
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO results (sha256, parser_version, stored_at, size, body) VALUES (?, ?, ?, ?, ?)',
+                (key, self.version, time.time(), len(data), data))
+            self._puts += 1
+            if self._puts % RESULT_DB_EVICT_EVERY == 1:
+                self.evict()
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️  Zapis magazynu wyników: {e}")
+
+    def evict(self):
+        """Usuwa wpisy po TTL i ze starszych wersji parsera, potem najstarsze ponad limit rozmiaru"""
+        conn = self._connect()
+        conn.execute('DELETE FROM results WHERE stored_at <= ? OR parser_version != ?',
+                     (time.time() - self.ttl_seconds, self.version))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Najnowsze wpisy mieszczące się w 90% limitu zostają, reszta jest usuwana
+        budget = self.max_bytes * 0.9
+        cutoff = None
+        for stored_at, size in conn.execute('SELECT stored_at, size FROM results ORDER BY stored_at DESC'):
+            budget -= size
+            if budget < 0:
+                cutoff = stored_at
+                break
+        if cutoff is not None:
+            deleted = conn.execute('DELETE FROM results WHERE stored_at <= ?', (cutoff,)).rowcount
+            print(f"🧹 Magazyn wyników: usunięto {deleted} najstarszych wpisów (limit {self.max_bytes // 2**20} MB)")
+
+
+class ResultCache:
+    """LRU z TTL: hash treści -> zserializowana odpowiedź (bytes); chybienie sprawdza trwały magazyn"""
+
+    def __init__(self, ttl_seconds: int = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES,
+                 store: ResultStore = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.store = store
+        self._entries = OrderedDict()  # hash -> (zapisano, body)
+        self._lock = Lock()
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, body = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def _put_memory(self, key: str, body: bytes):
+        with self._lock:
+            self._entries[key] = (time.time(), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        body = self._get_memory(key)
+        if body is None and self.store is not None:
+            body = self.store.get(key)
+            if body is not None:
+                self._put_memory(key, body)
+        return body
+
+    def put(self, key: str, body: bytes):
+        self._put_memory(key, body)
+        if self.store is not None:
+            self.store.put(key, body)
+
+    def __len__(self):
+        return len(self._entries)
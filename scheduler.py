@@ -0,0 +1,314 @@
+"""
+Sprawiedliwe szeregowanie parsowania faktur między klientami, w osobnych torach wykonania
+check_rate_limit ogranicza tylko częstość requestów; tu decyduje się, czyje parsowanie
+rusza jako następne. W procesie: co najwyżej N parsowań naraz w torze, klienci
+obsługiwani po kolei (round-robin), jeden klient ma najwyżej TANIPRAD_PARSE_PER_CLIENT
+parsowań w toku i TANIPRAD_PARSE_QUEUE_PER_CLIENT czekających. Seria ciężkich PDF-ów
+z jednego IP nie blokuje więc pozostałych użytkowników — ich lekkie faktury wchodzą
+między kolejne pliki z serii.
+
+Tory (lanes): upload trafia do toru szybkiego albo ciężkiego wg szacowanego kosztu
+(typ pliku, liczba stron PDF, piksele zdjęć). Każdy tor ma własne sloty i limit czasu,
+więc fala zdjęć do OCR nie opóźnia tanich PDF-ów z warstwą tekstową.
+
+Sync workery gunicorna obsługują jeden request naraz, więc kolejka w procesie nic
+tam nie daje: limity na klienta i na tor ciężki obowiązują też między workerami —
+sloty to pliki z blokadą flock w TANIPRAD_RUN_DIR. Kto nie dostał slotu, dostaje
+od razu 429 / 503 zamiast zajmować kolejny worker.
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import metrics
+
+PARSE_SLOTS = int(os.environ.get('TANIPRAD_PARSE_SLOTS', '0')) or os.cpu_count() or 1
+PER_CLIENT = int(os.environ.get('TANIPRAD_PARSE_PER_CLIENT', '2'))
+QUEUE_PER_CLIENT = int(os.environ.get('TANIPRAD_PARSE_QUEUE_PER_CLIENT', '8'))
+RETRY_AFTER = 5  # s — podpowiedź dla klienta odrzuconego przez limit
+
+SLOT_DIR = os.path.join(metrics.RUN_DIR, 'parse-slots')
+# Sloty klienta: pliki nazwane pełnym skrótem klienta (bez wspólnych kubełków — inny klient
+# nie zajmie cudzego limitu). Plik usuwa ten, kto zwalnia slot; pliki po zabitych workerach
+# sprząta co SLOT_SWEEP_INTERVAL s pierwszy proces, który o to poprosi
+SLOT_SWEEP_INTERVAL = 300
+_last_sweep = 0.0
+
+# Tory wykonania i szacowanie kosztu (sekundy pracy CPU)
+LANE_FAST = 'szybki'
+LANE_HEAVY = 'ciezki'
+LANE_FAST_MAX_COST = float(os.environ.get('TANIPRAD_LANE_FAST_MAX_COST', '2'))
+PDF_PAGE_COST = 0.2      # s na stronę PDF z warstwą tekstową
+OCR_PAGE_COST = 1.5      # s na zdjęcie strony (start Tesseracta, analiza układu)
+OCR_MEGAPIXEL_COST = 0.4  # s na megapiksel zdjęcia
+
+
+class ClientBusy(Exception):
+    """Klient ma już komplet parsowań w toku / w kolejce"""
+
+
+class LaneBusy(Exception):
+    """Tor nie przydzielił slotu w swoim limicie czasu albo wszystkie jego workery są zajęte"""
+
+
+class FairScheduler:
+    """
+    Sloty parsowania przydzielane klientom po kolei (round-robin).
+    Czekać można w wątku (slot) albo w pętli asyncio (acquire_async + release) —
+    czekający nie zajmują wątków puli parsowania.
+    """
+
+    def __init__(self, slots: int = PARSE_SLOTS, per_client: int = PER_CLIENT,
+                 queue_per_client: int = QUEUE_PER_CLIENT):
+        self.slots = slots
+        self.per_client = per_client
+        self.queue_per_client = queue_per_client
+        self._lock = threading.Lock()
+        self._waiting = defaultdict(deque)  # klient -> funkcje budzące czekających
+        self._rotation = deque()            # klienci z czekającymi, w kolejności obsługi
+        self._in_flight = defaultdict(int)  # klient -> parsowania w toku
+        self._running = 0
+
+    def _enqueue(self, client: str, wake):
+        with self._lock:
+            if len(self._waiting.get(client, ())) >= self.queue_per_client:
+                raise ClientBusy(client)
+            if not self._waiting[client]:
+                self._rotation.append(client)
+            self._waiting[client].append(wake)
+            self._dispatch()
+
+    def _withdraw(self, client: str, wake) -> bool:
+        """Wycofuje czekającego po upływie limitu czasu. False, gdy slot został już przydzielony."""
+        with self._lock:
+            waiting = self._waiting.get(client)
+            if not waiting or wake not in waiting:
+                return False
+            waiting.remove(wake)
+            if not waiting:
+                del self._waiting[client]
+                self._rotation.remove(client)
+            return True
+
+    def _dispatch(self):
+        """Wolne sloty dla kolejnych klientów z rotacji (pomija tych z kompletem w toku); pod _lock"""
+        while self._running < self.slots:
+            for _ in range(len(self._rotation)):
+                client = self._rotation[0]
+                self._rotation.rotate(-1)
+                if self._in_flight[client] < self.per_client:
+                    break
+            else:
+                return
+            wake = self._waiting[client].popleft()
+            if not self._waiting[client]:
+                del self._waiting[client]
+                self._rotation.remove(client)
+            self._running += 1
+            self._in_flight[client] += 1
+            wake()
+
+    def release(self, client: str):
+        with self._lock:
+            self._running -= 1
+            self._in_flight[client] -= 1
+            if not self._in_flight[client]:
+                del self._in_flight[client]
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, client: str, timeout: float = None):
+        """Czeka (w bieżącym wątku, najwyżej timeout s) na slot klienta, potem trzyma go do końca bloku"""
+        granted = threading.Event()
+        self._enqueue(client, granted.set)
+        if not granted.wait(timeout) and self._withdraw(client, granted.set):
+            raise LaneBusy(f'brak slotu w {timeout:g} s')
+        try:
+            yield
+        finally:
+            self.release(client)
+
+    async def acquire_async(self, client: str, timeout: float = None):
+        """Jak slot, ale czeka w pętli asyncio. Po pracy wywołać release(client)."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(granted.set_result, None)
+
+        self._enqueue(client, wake)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except asyncio.TimeoutError:
+            if self._withdraw(client, wake):
+                raise LaneBusy(f'brak slotu w {timeout:g} s')
+            await granted
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'running': self._running,
+                'queued': sum(len(q) for q in self._waiting.values()),
+                'clients_waiting': len(self._rotation),
+                'limits': {'slots': self.slots, 'per_client': self.per_client,
+                           'queue_per_client': self.queue_per_client},
+            }
+
+
+def _try_lock(path: str, removable: bool):
+    """Otwarty plik z blokadą flock albo None, gdy zajęty. removable: plik może zostać usunięty
+    przez innego posiadacza — blokada liczy się tylko wtedy, gdy ścieżka wciąż wskazuje ten plik."""
+    while True:
+        f = open(path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        if not removable:
+            return f
+        try:
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()  # zablokowany plik został już usunięty — otwórz nowy
+
+
+@contextmanager
+def _flock_slot(name: str, count: int, removable: bool = False):
+    """Jeden z count slotów o nazwie name wspólnych dla wszystkich workerów (flock, bez czekania).
+    Zwraca przez yield True albo False, gdy wszystkie zajęte. removable: plik slotu usuwany
+    przy zwolnieniu (sloty klientów — inaczej zostaje plik na każdego klienta)."""
+    os.makedirs(SLOT_DIR, exist_ok=True)
+    for number in range(count):
+        path = os.path.join(SLOT_DIR, f'{name}.{number}.lock')
+        f = _try_lock(path, removable)
+        if f is None:
+            continue
+        try:
+            yield True
+        finally:
+            if removable:
+                os.unlink(path)  # jeszcze pod blokadą — czekający na ten plik otworzą nowy
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        return
+    yield False
+
+
+def _sweep_client_slots():
+    """Usuwa wolne pliki slotów klientów (zostają po zabitym workerze), najwyżej co SLOT_SWEEP_INTERVAL s"""
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep < SLOT_SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    try:
+        names = [name for name in os.listdir(SLOT_DIR) if name.startswith('client-')]
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(SLOT_DIR, name)
+        try:
+            f = _try_lock(path, removable=True)
+            if f is not None:
+                os.unlink(path)
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+        except OSError:
+            pass
+
+
+@contextmanager
+def client_slot(client: str):
+    """Slot klienta wspólny dla wszystkich workerów. ClientBusy, gdy brak wolnego."""
+    _sweep_client_slots()
+    with _flock_slot(f'client-{hashlib.sha1(client.encode()).hexdigest()}', PER_CLIENT,
+                     removable=True) as acquired:
+        if not acquired:
+            raise ClientBusy(client)
+        yield
+
+
+class Lane:
+    """
+    Tor wykonania: własny FairScheduler (sloty w procesie), limit czasu (czekanie na slot
+    i termin samej pracy) i opcjonalnie limit workerów usługi pracujących naraz w tym torze.
+    """
+
+    def __init__(self, name: str, slots: int, timeout: float, workers: int = 0):
+        self.name = name
+        self.timeout = timeout
+        self.workers = workers
+        self.scheduler = FairScheduler(slots=slots)
+
+    @contextmanager
+    def shared_slots(self, client: str):
+        """Sloty wspólne dla workerów: klienta i toru (gdy tor ma limit workerów)"""
+        with client_slot(client):
+            if not self.workers:
+                yield
+                return
+            with _flock_slot(f'lane-{self.name}', self.workers) as acquired:
+                if not acquired:
+                    raise LaneBusy(f'tor {self.name}: {self.workers} workerów zajętych')
+                yield
+
+    @contextmanager
+    def slot(self, client: str):
+        """Slot w torze (wątek czeka najwyżej timeout); yield: termin pracy (time.monotonic)"""
+        with self.scheduler.slot(client, timeout=self.timeout):
+            with self.shared_slots(client):
+                yield time.monotonic() + self.timeout
+
+    def snapshot(self) -> dict:
+        snapshot = self.scheduler.snapshot()
+        snapshot['limits'].update(timeout_s=self.timeout, workers=self.workers)
+        return snapshot
+
+
+LANES = {
+    LANE_FAST: Lane(LANE_FAST,
+                    slots=int(os.environ.get('TANIPRAD_LANE_FAST_SLOTS', '0')) or PARSE_SLOTS,
+                    timeout=float(os.environ.get('TANIPRAD_LANE_FAST_TIMEOUT', '30'))),
+    LANE_HEAVY: Lane(LANE_HEAVY,
+                     slots=int(os.environ.get('TANIPRAD_LANE_HEAVY_SLOTS', '0')) or max(1, PARSE_SLOTS // 2),
+                     timeout=float(os.environ.get('TANIPRAD_LANE_HEAVY_TIMEOUT', '90')),
+                     workers=int(os.environ.get('TANIPRAD_LANE_HEAVY_WORKERS', '0'))
+                     or max(1, int(os.environ.get('WEB_CONCURRENCY', '4')) // 2)),
+}
+
+
+def estimate_cost(filepaths, file_ext: str) -> float:
+    """Szacowany czas analizy uploadu (s): strony PDF albo zdjęcia stron i ich piksele.
+    Czyta tylko nagłówki plików (pypdfium2 / PIL) — bez parsowania. Liczbę stron PDF
+    parser_advanced.page_count zapamiętuje — parser nie liczy jej drugi raz."""
+    if file_ext == 'pdf':
+        from parser_advanced import page_count
+
+        return (page_count(filepaths[0]) or 1) * PDF_PAGE_COST
+
+    from PIL import Image
+
+    cost = 0.0
+    for filepath in filepaths:
+        cost += OCR_PAGE_COST
+        try:
+            with Image.open(filepath) as image:
+                cost += image.width * image.height / 1e6 * OCR_MEGAPIXEL_COST
+        except Exception:
+            pass
+    return cost
+
+
+def choose_lane(filepaths, file_ext: str) -> Lane:
+    cost = estimate_cost(filepaths, file_ext)
+    lane = LANES[LANE_FAST] if cost <= LANE_FAST_MAX_COST else LANES[LANE_HEAVY]
+    print(f"🛤️  Tor {lane.name} (szacowany koszt {cost:.1f} s)")
+    return lane
@@ -0,0 +1,147 @@
+"""
+Single-flight: jedna analiza danej treści naraz we wszystkich workerach
+Podwójne kliknięcie "Analizuj" albo odświeżenie strony w trakcie parsowania wysyła
+ten sam plik ponownie — często do innego workera, który nie widzi cache'u pierwszego.
+Pierwszy request (lider) trzyma blokadę flock na pliku <hash>.lock w TANIPRAD_RUN_DIR
+i po udanej analizie zapisuje obok gotową odpowiedź (<hash>.json). Kolejne requesty
+z tym samym hashem czekają na zwolnienie blokady i zwracają wynik lidera zamiast
+drugi raz uruchamiać pdfplumber / OCR. Gdy lider zakończył się błędem, następny
+czekający sam zostaje liderem.
+
+Czekający nie zajmują slotów parsowania (scheduler.py) — czekają przed nimi.
+Wyniki zawierają dane z faktur: pliki tylko dla właściciela, usuwane po RESULT_TTL.
+"""
+import asyncio
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+
+import metrics
+
+FLIGHT_DIR = os.path.join(metrics.RUN_DIR, 'inflight')
+RESULT_TTL = 300       # s — wynik lidera i nieużywane pliki blokad (dłużej niż limit czasu toru)
+POLL_INTERVAL = 0.05   # s — sprawdzanie blokady lidera przez czekających
+
+
+def _path(key: str, suffix: str) -> str:
+    return os.path.join(FLIGHT_DIR, key + suffix)
+
+
+def _open_lock(key: str):
+    os.makedirs(FLIGHT_DIR, exist_ok=True)
+    path = _path(key, '.lock')
+    f = open(path, 'a')
+    os.utime(path)  # świeży plik blokady nie zostanie usunięty przez cleanup
+    return f
+
+
+def _try_lock(f) -> bool:
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _leader_result(key: str):
+    """Odpowiedź zapisana przez lidera (nie starsza niż RESULT_TTL)"""
+    path = _path(key, '.json')
+    try:
+        if time.time() - os.path.getmtime(path) > RESULT_TTL:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _joined(key: str, since: float, acquired: bool):
+    """Po czekaniu: wynik lidera albo None (jesteśmy liderem / lot się przedłużył)"""
+    if not acquired:
+        print(f"⏳ Analiza {key[:12]} w innym workerze trwa zbyt długo — analizuję równolegle")
+        return None
+    body = _leader_result(key)
+    if body is not None:
+        print(f"🔗 Wynik {key[:12]} współdzielony z równoległej analizy ({time.time() - since:.1f} s czekania)")
+    return body
+
+
+@contextmanager
+def coalesce(key: str, timeout: float):
+    """
+    Lot analizy treści key. Yield: odpowiedź lidera (bytes), gdy ta sama treść była właśnie
+    analizowana, albo None — wtedy wołający analizuje sam (jako lider, z blokadą do końca bloku)
+    i zapisuje udany wynik przez publish(). Czeka na lidera najwyżej timeout s.
+    """
+    if not key:
+        yield None
+        return
+    f = _open_lock(key)
+    try:
+        acquired = _try_lock(f)
+        if acquired:
+            yield None
+            return
+        since = time.time()
+        deadline = time.monotonic() + timeout
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            acquired = _try_lock(f)
+        yield _joined(key, since, acquired)
+    finally:
+        f.close()  # zamknięcie zwalnia blokadę
+
+
+async def join_async(key: str, timeout: float):
+    """
+    Jak coalesce, ale czeka w pętli asyncio i bez bloku: zwraca (odpowiedź lidera albo None,
+    release). Blokadę zwalnia dopiero release() — lider ASGI woła je, gdy wątek parsowania
+    naprawdę skończy (także po odpowiedzi 504), a nie gdy request przestał czekać.
+    """
+    if not key:
+        return None, _no_lock
+    f = _open_lock(key)
+    try:
+        acquired = _try_lock(f)
+        if acquired:
+            return None, f.close
+        since = time.time()
+        deadline = time.monotonic() + timeout
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            acquired = _try_lock(f)
+        return _joined(key, since, acquired), f.close  # zamknięcie zwalnia blokadę
+    except BaseException:
+        f.close()
+        raise
+
+
+def _no_lock():
+    pass
+
+
+def publish(key: str, body: bytes):
+    """Zapisuje udaną odpowiedź lidera dla czekających (atomowo) i sprząta stare pliki lotów"""
+    if not key:
+        return
+    try:
+        os.makedirs(FLIGHT_DIR, exist_ok=True)
+        tmp_path = _path(key, f'.{os.getpid()}.tmp')
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, _path(key, '.json'))
+        _cleanup()
+    except OSError as e:
+        print(f"⚠️  Nie udało się zapisać wyniku lotu {key[:12]}: {e}")
+
+
+def _cleanup():
+    now = time.time()
+    for name in os.listdir(FLIGHT_DIR):
+        path = os.path.join(FLIGHT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > RESULT_TTL:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,121 @@
+"""
+Zagregowane statystyki analiz dla dashboardu (GET /api/stats)
+Każda udana analiza aktualizuje w SQLite kilka liczników, sum i kubełków histogramu:
+analizy wg dostawcy i typu dokumentu, sumy oszczędności wg filarów, rozkład zużycia kWh.
+Żadnych danych faktury poza tymi liczbami — bez numerów, dat i kwot pojedynczych
+dokumentów. Aktualizacja to jedna transakcja UPSERT-ów (atomowa między workerami),
+odczyt — stała liczba wierszy, niezależnie od liczby analiz.
+
+Liczona jest analiza treści (parsowanie), nie każdy request: ponowny upload tego
+samego pliku obsłużony z cache nie zmienia statystyk.
+"""
+import os
+import sqlite3
+import threading
+
+import metrics
+
+STATS_DB = os.environ.get('TANIPRAD_STATS_DB', os.path.join(metrics.RUN_DIR, 'stats.db'))
+
+# Kubełki zużycia (kWh w okresie rozliczeniowym): [od, do), ostatni bez górnej granicy
+KWH_BUCKETS = (0, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000)
+FILARY = ('filar1_vat', 'filar2_certyfikaty', 'filar3_dystrybucja', 'filar4_oplaty', 'total')
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """Połączenie na wątek i proces (po fork workera otwierane od nowa)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    os.makedirs(os.path.dirname(os.path.abspath(STATS_DB)), exist_ok=True)
+    conn = sqlite3.connect(STATS_DB, timeout=2.0, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS stats ('
+                 ' key TEXT PRIMARY KEY, count INTEGER NOT NULL, total REAL NOT NULL) WITHOUT ROWID')
+    _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def _kwh_bucket(kwh: float) -> int:
+    """Dolna granica kubełka zużycia"""
+    lower = KWH_BUCKETS[0]
+    for edge in KWH_BUCKETS:
+        if kwh < edge:
+            break
+        lower = edge
+    return lower
+
+
+def _document_updates(document: dict):
+    """(klucz, wartość) do zsumowania dla jednego wyniku analizy"""
+    typ = document.get('typ_dokumentu', '')
+    if typ == 'prognoza':
+        data = document.get('dane_prognozy') or {}
+    else:
+        data = document.get('metadata') or {}
+    yield 'analizy', 0
+    yield f'typ:{typ}', 0
+    yield f'dostawca:{data.get("sprzedawca") or "unknown"}', 0
+
+    kwh = data.get('zuzycie_kwh') or 0
+    if kwh > 0:
+        yield 'kwh', kwh
+        yield f'kwh:{_kwh_bucket(kwh)}', 0
+
+    savings = document.get('savings')
+    if savings is not None:
+        savings = savings if isinstance(savings, dict) else savings.to_dict()
+        for filar in FILARY:
+            yield f'filar:{filar}', savings.get(filar) or 0
+
+
+def record(payload: dict):
+    """Dolicza udaną analizę (pojedynczy dokument albo pakiet) do statystyk"""
+    documents = payload.get('dokumenty') if payload.get('typ_dokumentu') == 'pakiet' else [payload]
+    updates = [update for document in documents or () for update in _document_updates(document)]
+    try:
+        conn = _connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT INTO stats (key, count, total) VALUES (?, 1, ?)'
+                             ' ON CONFLICT (key) DO UPDATE SET count = count + 1, total = total + excluded.total',
+                             updates)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error as e:
+        print(f"⚠️  Zapis statystyk: {e}")
+
+
+def snapshot() -> dict:
+    """Statystyki dla /api/stats: liczniki, średnie i histogram z zagregowanych wierszy"""
+    rows = {key: (count, total) for key, count, total in _connect().execute('SELECT key, count, total FROM stats')}
+
+    def group(prefix):
+        return {key[len(prefix):]: count for key, (count, _) in rows.items() if key.startswith(prefix)}
+
+    def average(key, digits):
+        count, total = rows.get(key, (0, 0))
+        return round(total / count, digits) if count else None
+
+    analizy = rows.get('analizy', (0, 0))[0]
+    wg_typu = group('typ:')
+    histogram = group('kwh:')
+    return {
+        'analizy': analizy,
+        'wg_dostawcy': group('dostawca:'),
+        'wg_typu': wg_typu,
+        'udzial_prognoz': round(wg_typu.get('prognoza', 0) / analizy, 3) if analizy else None,
+        'srednie_oszczednosci': {filar: average(f'filar:{filar}', 2) for filar in FILARY},
+        'zuzycie_kwh': {
+            'srednia': average('kwh', 1),
+            'histogram': [
+                {'od': lower, 'do': upper, 'liczba': histogram.get(str(lower), 0)}
+                for lower, upper in zip(KWH_BUCKETS, KWH_BUCKETS[1:] + (None,))
+            ],
+        },
+    }
@@ -0,0 +1,91 @@
+"""
+Znormalizowany model tabel faktury — budowany raz na dokument
+Parsery pozycji, sum i zużycia (parser_advanced) przeglądają te same tabele
+z pdfplumbera kilka razy: każdy sam sklejał wiersze w tekst małymi literami,
+szukał wiersza nagłówka i kolumn po słowach kluczowych i liczył wartości komórek.
+Tu każda z tych rzeczy liczona jest najwyżej raz na dokument (przy pierwszym
+pytaniu) i współdzielona przez wszystkie parsery tabel — np. sumy PGE, które
+po nieudanym wyszukaniu przechodzą do parsera generycznego, nie sklejają
+wszystkich wierszy drugi raz.
+"""
+from typing import List, Optional
+
+
+class Table:
+    """Jedna tabela: wiersze bez zmian; sklejony tekst wierszy (oryginalny i małymi literami),
+    nagłówki, kolumny i liczby z wierszy — liczone przy pierwszym pytaniu
+    (parser zwykle kończy na pierwszym pasującym wierszu) i zapamiętywane dla kolejnych"""
+
+    __slots__ = ('rows', '_texts', '_lower', '_cells', '_headers', '_columns', '_numbers')
+
+    def __init__(self, rows: List):
+        self.rows = rows
+        self._texts = [None] * len(rows)
+        self._lower = [None] * len(rows)
+        self._cells = {}    # numer wiersza -> komórki małymi literami
+        self._headers = {}  # grupy słów kluczowych -> numer wiersza nagłówka
+        self._columns = {}  # (wiersz, słowa kluczowe) -> numer kolumny
+        self._numbers = {}  # numer wiersza -> dodatnie liczby z komórek
+
+    def text(self, row_idx: int) -> str:
+        """Niepuste komórki wiersza sklejone spacją ('' dla pustego wiersza)"""
+        text = self._texts[row_idx]
+        if text is None:
+            row = self.rows[row_idx]
+            text = self._texts[row_idx] = ' '.join([str(cell) for cell in row if cell]) if row else ''
+        return text
+
+    def lower(self, row_idx: int) -> str:
+        """text(row_idx) małymi literami"""
+        lower = self._lower[row_idx]
+        if lower is None:
+            lower = self._lower[row_idx] = self.text(row_idx).lower()
+        return lower
+
+    def header(self, *groups) -> Optional[int]:
+        """Pierwszy wiersz zawierający co najmniej jedno słowo z każdej grupy (jak `in` na tekście
+        wiersza małymi literami), np. header(['opis'], ['wartość', 'netto'])"""
+        key = tuple(tuple(group) for group in groups)
+        if key not in self._headers:
+            self._headers[key] = None
+            for idx in range(len(self.rows)):
+                row_lower = self.lower(idx)
+                if all(any(kw in row_lower for kw in group) for group in key):
+                    self._headers[key] = idx
+                    break
+        return self._headers[key]
+
+    def cells_lower(self, row_idx: int) -> List[str]:
+        """Komórki wiersza małymi literami (pusta komórka -> '')"""
+        if row_idx not in self._cells:
+            self._cells[row_idx] = [str(cell).lower() if cell else '' for cell in self.rows[row_idx]]
+        return self._cells[row_idx]
+
+    def column(self, row_idx: int, keywords: List[str]) -> Optional[int]:
+        """Indeks pierwszej komórki wiersza row_idx zawierającej któreś ze słów kluczowych"""
+        key = (row_idx, tuple(keywords))
+        if key not in self._columns:
+            self._columns[key] = None
+            for idx, cell in enumerate(self.cells_lower(row_idx)):
+                if cell and any(kw in cell for kw in keywords):
+                    self._columns[key] = idx
+                    break
+        return self._columns[key]
+
+    def numbers(self, row_idx: int, clean) -> List[float]:
+        """Dodatnie wartości niepustych komórek wiersza (clean: str -> float, np. InvoiceParser._clean_number),
+        w kolejności kolumn — wspólne dla parserów sum"""
+        if row_idx not in self._numbers:
+            values = (clean(str(cell)) for cell in self.rows[row_idx] if cell)
+            self._numbers[row_idx] = [value for value in values if value > 0]
+        return self._numbers[row_idx]
+
+
+class TableIndex:
+    """Tabele dokumentu (bez pustych) w kolejności z ekstrakcji"""
+
+    __slots__ = ('source', 'tables')
+
+    def __init__(self, tables: List):
+        self.source = tables
+        self.tables = [Table(table) for table in tables or () if table]
@@ -0,0 +1,66 @@
+"""
+ASGI po 504: wątek parsowania pracuje dalej, więc pliki uploadu i blokada single_flight
+muszą przetrwać odpowiedź i zniknąć dopiero, gdy wątek skończy.
+Uruchomienie: python -m pytest -q tests
+"""
+import asyncio
+import fcntl
+import functools
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asgi  # noqa: E402
+import single_flight  # noqa: E402
+from scheduler import LANE_FAST, Lane  # noqa: E402
+
+CONTENT_HASH = 'ab' * 32
+
+
+def _lock_free(path: str) -> bool:
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+
+@pytest.fixture
+def slow_parse(tmp_path, monkeypatch):
+    """Analiza trwająca do release.set(), tor z limitem czasu 0,2 s"""
+    release = threading.Event()
+    lane = Lane(LANE_FAST, slots=1, timeout=0.2)
+    monkeypatch.setattr(single_flight, 'FLIGHT_DIR', str(tmp_path / 'inflight'))
+    monkeypatch.setattr(asgi.backend, 'cached_result', lambda filepaths: (CONTENT_HASH, None))
+    monkeypatch.setattr(asgi, 'choose_lane', lambda filepaths, file_ext: lane)
+    monkeypatch.setattr(asgi, '_analyze_profiled', lambda *args: release.wait(10) and (b'{}', 200))
+    return release
+
+
+def test_upload_and_flight_lock_outlive_504(tmp_path, slow_parse):
+    upload = tmp_path / 'faktura.pdf'
+    upload.write_bytes(b'%PDF-1.4')
+    lock_path = os.path.join(single_flight.FLIGHT_DIR, CONTENT_HASH + '.lock')
+
+    async def scenario():
+        cleanup = [functools.partial(os.remove, str(upload))]
+        _, status, _ = await asgi._analyze([str(upload)], 'pdf', '10.0.0.1', 'req', False, cleanup)
+        asgi._cleanup(cleanup)  # jak finally w analyze_invoice
+        assert status == 504
+        assert upload.exists()
+        assert not _lock_free(lock_path)
+
+        slow_parse.set()
+        for _ in range(100):
+            if not upload.exists() and _lock_free(lock_path):
+                break
+            await asyncio.sleep(0.02)
+        assert not upload.exists()
+        assert _lock_free(lock_path)
+
+    asyncio.run(scenario())
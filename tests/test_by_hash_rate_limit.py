@@ -0,0 +1,51 @@
+"""
+/api/analyze-invoice/by-hash ma limit requestów klienta jak upload (check_rate_limit),
+we własnym kubełku — seria zapytań o hash nie blokuje uploadu.
+Uruchomienie: python -m pytest -q tests
+"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import asgi  # noqa: E402
+
+UNKNOWN = {'sha256': 'cd' * 32}
+
+
+@pytest.fixture(autouse=True)
+def fresh_limits(monkeypatch):
+    monkeypatch.setattr(app, 'rate_limit_data', app.defaultdict(list))
+
+
+def test_flask_by_hash_limited_per_client():
+    http = app.app.test_client()
+    statuses = [http.post('/api/analyze-invoice/by-hash', json=UNKNOWN).status_code for _ in range(11)]
+    assert statuses == [404] * 10 + [429]
+    assert app.check_rate_limit(app.resolve_client_ip('127.0.0.1'))  # upload ma własny kubełek
+
+
+def test_asgi_by_hash_limited_per_client():
+    body = json.dumps(UNKNOWN).encode()
+    scope = {'type': 'http', 'client': ('10.0.0.7', 1234),
+             'headers': [(b'content-type', b'application/json')]}
+
+    async def request():
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi.analyze_invoice_by_hash(scope, receive, send)
+        return sent[0]['status']
+
+    statuses = [asyncio.run(request()) for _ in range(11)]
+    assert statuses == [404] * 10 + [429]
@@ -0,0 +1,49 @@
+"""
+Sloty klienta wspólne dla workerów (scheduler.client_slot): limit liczony na klienta,
+nie na kubełek współdzielony z innymi klientami, i bez plików po zwolnieniu slotu.
+Uruchomienie: python -m pytest -q tests
+"""
+import fcntl
+import os
+import sys
+from contextlib import ExitStack
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def slot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, 'SLOT_DIR', str(tmp_path))
+    monkeypatch.setattr(scheduler, '_last_sweep', 0.0)
+    return tmp_path
+
+
+def test_client_limit_does_not_block_other_clients(slot_dir):
+    clients = [f'10.0.{i // 256}.{i % 256}' for i in range(2000)]
+    with ExitStack() as stack:
+        for _ in range(scheduler.PER_CLIENT):
+            stack.enter_context(scheduler.client_slot(clients[0]))
+        with pytest.raises(scheduler.ClientBusy):
+            stack.enter_context(scheduler.client_slot(clients[0]))
+        # Dawniej 1024 kubełki: któryś z 2000 klientów trafiał do kubełka pełnego klienta 0
+        for client in clients[1:]:
+            with scheduler.client_slot(client):
+                pass
+    assert os.listdir(slot_dir) == []
+
+
+def test_stale_slot_files_are_swept(slot_dir, monkeypatch):
+    stale = slot_dir / 'client-0000.0.lock'
+    stale.touch()
+    held = slot_dir / 'client-1111.0.lock'
+    with open(held, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        monkeypatch.setattr(scheduler, '_last_sweep', -scheduler.SLOT_SWEEP_INTERVAL)
+        with scheduler.client_slot('10.0.0.1'):
+            pass
+        assert not stale.exists()
+        assert held.exists()  # zajęty przez inny proces — zostaje
@@ -0,0 +1,49 @@
+"""
+Magazyn IR (ir_store): IR warstwy tekstowej (1. strona, bez tabel) nie może zostać
+jedynym IR pliku — reprocess ekstrahuje go ponownie ze źródła, `add` zapisuje pełny IR.
+Uruchomienie: python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ir_store  # noqa: E402
+from parser_advanced import TIER_TABLES, TIER_TEXT  # noqa: E402
+from result_cache import file_sha256  # noqa: E402
+from warmup import build_sample_pdf  # noqa: E402
+
+
+@pytest.fixture
+def sample(tmp_path, monkeypatch):
+    monkeypatch.setattr(ir_store, 'IR_DIR', str(tmp_path / 'ir'))
+    sources = tmp_path / 'zrodla'
+    sources.mkdir()
+    path = sources / 'faktura.pdf'
+    path.write_bytes(build_sample_pdf())
+    return str(path), file_sha256(str(path))
+
+
+def _tiers(content_hash):
+    return [ir['tier'] for ir in ir_store.load(content_hash)]
+
+
+def test_reprocess_reextracts_text_tier_ir_from_source(sample):
+    path, content_hash = sample
+    ir_store.parse_documents(path, content_hash, tiered=True)
+    assert _tiers(content_hash) == [TIER_TEXT]
+
+    assert ir_store.reprocess()['bez_zrodla'] == 1
+    stats = ir_store.reprocess(sources_dir=os.path.dirname(path))
+    assert stats['ponowna_ekstrakcja'] == 1
+    assert _tiers(content_hash) == [TIER_TABLES]
+
+
+def test_add_stores_full_ir(sample):
+    path, content_hash = sample
+    ir_store.parse_documents(path, content_hash, tiered=True)
+    ir_store.parse_documents(path, content_hash, tiered=False)
+    assert _tiers(content_hash) == [TIER_TABLES]
+    assert ir_store.replayable(ir_store.load(content_hash))
@@ -0,0 +1,61 @@
+"""
+OCR regionów (ocr.extract_text z TANIPRAD_OCR_ROI=1): na stronę najwyżej dwa wywołania
+tesseract — zamaskowana strona i kolumny kwot — niezależnie od liczby regionów.
+Tesseract zastąpiony atrapą zwracającą po jednym słowie na wiersz tekstu każdego regionu.
+Uruchomienie: python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytesseract = pytest.importorskip('pytesseract')
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+import ocr  # noqa: E402
+
+
+def _invoice_image(path):
+    image = Image.new('L', (1600, 1000), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=28)
+    draw.text((80, 60), 'FAKTURA VAT NR E/123/2025', fill=0, font=font)
+    draw.text((80, 110), 'Sprzedawca: E.ON Polska', fill=0, font=font)
+    for row in range(6):
+        y = 300 + row * 45
+        draw.text((80, y), 'Energia czynna', fill=0, font=font)
+        draw.text((700, y), f'{row}12,34', fill=0, font=font)
+        draw.text((1100, y), f'{row}45,67', fill=0, font=font)
+    image.save(path)
+
+
+def _fake_image_to_data(calls):
+    def image_to_data(image, lang=None, config='', output_type=None, timeout=0):
+        calls.append(config)
+        data = {'text': [], 'left': [], 'top': [], 'height': [], 'conf': []}
+        for box, is_table, number in ocr.find_regions(image):
+            if 'whitelist' in config:
+                text = '112,34'  # drugi przebieg: obraz z samymi kolumnami kwot
+            else:
+                text = 'Energia' if number == 0 else '1I2,34'
+            for key, value in zip(data, (text, box[0] + 5, box[1] + 5, 20, '90')):
+                data[key].append(value)
+        return data
+    return image_to_data
+
+
+def test_regions_read_in_two_tesseract_calls(tmp_path, monkeypatch):
+    path = str(tmp_path / 'faktura.png')
+    _invoice_image(path)
+    regions = ocr.find_regions(Image.open(path).convert('L'))
+    assert len(regions) > 2
+
+    calls = []
+    monkeypatch.setattr(ocr, 'OCR_ROI', True)
+    monkeypatch.setattr(pytesseract, 'image_to_data', _fake_image_to_data(calls))
+    text = ocr.extract_text(path)
+
+    assert calls == [ocr.TEXT_CONFIG, ocr.AMOUNT_CONFIG]
+    assert '112,34' in text and '1I2,34' not in text  # kwoty z przebiegu z białą listą
@@ -0,0 +1,35 @@
+"""
+Parsowanie warstwowe (parser_advanced): wynik kontroli spójności warstwy tekstowej
+i ponowne parsowanie tego samego IR muszą dać to samo — także przy ciasnym budżecie regex.
+Uruchomienie: python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import text_index  # noqa: E402
+from parser_advanced import TIER_TEXT, InvoiceParser  # noqa: E402
+from warmup import SAMPLE_LINES  # noqa: E402
+
+
+def test_same_ir_parsed_twice_gives_same_result(monkeypatch):
+    parser = InvoiceParser()
+    ir = parser.text_ir('\n'.join(SAMPLE_LINES), tier=TIER_TEXT)
+    parser.parse_ir(ir)
+    # Budżet na styk jednego parsowania: drugie z resztką budżetu pierwszego by go przekroczyło
+    monkeypatch.setattr(text_index, 'REGEX_BUDGET_CHARS', max(parser._index._spent.values()))
+
+    first = parser.parse_ir(ir)
+    assert not parser.consistency_problems(first)
+    second = parser.parse_ir(ir)
+    assert second == first
+    assert '_regex_over_budget' not in second
+
+
+def test_text_tier_without_billing_period_escalates():
+    parser = InvoiceParser()
+    lines = [line for line in SAMPLE_LINES if 'w okresie od' not in line]
+    result = parser.parse_ir(parser.text_ir('\n'.join(lines), tier=TIER_TEXT))
+    assert result['suma_brutto'] == 184.5
+    assert parser.consistency_problems(result) == ['brak metadanych (okres_rozliczeniowy)']
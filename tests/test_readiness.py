@@ -0,0 +1,113 @@
+"""
+/api/ready przy nasyceniu: sync worker odpowiadający na readiness sam nie parsuje,
+więc 503 musi przyjść, gdy parsują wszystkie pozostałe workery. W ASGI parsują pule
+wątków torów — próg to suma ich slotów, a nie liczba workerów.
+Uruchomienie: python -m pytest -q tests
+"""
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKERS = 3
+
+
+def _parse_until(metrics, started, release):
+    """Inny 'worker': parsowanie w toku (track_parse) aż do release"""
+    with metrics.track_parse():
+        started.set()
+        release.wait(10)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv('WEB_CONCURRENCY', str(WORKERS))
+    monkeypatch.setenv('TANIPRAD_RUN_DIR', str(tmp_path))
+    monkeypatch.delenv('TANIPRAD_READY_MAX_INFLIGHT', raising=False)
+    monkeypatch.setenv('TANIPRAD_READY_MAX_QUEUE', '0')  # bez zależności od gniazd hosta
+    import metrics
+    importlib.reload(metrics)
+    import app
+    return metrics, app.app.test_client()
+
+
+def test_ready_503_when_all_other_workers_parse(client):
+    metrics, http = client
+    ctx = multiprocessing.get_context('fork')
+    release = ctx.Event()
+    workers = []
+    try:
+        for _ in range(WORKERS - 1):
+            started = ctx.Event()
+            worker = ctx.Process(target=_parse_until, args=(metrics, started, release))
+            worker.start()
+            assert started.wait(10)
+            workers.append(worker)
+
+        response = http.get('/api/ready')
+        assert response.status_code == 503
+        body = response.get_json()
+        assert body['busy_workers'] == WORKERS - 1
+        assert body['status'] == 'saturated'
+    finally:
+        release.set()
+        for worker in workers:
+            worker.join(10)
+
+    assert http.get('/api/ready').status_code == 200
+
+
+def test_ready_200_with_a_free_worker(client):
+    metrics, http = client
+    ctx = multiprocessing.get_context('fork')
+    started, release = ctx.Event(), ctx.Event()
+    worker = ctx.Process(target=_parse_until, args=(metrics, started, release))
+    worker.start()
+    try:
+        assert started.wait(10)
+        assert http.get('/api/ready').status_code == 200
+    finally:
+        release.set()
+        worker.join(10)
+
+
+def test_asgi_threshold_from_lane_slots(client, monkeypatch):
+    metrics, _ = client
+    import asgi
+    from scheduler import Lane
+
+    assert asgi._lane_capacity(Lane('x', slots=2, timeout=1)) == WORKERS * 2
+    assert asgi._lane_capacity(Lane('x', slots=2, timeout=1, workers=3)) == 3
+
+    monkeypatch.setattr(asgi, 'READY_MAX_INFLIGHT', WORKERS * 2)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    ctx = multiprocessing.get_context('fork')
+    release = ctx.Event()
+    workers = []
+    try:
+        for _ in range(WORKERS - 1):  # sync workery byłyby już nasycone
+            started = ctx.Event()
+            worker = ctx.Process(target=_parse_until, args=(metrics, started, release))
+            worker.start()
+            assert started.wait(10)
+            workers.append(worker)
+        asyncio.run(asgi.ready({'type': 'http', 'headers': []}, None, send))
+    finally:
+        release.set()
+        for worker in workers:
+            worker.join(10)
+
+    assert sent[0]['status'] == 200
+    body = json.loads(b''.join(m.get('body', b'') for m in sent[1:]))
+    assert body['limits']['max_in_flight'] == WORKERS * 2
+    assert body['in_flight'] == WORKERS - 1
@@ -0,0 +1,31 @@
+"""
+Trwały magazyn wyników (result_cache.ResultStore): dane z faktur tylko dla właściciela
+pliku bazy, wyniki innej wersji parsera nie trafiają.
+Uruchomienie: python -m pytest -q tests
+"""
+import os
+import stat
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import ResultStore  # noqa: E402
+
+KEY = 'cd' * 32
+
+
+def test_database_files_are_owner_only(tmp_path):
+    old_umask = os.umask(0o022)
+    try:
+        store = ResultStore(str(tmp_path / 'results.db'), version=1)
+        store.put(KEY, b'{"brutto": 123.45}')
+    finally:
+        os.umask(old_umask)
+    assert store.get(KEY) == b'{"brutto": 123.45}'
+    for name in os.listdir(tmp_path):
+        assert stat.S_IMODE(os.stat(tmp_path / name).st_mode) == 0o600, name
+
+
+def test_other_parser_version_misses(tmp_path):
+    ResultStore(str(tmp_path / 'results.db'), version=1).put(KEY, b'{}')
+    assert ResultStore(str(tmp_path / 'results.db'), version=2).get(KEY) is None
@@ -0,0 +1,63 @@
+"""
+Ekstraktory na TextIndex vs parser sprzed migracji (wzorce po całym tekście): teksty
+faktur każdego dostawcy z _detect_provider (tests/fixtures/teksty_dostawcow/*.txt)
+i ich warianty układu — puste linie między etykietą a wartością ("puste2@4": dwie
+puste linie po linii 4) oraz etykieta przełamana na dwie linie ("podzial@3.1": linia 3
+przełamana po pierwszym słowie). Oczekiwane wyniki w teksty_dostawcow.json wygenerował
+stary parser; bieżący musi dać identyczne.
+Uruchomienie: python -m pytest -q tests
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser_advanced import InvoiceParser  # noqa: E402
+from parser_simple import parse_invoice_simple  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+with open(os.path.join(FIXTURES, 'teksty_dostawcow.json'), encoding='utf-8') as f:
+    GOLDEN = json.load(f)
+
+
+def _variant(text: str, tag: str) -> str:
+    """Tekst w układzie opisanym znacznikiem ('' = oryginał)"""
+    if not tag:
+        return text
+    kind, where = tag.split('@')
+    lines = text.split('\n')
+    if kind.startswith('puste'):
+        number = int(where) + 1
+        return '\n'.join(lines[:number] + [''] * int(kind[len('puste'):]) + lines[number:])
+    number, words = (int(part) for part in where.split('.'))
+    split = lines[number].split(' ')
+    return '\n'.join(lines[:number] + [' '.join(split[:words]), ' '.join(split[words:])] + lines[number + 1:])
+
+
+def _extract(text: str) -> dict:
+    parser = InvoiceParser()
+    provider = parser._detect_provider(text)
+    result = {
+        'dostawca': provider,
+        'typ': parser._detect_document_type(text, provider),
+        'faktura': parser._parse_invoice_data(text, [], provider),
+        'prognoza': parser._parse_forecast(text, [], provider),
+        'prosty': parse_invoice_simple(text),
+    }
+    return json.loads(json.dumps(result, default=str))
+
+
+@pytest.mark.parametrize('name,tag', [(name, tag) for name, cases in GOLDEN.items() for tag in cases])
+def test_same_output_as_pre_index_parser(name, tag):
+    with open(os.path.join(FIXTURES, 'teksty_dostawcow', name + '.txt'), encoding='utf-8') as f:
+        text = f.read()
+    assert _extract(_variant(text, tag)) == GOLDEN[name][tag]
+
+
+def test_every_provider_has_fixture():
+    providers = {cases['']['dostawca'] for cases in GOLDEN.values()}
+    assert providers == {'lumi_pge', 'pge', 'tauron', 'eon', 'enea', 'energa', 'unknown'}
@@ -0,0 +1,130 @@
+"""
+Indeks tekstu faktury i warstwa wyrażeń regularnych z budżetem
+Wspólna dla InvoiceParser (parser_advanced) i parse_invoice_simple (parser_simple).
+
+Wzorce uruchamiane są tylko w krótkich oknach wokół linii z kotwicą (puste linie nie
+liczą się do długości okna, jak w wyszukiwaniu po całym tekście), na wejściu
+obciętym do TANIPRAD_REGEX_MAX_WINDOW znaków, a łączna długość okien przeszukanych
+jednym wzorcem w jednym dokumencie ograniczona jest budżetem TANIPRAD_REGEX_BUDGET_CHARS
+— po jego wyczerpaniu kolejne okna są pomijane (wzorzec "nie znalazł"). Budżet liczony
+w znakach, nie w czasie: ten sam dokument daje zawsze ten sam wynik, niezależnie od
+obciążenia hosta. Wzorce, którym zabrakło budżetu, trafiają do over_budget — taki
+wynik nie jest zapisywany w cache. Razem z wzorcami bez kwadratowego cofania
+(bench_regex.py) czas parsowania rośnie liniowo.
+"""
+import os
+import re
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List
+
+REGEX_BUDGET_CHARS = int(os.environ.get('TANIPRAD_REGEX_BUDGET_CHARS', '200000'))
+REGEX_MAX_WINDOW = int(os.environ.get('TANIPRAD_REGEX_MAX_WINDOW', '4000'))
+BLANK_LINES_MAX = 3  # więcej pustych linii z rzędu zamyka okno wzorca
+
+
+def _position(window: str, first: int, offset: int):
+    """(numer linii w dokumencie, kolumna) dla pozycji w oknie zaczynającym się linią first"""
+    line_start = window.rfind('\n', 0, offset) + 1
+    return first + window.count('\n', 0, offset), offset - line_start
+
+
+class TextIndex:
+    """Indeks tekstu dokumentu budowany raz: linie, linie małymi literami i mapa
+    słowo kluczowe → numery linii (wypełniana przy pierwszym pytaniu o dane słowo).
+    Ekstraktory szukają wzorców tylko w liniach z kotwicą zamiast w całym tekście."""
+
+    __slots__ = ('text', 'lines', 'lower', '_lower_text', '_starts', '_anchors', '_spent', 'over_budget')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.lines = text.split('\n')
+        self._lower_text = text.lower()
+        self.lower = self._lower_text.split('\n')
+        self._starts = list(accumulate((len(line) + 1 for line in self.lower[:-1]), initial=0))
+        self._anchors = {}  # słowo kluczowe -> numery linii
+        self._spent = {}    # skompilowany wzorzec -> znaki przeszukane w tym dokumencie
+        self.over_budget = []  # wzorce, którym zabrakło budżetu
+
+    def reset_budget(self):
+        """Nowy przebieg parsowania tego samego tekstu dostaje pełny budżet (kotwice zostają)"""
+        self._spent = {}
+        self.over_budget = []
+
+    def _iter_lines(self, keyword: str):
+        """Numery linii z keyword, leniwie (search zwykle kończy na pierwszej kotwicy)"""
+        numbers = self._anchors.get(keyword)
+        if numbers is not None:
+            yield from numbers
+            return
+        numbers = []
+        pos = self._lower_text.find(keyword)
+        while pos >= 0:
+            number = bisect_right(self._starts, pos) - 1
+            numbers.append(number)
+            yield number
+            if number + 1 >= len(self._starts):
+                break
+            pos = self._lower_text.find(keyword, self._starts[number + 1])
+        self._anchors[keyword] = numbers
+
+    def lines_with(self, keyword: str) -> List[int]:
+        """Numery linii zawierających keyword (małymi literami; dopasowanie podciągu jak `in`)"""
+        if keyword not in self._anchors:
+            for _ in self._iter_lines(keyword):
+                pass
+        return self._anchors[keyword]
+
+    def contains(self, keyword: str) -> bool:
+        return keyword in self._lower_text
+
+    def _window(self, number: int, span: int):
+        """(pierwsza linia, koniec) okna: `span` niepustych linii przed kotwicą i po niej.
+        Puste linie nie liczą się do span — etykieta i wartość rozdzielone pustymi liniami
+        lub etykieta przełamana na dwie linie mieszczą się w oknie jak w całym tekście;
+        więcej niż BLANK_LINES_MAX pustych linii z rzędu zamyka okno."""
+        bounds = []
+        for step, edge in ((-1, -1), (1, len(self.lines))):
+            last, needed, blank = number, span, 0
+            line = number + step
+            while needed and line != edge:
+                if self.lines[line].strip():
+                    last, needed, blank = line, needed - 1, 0
+                else:
+                    blank += 1
+                    if blank > BLANK_LINES_MAX:
+                        break
+                line += step
+            bounds.append(last)
+        return bounds[0], bounds[1] + 1
+
+    def finditer(self, pattern, anchor: str, flags: int = 0, span: int = 2):
+        """Dopasowania wzorca w oknach wokół linii z kotwicą (kolejność jak w tekście).
+        Okno to linia kotwicy i `span` niepustych linii przed nią i po niej (wzorce
+        wielowierszowe, etykiety przełamane na dwie linie). Okna sąsiednich kotwic
+        zachodzą na siebie — dopasowanie zwracane jest raz i, jak w re.finditer,
+        kolejne nie nachodzi na poprzednie."""
+        compiled = re.compile(pattern, flags)
+        frontier = (-1, 0)  # (linia, kolumna) końca ostatniego zwróconego dopasowania
+        for number in self._iter_lines(anchor):
+            first, end = self._window(number, span)
+            window = '\n'.join(self.lines[first:end])[:REGEX_MAX_WINDOW]
+            spent = self._spent.get(compiled, 0) + len(window)
+            if spent > REGEX_BUDGET_CHARS:
+                if compiled.pattern not in self.over_budget:
+                    self.over_budget.append(compiled.pattern)
+                print(f"⏱️  Budżet regex wyczerpany ({REGEX_BUDGET_CHARS} znaków): {compiled.pattern[:60]}")
+                return
+            self._spent[compiled] = spent
+            matches = []
+            for match in compiled.finditer(window):
+                start = _position(window, first, match.start())
+                if start < frontier:
+                    continue
+                frontier = max(_position(window, first, match.end()), (start[0], start[1] + 1))
+                matches.append(match)
+            yield from matches
+
+    def search(self, pattern, anchor: str, flags: int = 0, span: int = 2):
+        """Pierwsze dopasowanie wzorca (jak re.search) w oknach wokół kotwic albo None"""
+        return next(self.finditer(pattern, anchor, flags, span), None)
@@ -0,0 +1,102 @@
+"""
+Rozgrzewka parsera faktur
+Parsuje wbudowaną przykładową fakturę PDF, żeby załadować pdfplumber/pdfminer,
+metryki fontów, skompilowane wyrażenia regularne i ścieżki wyszukiwania tabel.
+Wywoływana raz w procesie master gunicorna (tryb preload) — workery dziedziczą
+rozgrzany stan przez fork.
+"""
+import io
+import time
+
+# Przykładowa faktura (fikcyjne dane) — tekst w formacie E.ON, tabela z ramkami
+SAMPLE_LINES = [
+    'E.ON Energie Polska',
+    'Faktura VAT nr 000000000000 z dnia 01.12.2025',
+    'Rozliczenie sprzedaży i dystrybucji energii elektrycznej w okresie od 01.11.2025 do 30.11.2025',
+    'Sprzedaż energii elektrycznej',
+    'Energia czynna 200 kWh 0,50 100,00 23 23,00 123,00',
+    'Dystrybucja energii elektrycznej',
+    'Opłata sieciowa zmienna 200 kWh 0,25 50,00 23 11,50 61,50',
+    'Razem',
+    'Należność za faktyczne zużycie 150,00 23 34,50 184,50',
+    'Zużycie: 200 kWh',
+]
+SAMPLE_TABLE = [
+    ['Pozycja', 'Wartość netto', 'Wartość brutto'],
+    ['Energia czynna', '100,00', '123,00'],
+    ['Opłata sieciowa zmienna', '50,00', '61,50'],
+]
+
+# Polskie znaki spoza WinAnsiEncoding — mapowane przez /Differences na kody 128+
+_GLYPHS = {
+    'ą': 'aogonek', 'ć': 'cacute', 'ę': 'eogonek', 'ł': 'lslash', 'ń': 'nacute',
+    'ś': 'sacute', 'ź': 'zacute', 'ż': 'zdotaccent', 'Ł': 'Lslash', 'Ś': 'Sacute',
+    'Ż': 'Zdotaccent', 'Ź': 'Zacute', 'ó': 'oacute', 'Ó': 'Oacute',
+}
+_CODES = {ch: 128 + i for i, ch in enumerate(_GLYPHS)}
+
+
+def _pdf_string(text: str) -> bytes:
+    raw = bytes(_CODES.get(ch, ord(ch) if ord(ch) < 128 else ord('?')) for ch in text)
+    return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def build_sample_pdf() -> bytes:
+    """Buduje jednostronicowy PDF z tekstem faktury i tabelą z liniami"""
+    ops = [b'BT /F1 9 Tf 12 TL 40 800 Td']
+    ops += [_pdf_string(line) + b' Tj T*' for line in SAMPLE_LINES]
+    ops.append(b'ET')
+
+    # Tabela: ramki komórek (linie dla table finder pdfplumbera) + tekst komórek
+    col_x = [40, 240, 380, 520]
+    row_h = 16
+    top = 620
+    for r, row in enumerate(SAMPLE_TABLE):
+        y = top - r * row_h
+        for c, cell in enumerate(row):
+            ops.append(b'%d %d %d %d re S' % (col_x[c], y - row_h, col_x[c + 1] - col_x[c], row_h))
+            ops.append(b'BT /F1 9 Tf %d %d Td ' % (col_x[c] + 3, y - row_h + 4) + _pdf_string(cell) + b' Tj ET')
+    content = b'\n'.join(ops)
+
+    differences = b'[128 ' + b' '.join(b'/' + g.encode() for g in _GLYPHS.values()) + b']'
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+        b'/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding '
+        b'<< /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences ' + differences + b' >> >>',
+        b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream',
+    ]
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for num, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % num + obj + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def warm_parser() -> float:
+    """Rozgrzewa parser: importy, regexy, cache fontów pdfminer. Zwraca czas w sekundach."""
+    start = time.perf_counter()
+
+    from parser_advanced import InvoiceParser
+    from parser_simple import parse_invoice_simple
+
+    result = InvoiceParser().parse_pdf(io.BytesIO(build_sample_pdf()))
+    parse_invoice_simple('\n'.join(SAMPLE_LINES))
+
+    elapsed = time.perf_counter() - start
+    print(f"🔥 Parser rozgrzany w {elapsed * 1000:.0f} ms "
+          f"(próbka: {result.get('sprzedawca')}, {len(result.get('pozycje', []))} pozycje)")
+    return elapsed
+
+
+if __name__ == '__main__':
+    warm_parser()